@@ -0,0 +1,466 @@
+"""
+
+Performance benchmarks of the candidate classifier.
+
+Generates synthetic candidate directories that follow the FETCH naming
+convention, drives CandClassifier on the offscreen Qt platform and
+saves the timings as JSON, so that the results of different versions
+can be compared.
+
+Usage:
+
+    python benchmarks/bench_classifier.py --sizes 1000 10000 -o bench.json
+
+"""
+
+import argparse as ap
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from glob import glob
+from numpy import asarray, percentile
+from numpy.random import default_rng
+from time import perf_counter
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QColor, QImage
+from PyQt5.QtTest import QTest
+from PyQt5.QtWidgets import QApplication
+
+from jester.classifier import CandClassifier
+from jester.labels import RFI
+
+logger = logging.getLogger(__name__)
+
+EXTENSION = "png"
+OUTPUT = "bench_results.csv"
+
+
+def cand_names(count, seed=0):
+
+    """
+
+    Generate candidate file names in the FETCH naming convention.
+
+    Parameters:
+
+        count: int
+            Number of candidates
+
+        seed: int
+            Random seed, the same seed gives the same names
+
+    Returns:
+
+        names: list
+            mjd_<mjd>_dm_<dm>_beam_<beam>_fetch_combined.png names
+
+    """
+
+    rng = default_rng(seed)
+    mjds = 58958.0 + rng.random(count) * 2.0
+    dms = rng.uniform(5.0, 3000.0, count)
+    beams = rng.integers(0, 390, count)
+
+    return [f"mjd_{mjd:.10f}_dm_{dm:.3f}_beam_{beam}_fetch_combined.{EXTENSION}"
+            for mjd, dm, beam in zip(mjds, dms, beams)]
+
+
+def template_plots(work_dir):
+
+    """
+
+    Return the plots the synthetic candidates are made from.
+
+    Uses the example plots shipped with the repository, so that the
+    decoding cost is realistic, and falls back to a generated noise
+    plot if they are not available.
+
+    """
+
+    templates = sorted(glob(os.path.join(REPO_DIR, "examples",
+                                         "*." + EXTENSION)))
+
+    if templates:
+        return templates
+
+    template = os.path.join(work_dir, "template." + EXTENSION)
+    if not os.path.exists(template):
+        rng = default_rng(0)
+        image = QImage(1000, 500, QImage.Format_RGB32)
+        for y in range(0, 500, 5):
+            for x in range(0, 1000, 5):
+                level = int(rng.integers(0, 256))
+                image.setPixelColor(x, y, QColor(level, level, level))
+        image.save(template)
+
+    return [template]
+
+
+def make_directory(work_dir, count):
+
+    """
+
+    Create, or reuse, a synthetic candidate directory.
+
+    Candidate files are hard links to the template plots where the file
+    system allows it, so even a million candidates take almost no space.
+
+    Parameters:
+
+        work_dir: str
+            Directory holding all the synthetic data sets
+
+        count: int
+            Number of candidates
+
+    Returns:
+
+        directory: str
+            Directory with `count` candidate plots
+
+    """
+
+    directory = os.path.join(work_dir, f"cands_{count}")
+    names = cand_names(count)
+
+    if os.path.isdir(directory):
+        present = sum(1 for name in os.listdir(directory)
+                      if name.endswith("." + EXTENSION))
+        if present == count:
+            return directory
+        shutil.rmtree(directory)
+
+    os.makedirs(directory)
+    templates = template_plots(work_dir)
+
+    for idx, name in enumerate(names):
+        template = templates[idx % len(templates)]
+        target = os.path.join(directory, name)
+        try:
+            os.link(template, target)
+        except OSError:
+            shutil.copyfile(template, target)
+
+    return directory
+
+
+def reset_directory(directory):
+
+    """
+
+    Remove the labels and the sidecar index left by a previous run.
+
+    """
+
+    for name in os.listdir(directory):
+        if name.startswith(".jester_index") or name.startswith(OUTPUT):
+            full_name = os.path.join(directory, name)
+            if os.path.isdir(full_name):
+                shutil.rmtree(full_name)
+            else:
+                os.remove(full_name)
+
+
+def summarise(seconds):
+
+    seconds = asarray(seconds)
+
+    if seconds.size == 0:
+        return {"count": 0}
+
+    return {
+        "count": int(seconds.size),
+        "total_s": float(seconds.sum()),
+        "mean_ms": float(seconds.mean() * 1e3),
+        "p50_ms": float(percentile(seconds, 50) * 1e3),
+        "p95_ms": float(percentile(seconds, 95) * 1e3),
+        "max_ms": float(seconds.max() * 1e3),
+    }
+
+
+def wait_until(app, condition, timeout):
+
+    start = perf_counter()
+
+    while not condition():
+        if perf_counter() - start > timeout:
+            raise TimeoutError(f"Timed out after {timeout} s")
+        app.processEvents()
+
+    return perf_counter() - start
+
+
+def start_classifier(app, directory, cache_dir, timeout):
+
+    """
+
+    Start the classifier and time how long it takes to become usable.
+
+    Returns:
+
+        classifier: CandClassifier
+            Classifier with all the candidates loaded
+
+        timings: dict
+            Time to the first plot on screen and to the fully loaded
+            and sorted candidate list
+
+    """
+
+    start = perf_counter()
+    classifier = CandClassifier(directory, OUTPUT, EXTENSION, resume=False,
+                                disk_cache_dir=cache_dir)
+    constructed = perf_counter() - start
+
+    wait_until(app, lambda: classifier._plot_label.pixmap() is not None
+               and not classifier._plot_label.pixmap().isNull(), timeout)
+    first_plot = perf_counter() - start
+    wait_until(app, lambda: classifier._loaded, timeout)
+    loaded = perf_counter() - start
+
+    return classifier, {
+        "construct_s": constructed,
+        "first_plot_s": first_plot,
+        "loaded_s": loaded,
+    }
+
+
+def press(app, classifier, key, count):
+
+    times = []
+
+    for _ in range(count):
+        start = perf_counter()
+        QTest.keyClick(classifier, key)
+        app.processEvents()
+        times.append(perf_counter() - start)
+
+    return times
+
+
+def bench_navigation(app, classifier, steps):
+
+    classifier._show_cand(0)
+
+    return {
+        "next": summarise(press(app, classifier, Qt.Key_X, steps)),
+        "previous": summarise(press(app, classifier, Qt.Key_Z, steps)),
+        "skip_forward": summarise(press(app, classifier, Qt.Key_PageUp,
+                                        steps // 5)),
+        "skip_back": summarise(press(app, classifier, Qt.Key_PageDown,
+                                     steps // 5)),
+    }
+
+
+def bench_labelling(app, classifier, steps):
+
+    classifier._show_cand(0)
+    label_times = []
+    for key in (Qt.Key_A, Qt.Key_S, Qt.Key_D):
+        label_times.extend(press(app, classifier, key, steps // 3))
+
+    # Go back and label the same candidates again, which takes the
+    # _replace_csv path
+    classifier._show_cand(0)
+    relabel_times = []
+    for key in (Qt.Key_D, Qt.Key_A, Qt.Key_S):
+        relabel_times.extend(press(app, classifier, key, steps // 3))
+
+    # The whole correction, until it is written and synced to the disk
+    # by the label writer thread
+    durable_times = []
+    for idx in range(steps):
+        class_type = "rfi" if classifier._label_state.get(idx) != RFI \
+            else "cand"
+        start = perf_counter()
+        classifier._update_list(idx, class_type)
+        classifier._label_store.sync()
+        durable_times.append(perf_counter() - start)
+
+    return {
+        "label": summarise(label_times),
+        "relabel": summarise(relabel_times),
+        "relabel_synced": summarise(durable_times),
+    }
+
+
+def bench_stats(app, classifier, repeats):
+
+    start = perf_counter()
+    stats_window = classifier._get_stats_window()
+    stats_window.show()
+    app.processEvents()
+    first_open = perf_counter() - start
+
+    update_times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        stats_window._update(classifier._class_hists)
+        stats_window._redraw()
+        app.processEvents()
+        update_times.append(perf_counter() - start)
+
+    dist_times = []
+    for source in ("DM", "MJD"):
+        start = perf_counter()
+        stats_window.limits_choice.setCurrentText(source)
+        app.processEvents()
+        dist_times.append(perf_counter() - start)
+
+    stats_window.hide()
+
+    return {
+        "first_open_s": first_open,
+        "class_histograms": summarise(update_times),
+        "distribution": summarise(dist_times),
+    }
+
+
+def bench_filter(app, classifier):
+
+    stats_window = classifier._get_stats_window()
+    stats_window.filter_mode.setCurrentText("Remove")
+    stats_window.limits_choice.setCurrentText("DM")
+    classifier._show_cand(0)
+    before = classifier._total_cands
+
+    # Remove the lowest tenth of the DM range
+    stats_window.start_limit.setText("0")
+    stats_window.end_limit.setText("300")
+
+    start = perf_counter()
+    classifier._apply_filter()
+    app.processEvents()
+    elapsed = perf_counter() - start
+    after = classifier._total_cands
+
+    start = perf_counter()
+    classifier._undo_filter()
+    app.processEvents()
+    undo_elapsed = perf_counter() - start
+
+    return {
+        "apply_filter_s": elapsed,
+        "undo_filter_s": undo_elapsed,
+        "before": before,
+        "after": after,
+    }
+
+
+def run_size(app, work_dir, count, steps, timeout):
+
+    directory = make_directory(work_dir, count)
+    reset_directory(directory)
+    cache_dir = os.path.join(work_dir, "plot_cache")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    logger.info(f"Benchmarking {count} candidates in {directory}")
+
+    result = {"candidates": count}
+
+    # Cold start scans the directory, warm start uses the sidecar index
+    classifier, result["startup_cold"] = start_classifier(app, directory,
+                                                          cache_dir, timeout)
+    classifier.close()
+    wait_until(app, lambda: os.path.exists(os.path.join(
+        directory, f".jester_index_{EXTENSION}", "meta.json")), timeout)
+
+    classifier, result["startup_warm"] = start_classifier(app, directory,
+                                                          cache_dir, timeout)
+    # Without a rescan the sidecar index was up to date
+    result["startup_warm"]["sidecar_fresh"] = classifier._scanner is None
+
+    steps = min(steps, count)
+    result["navigation"] = bench_navigation(app, classifier, steps)
+    result["labelling"] = bench_labelling(app, classifier, steps)
+    result["stats"] = bench_stats(app, classifier, min(steps, 50))
+    result["filter"] = bench_filter(app, classifier)
+    result["latency"] = classifier._timings.summary()
+    result["prefetch"] = classifier._prefetcher.stats()
+
+    classifier.close()
+    app.processEvents()
+    reset_directory(directory)
+
+    return result
+
+
+def version():
+
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"],
+                              cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+
+    parser = ap.ArgumentParser(description="Benchmark the MeerTRAP"
+                               + " candidate classifier")
+
+    parser.add_argument("--sizes", help="Numbers of synthetic candidates",
+                        required=False,
+                        type=int,
+                        nargs="+",
+                        default=[1000, 10000])
+    parser.add_argument("--steps", help="Number of key presses in the"
+                        + " navigation and labelling benchmarks",
+                        required=False,
+                        type=int,
+                        default=300)
+    parser.add_argument("-w", "--work-dir", help="Directory for the synthetic"
+                        + " data sets, reused between runs",
+                        required=False,
+                        type=str,
+                        default=os.path.join(tempfile.gettempdir(),
+                                             "jester_bench"))
+    parser.add_argument("-o", "--output", help="Output JSON file",
+                        required=False,
+                        type=str,
+                        default="bench.json")
+    parser.add_argument("--timeout", help="Give up on a single step after"
+                        + " this many seconds",
+                        required=False,
+                        type=float,
+                        default=600.0)
+
+    arguments = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    os.makedirs(arguments.work_dir, exist_ok=True)
+    # Keep the scaled plot cache of the benchmarks away from the real one
+    os.environ["XDG_CACHE_HOME"] = os.path.join(arguments.work_dir, "xdg")
+
+    app = QApplication([])
+
+    results = {
+        "version": version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "qt_platform": os.environ["QT_QPA_PLATFORM"],
+        "runs": [run_size(app, arguments.work_dir, count, arguments.steps,
+                          arguments.timeout) for count in arguments.sizes],
+    }
+
+    with open(arguments.output, "w") as of:
+        json.dump(results, of, indent=2)
+
+    logger.info(f"Results saved in {arguments.output}")
+
+
+if __name__ == "__main__":
+    main()
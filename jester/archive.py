@@ -0,0 +1,376 @@
+import json
+import logging
+import tarfile
+import zlib
+
+from numpy import asarray, int64, load, save, uint8
+from os import O_RDONLY, close, makedirs, open as os_open, path, pread
+from os import replace, stat
+from threading import Lock
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = (".tar", ".zip")
+MEMBERS_VERSION = 1
+
+# How the data of a member is stored
+TAR_MEMBER = 0
+ZIP_STORED_MEMBER = 1
+ZIP_DEFLATED_MEMBER = 2
+
+_ZIP_KINDS = {
+    ZIP_STORED: ZIP_STORED_MEMBER,
+    ZIP_DEFLATED: ZIP_DEFLATED_MEMBER,
+}
+
+# Size of the fixed part of the zip local file header
+_ZIP_HEADER = 30
+
+
+def is_archive(file_name):
+    return (file_name.lower().endswith(ARCHIVE_EXTENSIONS)
+            and path.isfile(file_name))
+
+
+def data_directory(directory):
+
+    """
+
+    Return the directory the results and other outputs are saved in.
+
+    That is the input directory itself, or the directory containing
+    the archive for archive inputs.
+
+    """
+
+    if is_archive(directory):
+        return path.dirname(path.abspath(directory))
+
+    return directory
+
+
+def members_path(archive):
+    return f"{archive}.jester_members"
+
+
+class MemberIndex:
+
+    """
+
+    Offsets of the candidate plots inside a tar or zip archive.
+
+    The archive is walked once to find where the data of every member
+    starts, after which any plot is read with a single positioned read,
+    without extracting anything. Members are looked up by their base
+    name, which is also the name the labels are saved under.
+
+    Parameters:
+
+        archive: str
+            Path to the archive
+
+        names: list
+            Member base names
+
+        offsets: array_like
+            Offset of the member data in the archive. Offset of the local
+            file header for zip members
+
+        sizes: array_like
+            Size of the stored, possibly compressed, member data
+
+        kinds: array_like
+            How every member is stored, e.g. TAR_MEMBER
+
+    """
+
+    def __init__(self, archive, names, offsets, sizes, kinds):
+
+        self._archive = archive
+        self._names = list(names)
+        self._offsets = asarray(offsets, dtype=int64)
+        self._sizes = asarray(sizes, dtype=int64)
+        self._kinds = asarray(kinds, dtype=uint8)
+        self._positions = {name: idx for idx, name in enumerate(self._names)}
+
+        if len(self._positions) != len(self._names):
+            logger.warning(f"{archive} has members with the same name in"
+                           + " different directories, only the last one"
+                           + " can be viewed")
+
+        self._fd = None
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    @classmethod
+    def build(cls, archive):
+
+        """
+
+        Walk the archive and record the offset of every member.
+
+        Compressed tar files cannot be read by offset and raise
+        a ValueError.
+
+        """
+
+        names, offsets, sizes, kinds = [], [], [], []
+
+        if archive.lower().endswith(".zip"):
+            with ZipFile(archive) as zf:
+                for info in zf.infolist():
+                    if info.is_dir():
+                        continue
+                    if info.compress_type not in _ZIP_KINDS:
+                        logger.warning(f"Skipping {info.filename}, its"
+                                       + " compression is not supported")
+                        continue
+                    names.append(path.basename(info.filename))
+                    offsets.append(info.header_offset)
+                    sizes.append(info.compress_size)
+                    kinds.append(_ZIP_KINDS[info.compress_type])
+        else:
+            try:
+                tar = tarfile.open(archive, "r:")
+            except tarfile.ReadError as exc:
+                raise ValueError(f"Cannot read {archive} by offset, only"
+                                 + " uncompressed tar files are supported:"
+                                 + f" {exc}")
+
+            with tar:
+                for member in tar:
+                    if member.isfile():
+                        names.append(path.basename(member.name))
+                        offsets.append(member.offset_data)
+                        sizes.append(member.size)
+                        kinds.append(TAR_MEMBER)
+                    # Do not keep millions of members in memory
+                    tar.members = []
+
+        return cls(archive, names, offsets, sizes, kinds)
+
+    def save(self):
+
+        sidecar = members_path(self._archive)
+
+        try:
+            makedirs(sidecar, exist_ok=True)
+
+            with open(path.join(sidecar, "names.txt.tmp"), "w",
+                      encoding="utf-8") as nf:
+                nf.write("\n".join(self._names))
+            replace(path.join(sidecar, "names.txt.tmp"),
+                    path.join(sidecar, "names.txt"))
+
+            for column in ("offsets", "sizes", "kinds"):
+                with open(path.join(sidecar, column + ".npy.tmp"),
+                          "wb") as cf:
+                    save(cf, getattr(self, "_" + column))
+                replace(path.join(sidecar, column + ".npy.tmp"),
+                        path.join(sidecar, column + ".npy"))
+
+            archive_stat = stat(self._archive)
+            meta = {
+                "version": MEMBERS_VERSION,
+                "count": len(self._names),
+                "size": archive_stat.st_size,
+                "mtime_ns": archive_stat.st_mtime_ns,
+            }
+            with open(path.join(sidecar, "meta.json.tmp"), "w") as mf:
+                json.dump(meta, mf)
+            replace(path.join(sidecar, "meta.json.tmp"),
+                    path.join(sidecar, "meta.json"))
+        except OSError as exc:
+            logger.warning(f"Could not save the member index in {sidecar}:"
+                           + f" {exc}")
+
+    @classmethod
+    def load(cls, archive):
+
+        """
+
+        Load the saved member index, None if it is missing or outdated.
+
+        """
+
+        sidecar = members_path(archive)
+
+        try:
+            with open(path.join(sidecar, "meta.json")) as mf:
+                meta = json.load(mf)
+
+            archive_stat = stat(archive)
+            if (meta["version"] != MEMBERS_VERSION
+                    or meta["size"] != archive_stat.st_size
+                    or meta["mtime_ns"] != archive_stat.st_mtime_ns):
+                return None
+
+            with open(path.join(sidecar, "names.txt"),
+                      encoding="utf-8") as nf:
+                names = nf.read()
+            names = names.split("\n") if names else []
+
+            columns = [load(path.join(sidecar, column + ".npy"))
+                       for column in ("offsets", "sizes", "kinds")]
+        except (OSError, ValueError, KeyError) as exc:
+            logger.debug(f"No usable member index in {sidecar}: {exc}")
+            return None
+
+        if any(column.shape[0] != len(names) for column in columns):
+            logger.warning(f"Member index in {sidecar} is corrupted")
+            return None
+
+        return cls(archive, names, *columns)
+
+    def names(self, extension):
+
+        """
+
+        Return the names of the candidate plots, in the archive order.
+
+        """
+
+        return [name for name in self._names
+                if name.endswith(extension) and not name.startswith(".")]
+
+    def read(self, name):
+
+        """
+
+        Read the data of a single member.
+
+        Uses positioned reads on a shared file descriptor, so it can be
+        called from many decoding threads at once.
+
+        Parameters:
+
+            name: str
+                Member base name
+
+        Returns:
+
+            data: bytes
+                Uncompressed member data
+
+        """
+
+        idx = self._positions.get(name)
+        if idx is None:
+            raise FileNotFoundError(f"No {name} in {self._archive}")
+
+        with self._lock:
+            if self._fd is None:
+                self._fd = os_open(self._archive, O_RDONLY)
+
+        offset = int(self._offsets[idx])
+        size = int(self._sizes[idx])
+        kind = self._kinds[idx]
+
+        if kind != TAR_MEMBER:
+            header = pread(self._fd, _ZIP_HEADER, offset)
+            offset += (_ZIP_HEADER + int.from_bytes(header[26:28], "little")
+                       + int.from_bytes(header[28:30], "little"))
+
+        data = pread(self._fd, size, offset)
+
+        if kind == ZIP_DEFLATED_MEMBER:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+
+        return data
+
+    def close(self):
+
+        with self._lock:
+            if self._fd is not None:
+                close(self._fd)
+                self._fd = None
+
+
+_archives = {}
+_archives_lock = Lock()
+
+
+def open_archive(archive):
+
+    """
+
+    Return the member index of an archive.
+
+    The index is built on the first use, saved next to the archive and
+    shared by everything reading from the same archive afterwards.
+
+    """
+
+    archive = path.abspath(archive)
+
+    with _archives_lock:
+        members = _archives.get(archive)
+        if members is None:
+            members = MemberIndex.load(archive)
+            if members is None:
+                logger.info(f"Indexing the members of {archive}")
+                members = MemberIndex.build(archive)
+                members.save()
+            _archives[archive] = members
+
+    return members
+
+
+def read_member(file_name):
+
+    """
+
+    Read a candidate plot given as <archive>/<member name>.
+
+    Returns:
+
+        data: bytes or None
+            Member data, None if the file is not inside an archive
+
+    """
+
+    archive = path.dirname(file_name)
+
+    if not archive.lower().endswith(ARCHIVE_EXTENSIONS) \
+            or not path.isfile(archive):
+        return None
+
+    return open_archive(archive).read(path.basename(file_name))
+
+
+def plot_exists(file_name):
+
+    """
+
+    Check whether a candidate plot exists, on disk or inside an archive.
+
+    """
+
+    archive = path.dirname(file_name)
+
+    if archive.lower().endswith(ARCHIVE_EXTENSIONS) and path.isfile(archive):
+        return path.basename(file_name) in open_archive(archive)
+
+    return path.isfile(file_name)
+
+
+def source_file(file_name):
+
+    """
+
+    Return the file on disk that holds a candidate plot.
+
+    """
+
+    archive = path.dirname(file_name)
+
+    if archive.lower().endswith(ARCHIVE_EXTENSIONS) and path.isfile(archive):
+        return archive
+
+    return file_name
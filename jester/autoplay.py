@@ -0,0 +1,153 @@
+from math import ceil
+from time import monotonic
+
+from PyQt5.QtCore import QObject, Qt, QTimer, pyqtSignal
+
+
+class AutoPlayer(QObject):
+
+    """
+
+    Frame-paced auto view.
+
+    Frames are scheduled against a monotonic clock rather than a fixed
+    timer interval, so slow frames do not push back all the following
+    ones. A frame is only shown once its plot has been decoded: if it is
+    not ready on time, the current plot is held and the frame is counted
+    as dropped. A frame shown more than one frame period after it was
+    due is counted as late and the schedule restarts from it, so that we
+    never rush through several candidates to catch up.
+
+    Parameters:
+
+        ready: callable
+            Returns True if the next frame can be shown without waiting
+
+        lookahead: float
+            Time in seconds the decode-ahead buffer should cover
+
+    """
+
+    frame = pyqtSignal()
+
+    def __init__(self, ready=None, lookahead=0.5):
+
+        super().__init__()
+
+        self._ready = ready or (lambda: True)
+        self._lookahead = lookahead
+        self._rate = 1.0
+        self._running = False
+        self._start = 0.0
+        self._frame_no = 0
+        self._waiting = False
+
+        self._timer = QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.timeout.connect(self._tick)
+
+        self._reset_stats()
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def buffer_size(self, rate=None):
+
+        """
+
+        Number of plots that have to be decoded ahead for the given rate.
+
+        """
+
+        return int(ceil((rate or self._rate) * self._lookahead)) + 1
+
+    def start(self, rate):
+
+        self._reset_stats()
+        self._running = True
+        self.set_rate(rate)
+
+    def stop(self):
+
+        self._running = False
+        self._timer.stop()
+
+    def set_rate(self, rate):
+
+        self._rate = float(rate)
+
+        if self._running:
+            self._anchor(monotonic())
+            self._schedule()
+
+    def stats(self):
+
+        elapsed = monotonic() - self._started
+
+        return {
+            "frames": self.frames,
+            "late": self.late,
+            "dropped": self.dropped,
+            "requested_rate": self._rate,
+            "achieved_rate": self.frames / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def _reset_stats(self):
+
+        self.frames = 0
+        self.late = 0
+        self.dropped = 0
+        self._started = monotonic()
+
+    def _anchor(self, now):
+
+        self._start = now
+        self._frame_no = 0
+
+    def _due(self):
+        return self._start + (self._frame_no + 1) / self._rate
+
+    def _schedule(self, delay=None):
+
+        if delay is None:
+            delay = self._due() - monotonic()
+
+        self._timer.start(max(int(delay * 1000), 0))
+
+    def _tick(self):
+
+        if not self._running:
+            return
+
+        now = monotonic()
+        due = self._due()
+
+        # Timers can fire slightly early
+        if now < due - 0.001:
+            self._schedule()
+            return
+
+        if not self._ready():
+            if not self._waiting:
+                self.dropped += 1
+                self._waiting = True
+            self._schedule(0.002)
+            return
+
+        self._waiting = False
+        self.frame.emit()
+        self.frames += 1
+        self._frame_no += 1
+
+        if now - due > 1.0 / self._rate:
+            self.late += 1
+            self._anchor(now)
+
+        if self._running:
+            self._schedule()
@@ -1,48 +1,159 @@
-import asyncio
-from csv import reader, writer
-from glob import glob
-from numpy import array, histogram, linspace
+import logging
+
+from csv import reader
+from threading import Event, Thread
+from time import monotonic, perf_counter
+from numpy import arange, argsort, asarray, delete
 from os import path
-from os.path import basename, isfile
-from shutil import move
 
-from PyQt5.QtCore import QSize
+from PyQt5.QtCore import QSize, pyqtSignal
 from PyQt5.QtGui import QPixmap
 
-from PyQt5.QtWidgets import QWidget, QCheckBox, QSpinBox
-from PyQt5.QtWidgets import QComboBox, QLabel, QLineEdit, QMessageBox
+from PyQt5.QtWidgets import QApplication, QWidget, QCheckBox, QSpinBox
+from PyQt5.QtWidgets import QLabel, QLineEdit, QMessageBox
 from PyQt5.QtWidgets import QPushButton
 from PyQt5.QtWidgets import QHBoxLayout, QVBoxLayout
-from PyQt5.QtCore import Qt, QTimer
-
-from pyqtgraph import mkPen, PlotWidget
+from PyQt5.QtCore import QEvent, Qt, QTimer
+
+from jester.archive import data_directory
+from jester.autoplay import AutoPlayer
+from jester.cluster import find_clusters, group_members
+from jester.decode import DiskCache, PlotDecoder, default_cache_directory
+from jester.filters import BeamFilter, FilterStack, FILTER_COLUMNS
+from jester.filters import RangeFilter, RegionFilter, parse_beams
+from jester.grid import GridWindow
+from jester.index import CandIndex, load_sidecar, restamp_sidecar
+from jester.index import save_sidecar
+from jester.labels import open_label_store, LabelState, UNLABELLED
+from jester.labels import RFI, CANDIDATE, KNOWN
+from jester.loader import DirectoryScanner
+from jester.phash import compute_hashes, hash_index, load_hashes, save_hashes
+from jester.prefetch import Prefetcher
+from jester.share import ChunkClaims, labelled_names, labeller_output
+from jester.share import merge_outputs
+from jester.stats import ClassHistograms, DensityMap, distribution
+from jester.timing import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+CLASS_LABELS = {"rfi": RFI, "known": KNOWN, "cand": CANDIDATE}
 
 class CandClassifier(QWidget):
 
-    def __init__(self, directory, output, extension):
+    _distributions_ready = pyqtSignal(object, object)
+
+    def __init__(self, directory, output, extension, prefetch_ahead=8,
+                 prefetch_behind=4, cache_size=256, label_store="csv",
+                 resume=None, disk_cache_size=1024, disk_cache_dir=None,
+                 grid_size=(4, 4), timings=None, timings_file=None,
+                 scores=None, clustering=None, family_radius=None,
+                 share=None, sync_interval=2.0):
 
         super().__init__()
 
+        # Until the first plot is on the screen
+        self._start_time = perf_counter()
+
         self._directory = directory
+        # Results go next to the archive for the archive inputs
+        self._output_directory = data_directory(directory)
+        self._extension = extension
         self._output_file_name = output
-        self._cand_plots = sorted(glob(path.join(directory, "*" + extension)))
-        self._total_cands = len(self._cand_plots)
+        self._index = CandIndex(directory)
+        self._total_cands = 0
 
-        self._cands_params = [self._splitter(cand) for cand in self._cand_plots]
         self._current_cand = 0
-        self._rfi_data = []
-        self._known_data = []
-        self._cand_data = []
+        self._label_state = LabelState(0)
+        # Filters never touch the candidates in the viewing order, only
+        # select the positions we show. The labels of all the candidates
+        # are kept along with them
+        self._filters = FilterStack(self._index)
+        self._base_labels = self._label_state
+        self._view = self._filters.view()
+        # Provisional edges until we know the full DM range
+        self._class_hists = ClassHistograms(0.0, 1.0)
         self._auto_enabled = False
         self._auto_speed_value = 2
-
-        self._stats_window = StatsWindow()
-        self._stats_window.update_dist_plot([cand["dm"] for cand in self._cands_params])
-        self._stats_window.apply_limits_button.clicked.connect(self._get_limits)
-        self._stats_window.limits_choice.currentTextChanged.connect(self._change_source)
-
-        self._help_window = HelpWindow()
-        self._examples_window = ExamplesWindow()
+        # RFI probabilities from the pre-triage, if we have them
+        self._scores = scores
+        # Cluster tolerances, see find_clusters, and representative name
+        # to the names of all the cluster members
+        self._clustering = clustering
+        self._cluster_members = {}
+        # Perceptual hashes of the plots, to find look-alike families
+        self._family_radius = family_radius
+        self._hashes = {}
+        self._hash_index = None
+        self._hash_stop = Event()
+        self._hash_thread = None
+        self._hash_result = {}
+        self._hash_timer = QTimer()
+        self._hash_timer.timeout.connect(self._collect_hashes)
+
+        # Before we create anything next to the plots, so that whatever
+        # we write from now on can be told apart from the other changes
+        cached_index, fresh = load_sidecar(directory, extension)
+
+        # Shared directory: every labeller writes their own results file
+        # and works on one claimed chunk of the candidates at a time
+        self._claims = None
+        self._shared_output = output
+        self._sorted_index = None
+        self._claim_timer = QTimer()
+        if share is not None:
+            self._claims = ChunkClaims(directory, **share)
+            self._claim_timer.timeout.connect(self._renew_claim)
+            output = labeller_output(output, self._claims.labeller)
+            resume = True
+
+        self._timings = timings or LatencyRecorder()
+        self._timings_file = timings_file
+        self._key_time = None
+
+        # Labels are saved on a background thread, keypresses never wait
+        # on the disk
+        self._label_store = open_label_store(path.join(self._output_directory,
+                                                       output), label_store,
+                                             write_behind=True,
+                                             sync_interval=sync_interval,
+                                             timings=self._timings)
+
+        disk_cache = None
+        if disk_cache_size > 0:
+            try:
+                disk_cache = DiskCache(disk_cache_dir
+                                       or default_cache_directory(),
+                                       disk_cache_size * 1024 ** 2)
+            except OSError as exc:
+                logger.warning(f"Scaled plot cache disabled: {exc}")
+
+        self._decoder = PlotDecoder(disk_cache)
+        self._prefetch_ahead = prefetch_ahead
+        self._prefetcher = Prefetcher(decoder=self._timings.wrap("decode",
+                                                                 self._decoder),
+                                      ahead=prefetch_ahead,
+                                      behind=prefetch_behind,
+                                      max_bytes=cache_size * 1024 ** 2)
+
+        # Most sessions never open the other windows, they are only
+        # created when they are needed for the first time
+        self._stats_window = None
+        self._help_window = None
+        self._examples_window = None
+        self._grid_window = None
+        # Positions of the look-alikes shown in the grid instead of the
+        # whole list, and their labels as shown there
+        self._grid_family = None
+        self._grid_labels = None
+        self._diagnostics_window = None
+        self._disk_cache = disk_cache
+        self._grid_size = grid_size
+        # Whole candidate list loaded and arranged
+        self._loaded = False
+        # Index the distributions were prepared for and the distributions
+        self._distributions = None
+        self._distributions_building = False
+        self._distributions_ready.connect(self._distributions_prepared)
 
         main_box = QVBoxLayout()
         main_box.setContentsMargins(10, 0, 10, 0)
@@ -50,6 +161,7 @@ class CandClassifier(QWidget):
 
         # Because adding QPixmap to layout directly is not a thing
         self._plot_label = QLabel()
+        self._plot_label.installEventFilter(self)
         main_box.addWidget(self._plot_label)
 
         stats_box = QHBoxLayout()
@@ -156,8 +268,8 @@ class CandClassifier(QWidget):
         view_box.addLayout(nav_box)
         
         auto_box = QHBoxLayout()
-        self._auto_timer = QTimer()
-        self._auto_timer.timeout.connect(self._next_press)
+        self._auto_player = AutoPlayer(ready=self._auto_ready)
+        self._auto_player.frame.connect(self._auto_frame)
         self._auto_label = QLabel("Enable auto view")
         auto_box.addWidget(self._auto_label)
         self._auto_enable = QCheckBox()
@@ -165,12 +277,14 @@ class CandClassifier(QWidget):
         auto_box.addWidget(self._auto_enable)
         self._auto_speed = QSpinBox()
         self._auto_speed.setMinimum(1)
-        self._auto_speed.setMaximum(10)
+        self._auto_speed.setMaximum(60)
         self._auto_speed.setValue(self._auto_speed_value)
         self._auto_speed.valueChanged.connect(self._change_auto_speed)
         auto_box.addWidget(self._auto_speed)
         self._speed_label = QLabel(" cands per second")
         auto_box.addWidget(self._speed_label)
+        self._auto_stats_label = QLabel()
+        auto_box.addWidget(self._auto_stats_label)
         auto_box.setContentsMargins(0, 0, 30, 0)
         view_box.addLayout(auto_box)
 
@@ -182,10 +296,18 @@ class CandClassifier(QWidget):
         self._stats_button.clicked.connect(self._open_stats)
         self._stats_button.setText("Open Statistics")
         extra_buttons.addWidget(self._stats_button)
+        self._grid_button = QPushButton()
+        self._grid_button.clicked.connect(self._open_grid)
+        self._grid_button.setText("Grid view")
+        extra_buttons.addWidget(self._grid_button)
         self._examples_button = QPushButton()
         self._examples_button.clicked.connect(self._open_examples)
         self._examples_button.setText("Examples")
         extra_buttons.addWidget(self._examples_button)
+        self._diagnostics_button = QPushButton()
+        self._diagnostics_button.clicked.connect(self._open_diagnostics)
+        self._diagnostics_button.setText("Diagnostics")
+        extra_buttons.addWidget(self._diagnostics_button)
         self._help_button = QPushButton()
         self._help_button.clicked.connect(self._open_help)
         self._help_button.setText("Help")
@@ -198,118 +320,789 @@ class CandClassifier(QWidget):
         self.setWindowTitle("MeerTRAP candidate classifier")
         self.show()
 
-        if len(self._cand_plots) > 0:
-            self._show_cand()
+        self._cand_label.setText("Loading candidates...")
+        self._last_dist_update = 0.0
+        self._scanner = None
+        self._load_timer = QTimer()
+        self._load_timer.timeout.connect(self._load_batches)
+        self._sort_thread = None
+        self._sort_result = {}
+        self._sort_timer = QTimer()
+        self._sort_timer.timeout.connect(self._collect_sorted)
+
+        # Ask before we start loading, so that the labels can be restored
+        # batch by batch as the candidates come in
+        self._resume = False
+        if len(self._label_store) > 0:
+            if resume is None:
+                resume = self._resume_dialog(len(self._label_store), output)
+            self._resume = resume
+
+        if cached_index is not None:
+            self._index = cached_index
+            self._total_cands = len(self._index)
+            self._label_state = LabelState(self._total_cands)
+            if self._resume:
+                self._reload_csv()
+
+        if fresh:
+            # Saved sorted, the memory-mapped columns are used as they are
+            self._index_ready()
         else:
+            # Stale index: show what we already know and only add the
+            # new files as the rescan finds them
+            if self._total_cands > 0:
+                self._show_cand()
+
+            self._scanner = DirectoryScanner(directory, extension,
+                                             known=self._index.names[:])
+            self._load_timer.start(50)
+            self._scanner.start()
+
+    def _load_batches(self):
+
+        # Parsed on the scanner thread, we only append the columns and
+        # leave the rest of the batches for the next ticks
+        batches = self._scanner.poll(max_batches=4)
+
+        if batches:
+            start = self._total_cands
+            for batch in batches:
+                self._index.append(*batch)
+            self._label_state.extend(len(self._index) - start)
+            self._total_cands = len(self._index)
+            if self._resume:
+                self._reload_csv(start)
+
+            if start == 0:
+                self._show_cand()
+            else:
+                self._update_cand_label()
+
+            if self._stats_window is not None \
+                    and monotonic() - self._last_dist_update > 1.0:
+                self._change_source()
+                self._last_dist_update = monotonic()
+
+        if self._scanner.finished:
+            self._load_timer.stop()
+            self._finish_loading(removed=self._scanner.removed)
+
+    def _finish_loading(self, removed=()):
+
+        """
+
+        Put the candidates in the final, deterministic order.
+
+        Candidates are shown in the directory order while the scan is
+        running. Once it is done, they are sorted by file name on a
+        background thread, so that the interface stays responsive for
+        large directories, and handed over in _collect_sorted.
+
+        Parameters:
+
+            removed: list
+                Positions of the candidates that are no longer there
+
+        """
+
+        index = self._index
+        result = {}
+
+        def sort():
+            keep = None
+            if len(removed):
+                keep = delete(arange(len(index)), removed).tolist()
+            positions = index.sort(keep)
+            result["positions"] = positions
+            result["index"] = index.take(positions)
+
+        self._sort_result = result
+        self._sort_thread = Thread(target=sort, daemon=True)
+        self._sort_thread.start()
+        self._sort_timer.start(20)
+
+    def _collect_sorted(self):
+
+        """
+
+        Switch to the sorted candidates once they are ready.
+
+        The labels are moved along with the candidates and we stay on
+        the candidate that is currently shown. If nothing has been
+        labelled yet, we start from the beginning of the sorted list
+        instead.
+
+        """
+
+        if self._sort_thread.is_alive():
+            return
+
+        self._sort_timer.stop()
+        self._sort_thread = None
+
+        positions = self._sort_result["positions"]
+        current_name = self._index.name(self._current_cand) \
+            if self._total_cands > 0 else None
+
+        self._index = self._sort_result["index"]
+        self._label_state = self._label_state.take(positions)
+        self._total_cands = len(self._index)
+        self._sort_result = {}
+
+        self._index_ready(current_name, save_index=True)
+
+    def _index_ready(self, current_name=None, save_index=False):
+
+        """
+
+        Start viewing the complete, sorted candidate list.
+
+        Parameters:
+
+            current_name: str, optional
+                Candidate shown while the list was loading
+
+            save_index: bool
+                Save the sorted index next to the data for the next
+                session
+
+        """
+
+        if self._total_cands == 0:
             self._cand_label.setText("No candidates to view")
-    
-    """
-        if isfile(path.join(self._directory, self._output_file_name)):
-            done = 0
-            with open(path.join(self._directory, self._output_file_name)) as df:
-                done = sum(1 for line in df)
+            return
+
+        sorted_index = self._index
+
+        if save_index:
+            Thread(target=save_sidecar, args=(sorted_index, self._extension),
+                   daemon=True).start()
+
+        if self._family_radius is not None:
+            self._start_hashing(sorted_index)
+
+        if self._claims is not None:
+            self._sorted_index = sorted_index
+            if not self._enter_chunk():
+                return
+
+        self._arrange()
+        self._reset_filters()
+
+        if self._resume:
+            # Carry on from where the previous session has stopped
+            first_unlabelled = self._label_state.first(UNLABELLED)
+            if first_unlabelled is None:
+                first_unlabelled = self._total_cands - 1
+            self._current_cand = first_unlabelled
+            self._resume = False
+        elif current_name is not None \
+                and (self._label_state.labels != UNLABELLED).any():
+            current_cand = self._index.find(current_name)
+            self._current_cand = current_cand if current_cand is not None \
+                else 0
+        else:
+            self._current_cand = 0
+
+        self._refresh_candidates()
+
+    def _arrange(self):
+
+        """
+
+        Put the sorted candidates in the viewing order.
+
+        """
 
-            if done > 0:
-                self._resume_dialog(done, self._output_file_name)
+        if self._scores:
+            # Most likely astrophysical first, likely RFI left for the end
+            rfi_scores = asarray([self._scores.get(name, 0.5)
+                                  for name in self._index.names])
+            order = argsort(rfi_scores, kind="stable")
+            self._index = self._index.take(order)
+            self._label_state = self._label_state.take(order)
+
+        if self._clustering is not None:
+            self._group_clusters()
+
+    def _refresh_candidates(self):
+
+        """
+
+        Update everything that depends on the candidate list.
+
+        """
+
+        self._class_hists = ClassHistograms.from_values(self._index.dm)
+        self._class_hists.fill(self._index.dm, self._label_state.labels)
+        self._update_counts()
+        self._loaded = True
+        self._prepare_distributions()
+        self._update_stats()
+        self._set_grid_candidates()
+
+        if self._hash_index is not None:
+            self._build_hash_index()
+
+        self._show_cand(self._current_cand)
+
+    def _enter_chunk(self):
+
+        """
+
+        Claim the next chunk of the shared directory and show it.
+
+        Chunks whose candidates have all been labelled, by anyone, are
+        skipped. Once there is nothing left to claim and nobody else is
+        working on a chunk any more, the results files of all the
+        labellers are merged into the main one.
+
+        Returns:
+
+            claimed: bool
+                False if there are no chunks left
+
+        """
+
+        # Our own labels have to be in our results file for the others
+        self._label_store.update_results()
+
+        names = self._sorted_index.names
+        total = len(names)
+        labelled = labelled_names(self._output_directory,
+                                  self._shared_output)
+
+        skip = []
+        for chunk in range(self._claims.chunks(total)):
+            start, stop = self._claims.bounds(chunk, total)
+            if all(name in labelled for name in names[start:stop]):
+                skip.append(chunk)
+
+        chunk = self._claims.claim(total, skip)
+
+        if chunk is None:
+            self._claim_timer.stop()
+            others = self._claims.claimed(total)
+            if others:
+                # Their labels would be left out of the merge
+                message = ("Nothing left to claim, waiting for"
+                           + f" {len(others)} chunks still being classified"
+                           + " by others. Restart later to merge the"
+                           + " results")
+            else:
+                merged = merge_outputs(self._output_directory,
+                                       self._shared_output)
+                message = (f"Nothing left to classify, merged {merged}"
+                           + f" candidates into {self._shared_output}")
+            self._index = CandIndex(self._directory)
+            self._label_state = LabelState(0)
+            self._total_cands = 0
+            self._reset_filters()
+            if self._stats_window is not None:
+                self._stats_window.apply_limits_button.setEnabled(False)
+            self._set_grid_candidates()
+            self._plot_label.clear()
+            self._cand_label.setText(message)
+            return False
+
+        start, stop = self._claims.bounds(chunk, total)
+        self._index = self._sorted_index.take(arange(start, stop))
+        self._total_cands = len(self._index)
+        self._label_state = LabelState(self._total_cands)
+        self._label_state.update(slice(0, None),
+                                 [self._label_store.get(name, UNLABELLED)
+                                  for name in self._index.names])
+        # Always start from the first unlabelled candidate of the chunk
+        self._resume = True
+
+        self._claim_timer.start(int(self._claims.lease * 1000 / 3))
+        self.setWindowTitle("MeerTRAP candidate classifier - chunk"
+                            + f" {chunk + 1} of {self._claims.chunks(total)}")
+        logger.info(f"Claimed chunk {chunk}, candidates {start} to {stop}")
+
+        return True
+
+    def _chunk_done(self):
+
+        # The shown candidates can be only a filtered part of the chunk,
+        # the store knows about all of them
+        start, stop = self._claims.bounds(self._claims.chunk,
+                                          len(self._sorted_index))
+        return all(self._label_store.get(name, UNLABELLED) != UNLABELLED
+                   for name in self._sorted_index.names[start:stop])
+
+    def _next_chunk(self):
+
+        # Called after every label, only move on once the chunk is done
+        if self._claims.chunk is None \
+                or self._label_state.first(UNLABELLED) is not None \
+                or not self._chunk_done():
+            return
+
+        self._label_store.flush()
+        self._claims.release(done=True)
+        self._show_next_chunk()
+
+    def _renew_claim(self):
+
+        if self._claims.renew():
+            return
+
+        # Taken over by somebody else, whatever we have labelled in it
+        # is still in our results file
+        self._show_next_chunk()
+
+    def _show_next_chunk(self):
+
+        if not self._enter_chunk():
+            return
+
+        self._arrange()
+        self._reset_filters()
+        first_unlabelled = self._label_state.first(UNLABELLED)
+        self._current_cand = first_unlabelled if first_unlabelled \
+            is not None else 0
+        self._resume = False
+        self._refresh_candidates()
+
+    def _start_hashing(self, index):
+
+        """
+
+        Hash the plots that were not hashed in the previous sessions.
+
+        Hashing runs in a process pool driven from a background thread,
+        and the results are picked up by a timer on the GUI thread.
+
+        Parameters:
+
+            index: CandIndex
+                Index of all the candidates in the directory
+
+        """
+
+        self._hashes = load_hashes(self._directory, self._extension)
+        missing = [idx for idx, name in enumerate(index.names)
+                   if name not in self._hashes]
+
+        if not missing:
+            self._build_hash_index()
+            return
+
+        logger.info(f"Hashing {len(missing)} candidate plots")
+        result = {}
+
+        def hash_plots():
+            hashes = compute_hashes([index.path(idx) for idx in missing],
+                                    stop=self._hash_stop)
+            result.update((index.name(idx), plot_hash) for idx, plot_hash
+                          in zip(missing, hashes.tolist()) if plot_hash)
+            all_hashes = dict(self._hashes)
+            all_hashes.update(result)
+            save_hashes(self._directory, self._extension, all_hashes)
+
+        self._hash_result = result
+        self._hash_thread = Thread(target=hash_plots, daemon=True)
+        self._hash_thread.start()
+        self._hash_timer.start(500)
+
+    def _collect_hashes(self):
+
+        if self._hash_thread.is_alive():
+            return
+
+        self._hash_timer.stop()
+        self._hash_thread = None
+        self._hashes.update(self._hash_result)
+        self._build_hash_index()
+        self._update_cand_label()
+
+    def _build_hash_index(self):
+
+        self._hash_index = hash_index(self._index.names, self._hashes,
+                                      self._family_radius)
+
+    def _family(self, idx):
+
+        if self._hash_index is None:
+            return [idx]
+
+        family = self._hash_index.family(idx)
+        return family if len(family) else [idx]
+
+    def _group_clusters(self):
+
+        """
+
+        Only keep one representative of every cluster of candidates.
+
+        The members of every cluster are remembered, so that the label
+        given to the representative is saved for all of them.
+
+        """
+
+        clusters = find_clusters(self._index.mjd, self._index.dm,
+                                 self._index.beam, **self._clustering)
+        representatives, members = group_members(clusters)
+
+        names = self._index.names
+        self._cluster_members = {names[group[0]]: [names[member] for member
+                                                   in group]
+                                 for group in members if len(group) > 1}
+
+        logger.info(f"Grouped {self._total_cands} candidates into"
+                    + f" {len(representatives)} clusters")
+
+        self._index = self._index.take(representatives)
+        self._label_state = self._label_state.take(representatives)
+        self._total_cands = len(self._index)
 
     def _resume_dialog(self, done, file_name):
 
         done_box = QMessageBox()
         done_box.setIcon(QMessageBox.Information)
         done_box.setText(f"File {file_name} already exists with"
-                         + f"{done} candidates.\n"
+                         + f" {done} candidates.\n"
                          + "Would you like to load it?")
         done_box.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
 
-        done_value = done_box.exec()
-        
-        if done_value == QMessageBox.Yes:
-            self._reload_csv()
-            self._show_cand(min(done, self._total_cands - 1))
+        return done_box.exec() == QMessageBox.Yes
 
-    def _reload_csv():
-
-        with open(path.join(self._directory, self._output_file_name)) as df:
-            done_reader = reader(df, delimiter=",")
-
-            for done in done_reader:
-                filename = [0]
-                done = [1]
-    
-    """
-
-    def _splitter(self, cand):
+    def _reload_csv(self, start=0):
 
         """
-        
-        Extract DM and MJD from the candidate plot file name.
 
-        Check for different naming conventions we currently use and
-        take them into account when getting that information
+        Restore the labels saved in the output file.
 
-        Parameters:
+        The whole output file has already been read by the label store,
+        with the last row winning for relabelled candidates, so this is
+        a single pass of dictionary lookups over the new candidates.
+        Only the new candidates are added to the counts and histograms,
+        so loading in batches stays linear.
 
-            cand: str
-                Candidate plot name
+        Parameters:
 
-        Returns:
+            start: int
+                Index of the first candidate to restore the labels for
 
-            cand_dict: dict
-                Dictionary with correctly extracted MJD and DM values
-        
         """
 
-        cand = basename(cand)
+        get_label = self._label_store.get
+        labels = [get_label(name, UNLABELLED)
+                  for name in self._index.names[start:]]
 
-        split_cand = cand.split("_")
-        cand_dict = {}
-        mjd_off = cand.startswith("mjd_")
-        cand_dict["mjd"] = float(split_cand[0 + mjd_off])
-        cand_dict["dm"] = float(split_cand[2 + mjd_off])
-
-        return cand_dict
+        if labels:
+            self._label_state.update(slice(start, None), labels)
+            if start == 0:
+                self._class_hists.fill(self._index.dm,
+                                       self._label_state.labels)
+            else:
+                self._class_hists.add_many(self._index.dm[start:],
+                                           self._label_state.labels[start:])
+            self._update_counts()
+            self._update_stats()
 
     def _enable_auto(self, state=None):
 
         self._auto_enabled = not self._auto_enabled
         if self._auto_enabled:
             self._auto_speed_value = self._auto_speed.value()
-            self._auto_timer.start(1000 / self._auto_speed_value)
+            self._prefetcher.ahead = max(self._prefetch_ahead,
+                                         self._auto_player.buffer_size(
+                                             self._auto_speed_value))
+            self._prefetcher.update(self._index.paths, self._current_cand, 1)
+            self._auto_player.start(self._auto_speed_value)
         else:
-            self._auto_timer.stop()
+            self._auto_player.stop()
+            self._prefetcher.ahead = self._prefetch_ahead
+            self._update_auto_stats()
 
     def _change_auto_speed(self, state):
+
         self._auto_speed_value = state
+        if self._auto_enabled:
+            self._prefetcher.ahead = max(self._prefetch_ahead,
+                                         self._auto_player.buffer_size(state))
+            self._auto_player.set_rate(state)
+
+    def _auto_ready(self):
+
+        """
+
+        Check whether the next auto view frame has been decoded already.
+
+        """
+
+        next_cand = self._current_cand + 1
+        if next_cand >= self._total_cands:
+            return True
+
+        if self._prefetcher.ready(self._index.path(next_cand)):
+            return True
+
+        # Make sure it is on its way, e.g. after it was evicted
+        self._prefetcher.update(self._index.paths, self._current_cand, 1)
+        return False
+
+    def _auto_frame(self):
+
+        if self._current_cand + 1 >= self._total_cands:
+            self._auto_enable.setChecked(False)
+            return
+
+        self._next_press()
+
+        if self._auto_player.frames % max(self._auto_speed_value, 1) == 0:
+            self._update_auto_stats()
+
+    def _update_auto_stats(self):
+
+        stats = self._auto_player.stats()
+        self._auto_stats_label.setText(f" {stats['achieved_rate']:.1f}/s,"
+                                       + f" {stats['late']} late,"
+                                       + f" {stats['dropped']} dropped")
+
+    def _change_source(self, source=None):
+
+        if self._stats_window is None:
+            return
+
+        source = source or self._stats_window.limits_choice.currentText()
+        column = FILTER_COLUMNS[source]
+
+        prepared = self._prepared_distributions()
+        if prepared is not None:
+            counts, edges = prepared[column]
+        else:
+            counts, edges = distribution(self._index.column(column))
+
+        self._stats_window.update_dist_plot(counts, edges, source == "MJD")
+
+    def _prepare_distributions(self):
+
+        """
+
+        Compute the distributions and the density map in the background.
+
+        Only done while the statistics window exists, it is opened for
+        the first time with the distributions of the candidate list at
+        that point. A single build runs at a time, lists that are
+        replaced while it runs, e.g. by pushing several filters, are
+        never built. The statistics window is brought up to date once
+        they are ready.
+
+        """
+
+        if self._stats_window is None or self._distributions_building:
+            return
+
+        index = self._index
+        self._distributions_building = True
+
+        def prepare():
+            prepared = None
+            try:
+                prepared = {column: distribution(index.column(column))
+                            for column in FILTER_COLUMNS.values()}
+                prepared["density"] = DensityMap(index.mjd, index.dm)
+            except Exception as exc:
+                logger.error(f"Could not prepare the distributions: {exc}")
+            finally:
+                # Hand them over to the GUI thread
+                self._distributions_ready.emit(index, prepared)
+
+        Thread(target=prepare, daemon=True).start()
+
+    def _distributions_prepared(self, index, prepared):
+
+        self._distributions_building = False
+
+        # Candidate list has changed in the meantime, build the new one
+        if index is not self._index:
+            self._prepare_distributions()
+            return
+
+        if prepared is None:
+            return
+
+        self._distributions = (index, prepared)
+        self._sync_stats_window()
+
+    def _prepared_distributions(self):
+
+        distributions = self._distributions
+        if distributions is None or distributions[0] is not self._index:
+            return None
+
+        return distributions[1]
+
+    def _get_stats_window(self):
+
+        if self._stats_window is None:
+            # Pulls in pyqtgraph
+            from jester.stats_window import StatsWindow
+
+            stats_window = StatsWindow(timings=self._timings)
+            stats_window.apply_limits_button.clicked.connect(
+                self._apply_filter)
+            stats_window.undo_limits_button.clicked.connect(
+                self._undo_filter)
+            stats_window.brushed.connect(self._brush_filter)
+            stats_window.limits_choice.currentTextChanged.connect(
+                self._change_source)
+            self._stats_window = stats_window
+            if self._loaded:
+                self._prepare_distributions()
+            self._sync_stats_window()
+
+        return self._stats_window
+
+    def _sync_stats_window(self):
+
+        """
+
+        Bring the statistics window up to date with the candidate list.
+
+        """
+
+        if self._stats_window is None:
+            return
+
+        self._stats_window.apply_limits_button.setEnabled(self._loaded)
+        self._stats_window._update(self._class_hists)
+        self._update_filter_label()
+
+        # The rest is done once the distributions are ready, rather than
+        # computed here on the GUI thread
+        prepared = self._prepared_distributions()
+        if prepared is None:
+            return
+
+        self._change_source()
+        self._stats_window.set_density(self._index.mjd, self._index.dm,
+                                       prepared["density"])
+
+    def _update_stats(self):
 
-    def _change_source(self, source):
-        self._stats_window.update_dist_plot([cand[source.lower()] for cand in self._cands_params], source == "MJD")
+        if self._stats_window is not None:
+            self._stats_window._update(self._class_hists)
 
-    def _get_limits(self):
+    def _reset_filters(self):
 
-        limit_type = self._stats_window.limits_choice.currentText()
-        lower_limit = float(self._stats_window.start_limit.text())
-        upper_limit = float(self._stats_window.end_limit.text())
+        """
+
+        Make the current candidate list the base of the filters.
+
+        """
+
+        self._filters = FilterStack(self._index)
+        self._base_labels = self._label_state
+        self._view = self._filters.view()
+        self._update_filter_label()
+
+    def _apply_filter(self):
+
+        stats_window = self._stats_window
+        column = FILTER_COLUMNS[stats_window.limits_choice.currentText()]
+        exclude = stats_window.filter_mode.currentText() == "Remove"
+
+        try:
+            if column == "beam":
+                candidate_filter = BeamFilter(
+                    parse_beams(stats_window.start_limit.text()), exclude)
+            else:
+                candidate_filter = RangeFilter(
+                    column, float(stats_window.start_limit.text()),
+                    float(stats_window.end_limit.text()), exclude)
+        except ValueError as exc:
+            stats_window.remove_label.setText(f"Invalid filter: {exc}")
+            return
+
+        self._push_filter(candidate_filter)
+
+    def _brush_filter(self, mjd_range, dm_range):
+
+        # Only the brushed region is shown, until the filter is undone
+        self._push_filter(RegionFilter(mjd_range, dm_range))
+
+    def _push_filter(self, candidate_filter):
+
+        removed = self._filters.push(candidate_filter)
+
+        if not self._filters.mask().any():
+            self._filters.pop()
+            self._stats_window.remove_label.setText("The filter would remove"
+                                                    + " all the candidates")
+            return
+
+        self._show_view()
+        self._stats_window.remove_label.setText(f"Removed {removed}"
+                                                + " candidates,"
+                                                + f" {self._total_cands} left")
+
+    def _undo_filter(self):
+
+        if self._filters.pop() is None:
+            return
 
-        idx = 0
-        if limit_type == "DM":
-            idx = 2
+        self._show_view()
+        self._stats_window.remove_label.setText(f"Showing {self._total_cands}"
+                                                + " candidates")
 
-        remaining_plots = self._cand_plots[self._current_cand:]
-        passed_remaining_plots = [cand for cand in remaining_plots if not ((float(basename(cand).split("_")[idx + cand.startswith("mjd_")]) >= lower_limit) and (float(basename(cand).split("_")[idx + cand.startswith("mjd_")]) < upper_limit))]
+    def _show_view(self):
 
-        removed = len(remaining_plots) - len(passed_remaining_plots)
-        self._stats_window.remove_label.setText(f"Removed {removed} candidates")
+        """
+
+        Show the candidates passing the current filters.
+
+        We stay on the candidate shown before, or move on to the next
+        one that passed the filters.
+
+        """
+
+        # Labels given in the old view go back to the full list first
+        if self._label_state is not self._base_labels:
+            self._base_labels.update(self._view, self._label_state.labels)
+
+        position = self._view[self._current_cand] if len(self._view) else 0
+
+        self._view = self._filters.view()
+        if len(self._filters) == 0:
+            self._index = self._filters.index
+            self._label_state = self._base_labels
+        else:
+            self._index = self._filters.index.take(self._view)
+            self._label_state = self._base_labels.take(self._view)
 
-        del self._cand_plots[self._current_cand:]
+        self._total_cands = len(self._index)
+        self._current_cand = min(int(self._view.searchsorted(position)),
+                                 self._total_cands - 1)
 
-        self._cand_plots.extend(passed_remaining_plots)
-        self._total_cands = len(self._cand_plots)
-        #self._cands_params = [{"mjd": float(basename(cand).split("_")[0]), "dm": float(basename(cand).split("_")[2])} for cand in self._cand_plots]
-        self._cands_params = [self._splitter(cand) for cand in self._cand_plots]
+        self._class_hists.fill(self._index.dm, self._label_state.labels)
+        self._update_counts()
+        self._set_grid_candidates()
 
-        self._stats_window.update_dist_plot([cand[limit_type.lower()] for cand in self._cands_params], limit_type == "MJD")
+        if self._hash_index is not None:
+            self._build_hash_index()
+
+        self._prepare_distributions()
+        self._update_stats()
+        self._update_filter_label()
         self._show_cand(self._current_cand)
 
+    def _update_filter_label(self):
+
+        if self._stats_window is None:
+            return
+
+        self._stats_window.undo_limits_button.setEnabled(len(self._filters)
+                                                         > 0)
+        self._stats_window.filters_label.setText(
+            "Filters: " + ("; ".join(str(candidate_filter) for
+                                     candidate_filter in self._filters)
+                           or "none"))
+
     def _set_cand(self):
 
         self._plot_label.setFocus()
@@ -323,35 +1116,181 @@ class CandClassifier(QWidget):
 
     def _show_cand(self, idx = 0):
 
-        if (idx == 0):
+        with self._timings.stage("show_cand"):
+            if (idx < self._total_cands) and (idx >= 0):
+                if self._decoder.size is None:
+                    self._set_plot_size(self._index.path(idx))
 
-            cand_map = QPixmap(self._cand_plots[idx])
-            img_width = cand_map.width()
-            img_height = cand_map.height()
+                with self._timings.stage("cache_get"):
+                    cand_image = self._prefetcher.get(self._index.path(idx))
+                self._plot_label.setPixmap(QPixmap.fromImage(cand_image))
+                step = idx - self._current_cand
+                self._current_cand = idx
+                self._current_cand_select.setText(str(self._current_cand + 1))
+                self._update_cand_label()
+                self._prefetcher.update(self._index.paths, idx, step)
 
-            window_width = max(img_width, 1024)
-            window_height = max(img_height + 150, 620)
-            self.setFixedSize(QSize(window_width, window_height))
+    def _set_plot_size(self, file_name):
 
-        if (idx < self._total_cands) and (idx >= 0):
-            cand_map = QPixmap(self._cand_plots[idx])
-            self._plot_label.setPixmap(cand_map)
-            self._current_cand = idx
-            self._current_cand_select.setText(str(self._current_cand + 1))
-            self._cand_label.setText(f" out of {self._total_cands}:"
-                                    + f" {basename(self._cand_plots[idx])}")
+        """
+
+        Size the window for the plots and the screen we are shown on.
+
+        Plots are decoded straight at the size they are shown at, so
+        anything that does not fit on the screen, together with the
+        controls, is scaled down already when reading the file.
+
+        """
+
+        screen = QApplication.primaryScreen().availableGeometry()
+        self._decoder.size = QSize(max(screen.width() - 20, 320),
+                                   max(screen.height() - 200, 240))
+        plot_size = self._decoder.fit(self._decoder.native_size(file_name))
+
+        window_width = max(plot_size.width(), 1024)
+        window_height = max(plot_size.height() + 150, 620)
+        self.setFixedSize(QSize(window_width, window_height))
+
+        # Anything decoded so far was decoded at the full resolution
+        self._prefetcher.clear()
+
+    def _update_cand_label(self):
+
+        cand_name = self._index.name(self._current_cand)
+        score = self._scores.get(cand_name) if self._scores else None
+        members = self._cluster_members.get(cand_name, ())
+        family = len(self._family(self._current_cand))
+        self._cand_label.setText(f" out of {self._total_cands}:"
+                                 + f" {cand_name}"
+                                 + (f" (RFI score {score:.2f})"
+                                    if score is not None else "")
+                                 + (f" (cluster of {len(members)})"
+                                    if members else "")
+                                 + (f" ({family - 1} look-alikes, F to view)"
+                                    if family > 1 else ""))
+
+    def closeEvent(self, event):
+
+        if self._scanner is not None:
+            self._scanner.stop()
+        self._auto_player.stop()
+        self._hash_stop.set()
+        if self._claims is not None:
+            self._claim_timer.stop()
+            self._claims.release()
+        if self._timings_file:
+            self._timings.dump(self._timings_file, self._diagnostics())
+        self._prefetcher.shutdown()
+        if self._grid_window is not None:
+            self._grid_window.shutdown()
+        self._label_store.close()
+        # The results we have just written must not make the index stale
+        restamp_sidecar(self._directory, self._extension)
+        super().closeEvent(event)
 
     def _open_stats(self):
 
-        if not self._stats_window.isVisible():
+        if not self._get_stats_window().isVisible():
             self._stats_window.show()
             self._stats_button.setText("Close Statistics")
         else:
             self._stats_window.hide()
             self._stats_button.setText("Open Statistics")
 
+    def _get_grid_window(self):
+
+        if self._grid_window is None:
+            self._grid_window = GridWindow(PlotDecoder(self._disk_cache),
+                                           *self._grid_size)
+            self._grid_window.labelled.connect(self._grid_labelled)
+
+        return self._grid_window
+
+    def _set_grid_candidates(self):
+
+        """
+
+        Show the whole candidate list in the grid, if it is open.
+
+        """
+
+        self._grid_family = None
+        self._grid_labels = None
+        if self._grid_window is not None:
+            self._grid_window.set_candidates(self._index, self._label_state)
+
+    def _open_grid(self, event=None):
+
+        grid_window = self._get_grid_window()
+
+        if not grid_window.isVisible() or self._grid_family is not None:
+            self._set_grid_candidates()
+            grid_window.show()
+            grid_window.show_cand(self._current_cand)
+            grid_window.activateWindow()
+        else:
+            grid_window.hide()
+
+    def _show_family(self, event=None):
+
+        """
+
+        Show the current candidate and its look-alikes in the grid.
+
+        They are labelled from there, like any other grid page, so that
+        nothing is labelled without being seen.
+
+        """
+
+        if self._total_cands == 0:
+            return
+
+        family = asarray(self._family(self._current_cand))
+        self._grid_family = family
+        self._grid_labels = self._label_state.take(family)
+
+        title = f"Look-alikes of {self._index.name(self._current_cand)}"
+        grid_window = self._get_grid_window()
+        grid_window.set_candidates(self._index.take(family),
+                                   self._grid_labels, title)
+        grid_window.show()
+        grid_window.show_page(0)
+        grid_window.activateWindow()
+
+    def _grid_labelled(self, cands, class_type):
+
+        for idx in cands:
+            if self._grid_family is not None:
+                self._grid_labels.set(idx, CLASS_LABELS[class_type])
+                idx = int(self._grid_family[idx])
+            self._update_list(idx, class_type)
+
+        self._grid_window.refresh()
+
+    def _open_diagnostics(self, event=None):
+
+        if self._diagnostics_window is None:
+            self._diagnostics_window = DiagnosticsWindow(self._timings,
+                                                         self._diagnostics)
+
+        if not self._diagnostics_window.isVisible():
+            self._diagnostics_window.show()
+        else:
+            self._diagnostics_window.hide()
+
+    def _diagnostics(self):
+
+        return {
+            "prefetch": self._prefetcher.stats(),
+            "auto_view": self._auto_player.stats(),
+            "labels": self._label_store.stats(),
+        }
+
     def _open_help(self):
 
+        if self._help_window is None:
+            self._help_window = HelpWindow()
+
         if not self._help_window.isVisible():
             self._help_window.show()
         else:
@@ -359,6 +1298,9 @@ class CandClassifier(QWidget):
 
     def _open_examples(self):
 
+        if self._examples_window is None:
+            self._examples_window = ExamplesWindow()
+
         if not self._examples_window.isVisible():
             self._examples_window.show()
         else:
@@ -378,94 +1320,93 @@ class CandClassifier(QWidget):
             Qt.Key_PageDown: self._previous_skip_press,
             Qt.Key_PageUp: self._next_skip_press,
             Qt.Key_Home: self._skip_start_press,
-            Qt.Key_End: self._skip_end_press
+            Qt.Key_End: self._skip_end_press,
+            Qt.Key_G: self._open_grid,
+            Qt.Key_F: self._show_family,
+            Qt.Key_F12: self._open_diagnostics
         }
 
         pressed = event.key()
         function = route.get(pressed)
+
         if function:
-            if pressed != Qt.Key_V:
-                if self._auto_enabled:
-                    self._auto_enable.nextCheckState()
-                return function(event)
-            else:
-                return function()
+            self._key_time = perf_counter()
+            with self._timings.stage("keypress"):
+                if pressed != Qt.Key_V:
+                    if self._auto_enabled:
+                        self._auto_enable.nextCheckState()
+                    return function(event)
+                else:
+                    return function()
+
+    def eventFilter(self, watched, event):
+
+        # Time from the keypress until the new plot is actually painted
+        if (watched is self._plot_label and event.type() == QEvent.Paint
+                and self._key_time is not None):
+            self._timings.record("key_to_paint", perf_counter() - self._key_time)
+            self._key_time = None
+
+        if (watched is self._plot_label and event.type() == QEvent.Paint
+                and self._start_time is not None
+                and self._plot_label.pixmap() is not None
+                and not self._plot_label.pixmap().isNull()):
+            first_plot = perf_counter() - self._start_time
+            self._timings.record("first_plot", first_plot)
+            logger.info(f"First plot shown after {first_plot:.3f} s")
+            self._start_time = None
+
+        return super().eventFilter(watched, event)
 
     def _update_list(self, idx, class_type):
 
-        cand_name = basename(self._cand_plots[idx])
-        split_cand = cand_name.split("_")
-        cand_dm = float(split_cand[2 + cand_name.startswith("mjd_")])
-        
-        cand = (idx, cand_dm)
-
-        if class_type == "rfi":
-            if cand not in self._rfi_data:
-                self._rfi_data.append(cand)
-                if cand in self._cand_data:
-                    self._cand_data.remove(cand)
-                    self._replace_csv(cand_name, 0)
-                elif cand in self._known_data:
-                    self._known_data.remove(cand)
-                    self._replace_csv(cand_name, 0)
-                else:
-                    self._add_csv(cand_name, 0)
-        
-        elif class_type == "known":
-            if cand not in self._known_data:
-                self._known_data.append(cand)
-                if cand in self._rfi_data:
-                    self._rfi_data.remove(cand)
-                    self._replace_csv(cand_name, 2)
-                elif cand in self._cand_data:
-                    self._cand_data.remove(cand)
-                    self._replace_csv(cand_name, 2)
-                else:
-                    self._add_csv(cand_name, 2)
-
-        elif class_type == "cand":
-            if cand not in self._cand_data:
-                self._cand_data.append(cand)
-                if cand in self._rfi_data:
-                    self._rfi_data.remove(cand)
-                    self._replace_csv(cand_name, 1)
-                elif cand in self._known_data:
-                    self._known_data.remove(cand)
-                    self._replace_csv(cand_name, 1)
+        with self._timings.stage("update_list"):
+            if idx >= self._total_cands:
+                return
+
+            label = CLASS_LABELS[class_type]
+            old_label = self._label_state.set(idx, label)
+
+            if old_label != label:
+                self._class_hists.relabel(self._index.dm[idx], old_label, label)
+                cand_name = self._index.name(idx)
+                if old_label == UNLABELLED:
+                    self._add_csv(cand_name, label)
                 else:
-                    self._add_csv(cand_name, 1)
+                    self._replace_csv(cand_name, label)
 
-        self._rfi_count_label.setText(f"RFI: {len(self._rfi_data)}")
-        self._known_count_label.setText(f"Known: {len(self._known_data)}")
-        self._cand_count_label.setText(f"Candidates: {len(self._cand_data)}")
+            self._update_counts()
+            self._update_stats()
 
-        self._stats_window._update(self._rfi_data, self._cand_data)
+            if self._claims is not None:
+                QTimer.singleShot(0, self._next_chunk)
 
-    def _replace_csv(self, cand_name, new_label):
+    def _update_counts(self):
 
-        with open(path.join(self._directory, self._output_file_name),
-                            "r", buffering=1) as of,\
-             open(path.join(self._directory, self._output_file_name + ".tmp"),
-                            "a", buffering=1) as nf:
-            
-            old_csv = reader(of, delimiter=",")
-            new_csv = writer(nf, delimiter=",")
-
-            for cand in old_csv:
-                if cand[0] != cand_name:
-                    new_csv.writerow([cand[0], cand[1]])
-                else:
-                    new_csv.writerow([cand[0], new_label])
+        self._rfi_count_label.setText(f"RFI: {self._label_state.count(RFI)}")
+        self._known_count_label.setText("Known:"
+                                        + f" {self._label_state.count(KNOWN)}")
+        self._cand_count_label.setText("Candidates:"
+                                       + f" {self._label_state.count(CANDIDATE)}")
 
-        move(path.join(self._directory, self._output_file_name + ".tmp"),
-             path.join(self._directory, self._output_file_name))
+    def _replace_csv(self, cand_name, new_label):
+
+        with self._timings.stage("label_io"):
+            self._label_store.set(cand_name, new_label)
+            self._label_members(cand_name, new_label)
 
     def _add_csv(self, cand_name, label):
 
-        with open(path.join(self._directory, self._output_file_name),
-                            "a", buffering=1) as cf:
-            cand_csv = writer(cf, delimiter=",")
-            cand_csv.writerow([cand_name, label])
+        with self._timings.stage("label_io"):
+            self._label_store.set(cand_name, label)
+            self._label_members(cand_name, label)
+
+    def _label_members(self, cand_name, label):
+
+        members = self._cluster_members.get(cand_name)
+        if members:
+            self._label_store.set_many((member, label) for member
+                                       in members[1:])
 
     def _rfi_press(self, event):
         self._update_list(self._current_cand, "rfi")
@@ -499,92 +1440,60 @@ class CandClassifier(QWidget):
     def _skip_end_press(self, event):
         self._show_cand(self._total_cands - 1)
 
-class StatsWindow(QWidget):
+class DiagnosticsWindow(QWidget):
 
-    def __init__(self):
+    """
+
+    Live view of the hot-path latencies and cache statistics.
+
+    Parameters:
+
+        timings: LatencyRecorder
+            Recorder with the per-stage timings
+
+        extra: callable
+            Returns a dictionary of additional statistics groups
+
+    """
+
+    def __init__(self, timings, extra):
         super().__init__()
-        self.setGeometry(150 + 1024, 150, 800, 600)
+        self.setGeometry(150 + 1024, 150 + 600, 620, 360)
+        self.setWindowTitle("Diagnostics")
+
+        self._timings = timings
+        self._extra = extra
 
         main_box = QVBoxLayout()
+        self._stats_label = QLabel()
+        self._stats_label.setStyleSheet("font-family: monospace")
+        self._stats_label.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        main_box.addWidget(self._stats_label)
+        self.setLayout(main_box)
 
-        self.graph_rfi = PlotWidget()
-        self.graph_rfi.setBackground("w")
-        self.graph_rfi.setTitle("RFI", color="k")
-        self.graph_rfi.plot = self.graph_rfi.plot([0,0], [0],
-                                                  pen=mkPen('k', width=1),
-                                                  stepMode=True)
-        self.graph_cand = PlotWidget()
-        self.graph_cand.setBackground("w")
-        self.graph_cand.setTitle("Candidates", color="k")
-        self.graph_cand.plot = self.graph_cand.plot([0,0], [0],
-                                                  pen=mkPen('k', width=1),
-                                                  stepMode=True)
-
-        self.dist_plot = PlotWidget()
-        self.dist_plot.setMouseEnabled(y=False)
-        self.dist_plot.setBackground("w")
-        self.dist_plot.setTitle("Full distribution", color="k")
-        self.dist_plot.plot = self.dist_plot.plot([0,0], [0],
-                                                  pen=mkPen('k', width=1),
-                                                  stepMode=True)
-
-
-        plots_box = QHBoxLayout()
-        plots_box.addWidget(self.graph_rfi)
-        plots_box.addWidget(self.graph_cand)
-        main_box.addLayout(plots_box)
-        main_box.addWidget(self.dist_plot)
-
-        limits_box = QHBoxLayout()
-        limits_box.setAlignment(Qt.AlignLeft)
-        
-        self.limits_choice = QComboBox()
-        self.limits_choice.addItems(["DM", "MJD"])
-        self.limits_choice.setFixedWidth(100)
-        limits_box.addWidget(self.limits_choice)
-        self.start_limit = QLineEdit()
-        self.start_limit.setPlaceholderText("from")
-        self.start_limit.setFixedWidth(150)
-        limits_box.addWidget(self.start_limit)
-        self.end_limit = QLineEdit()
-        self.end_limit.setPlaceholderText("to")
-        self.end_limit.setFixedWidth(150)
-        limits_box.addWidget(self.end_limit)
-        self.apply_limits_button = QPushButton()
-        self.apply_limits_button.setFixedWidth(150)
-        self.apply_limits_button.setText("Remove limits")
-        limits_box.addWidget(self.apply_limits_button)
-        self.remove_label = QLabel()
-        limits_box.addWidget(self.remove_label)
-        main_box.addLayout(limits_box)
-        
+        self._refresh_timer = QTimer()
+        self._refresh_timer.timeout.connect(self._refresh)
 
-        self.setLayout(main_box)
+    def showEvent(self, event):
 
-    def _update(self, rfi_data, cand_data):
+        self._refresh()
+        self._refresh_timer.start(1000)
+        super().showEvent(event)
 
-        y_rfi, x_rfi = histogram([cand[1] for cand in rfi_data],
-                                 bins=min(len(rfi_data) + 1, 100))
-        self.graph_rfi.plot.setData(x_rfi, y_rfi)
+    def hideEvent(self, event):
 
-        y_cand, x_cand = histogram([cand[1] for cand in cand_data],
-                                   bins=min(len(cand_data) + 1, 100))
-        self.graph_cand.plot.setData(x_cand, y_cand)
+        self._refresh_timer.stop()
+        super().hideEvent(event)
 
-    def update_dist_plot(self, data, extra_dec=False):
+    def _refresh(self):
 
-        y_dist, x_dist = histogram(data, bins=100)
-        ax = self.dist_plot.getAxis("bottom")
+        lines = ["Latency [ms]", self._timings.table(), ""]
+        for group, stats in self._extra().items():
+            lines.append(group + ": " + ", ".join(
+                f"{name} {value:.2f}" if isinstance(value, float)
+                else f"{name} {value}" for name, value in stats.items()))
 
-        min_val = min(data)
-        max_val = max(data)
-        tick_vals = linspace(min_val, max_val, num=6)
-        decimals = 2 + extra_dec * 4
-        ticks = [(val, "{:.{dec}f}".format(val, dec=decimals)) for val in tick_vals]
-        ax.setTicks( [ticks, []])
-        ax.setStyle(tickLength=-5)
-        self.dist_plot.plot.setData(x_dist, y_dist)
-        self.dist_plot.autoRange()
+        self._stats_label.setText("\n".join(lines))
 
 class HelpWindow(QWidget):
     def __init__(self):
@@ -593,7 +1502,7 @@ class HelpWindow(QWidget):
 
         help_contents = QVBoxLayout()
         help_label = QLabel()
-        help_label.setText("Auto scroll toggle: V\nRFI: A\nKnown source: S\nCandidate: D\nPrevious: Z\nNext: X\nBack 5: PgDown\nForward 5: PgUp\nBack to start: Home\nSkip to end: End")
+        help_label.setText("Auto scroll toggle: V\nRFI: A\nKnown source: S\nCandidate: D\nPrevious: Z\nNext: X\nBack 5: PgDown\nForward 5: PgUp\nBack to start: Home\nSkip to end: End\nLook-alikes in the grid: F\nGrid view: G\nDiagnostics: F12\n\nGrid view:\nSelect: click, Ctrl+A\nLabel selected or all unlabelled: A/S/D\nPrevious/next page: Z/X")
         help_contents.addWidget(help_label)
         self.setLayout(help_contents)
 
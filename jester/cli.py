@@ -0,0 +1,351 @@
+import argparse as ap
+import json
+import logging
+
+from numpy import asarray, int8
+from os import makedirs, path
+
+from jester.archive import data_directory
+from jester.dataset import export_dataset
+from jester.index import CandIndex, load_index, restamp_sidecar
+from jester.labels import LABEL_NAMES, RFI, UNLABELLED, read_results
+from jester.labels import merge_results, open_label_store
+from jester.stats import ClassHistograms, distribution, summarise
+from jester.stats import write_histogram
+from jester.triage import TriageModel, extract_features, training_labels
+from jester.triage import write_scores
+
+logger = logging.getLogger(__name__)
+
+# Nothing in here can import Qt or pyqtgraph, so that these commands
+# work on the nodes without a display and start quickly
+
+
+def merge(arguments):
+
+    merged, conflicts = merge_results(arguments.inputs, arguments.output,
+                                      arguments.policy)
+    print(f"Merged {merged} candidates from {len(arguments.inputs)} files"
+          + f" into {arguments.output}, {conflicts} with conflicting labels")
+
+
+def stats(arguments):
+
+    labels = {}
+    for file_name in arguments.inputs:
+        labels.update(read_results(file_name))
+
+    labelled = CandIndex.from_names("", labels)
+    label_values = asarray(list(labels.values()), dtype=int8)
+
+    directory_index = None
+    if arguments.directory:
+        directory_index = load_index(arguments.directory, arguments.extension)
+
+    makedirs(arguments.output, exist_ok=True)
+    summary = {"labelled": len(labels)}
+
+    for column in ("dm", "mjd"):
+
+        # Use the same edges as the statistics window: the range of the
+        # whole directory if we have it, of the labelled candidates if not
+        range_values = (directory_index.column(column)
+                        if directory_index is not None
+                        else labelled.column(column))
+        class_hists = ClassHistograms.from_values(range_values,
+                                                  arguments.bins)
+        class_hists.fill(labelled.column(column), label_values)
+
+        write_histogram(path.join(arguments.output, f"{column}_classes.csv"),
+                        class_hists.edges,
+                        {name: class_hists.counts(label)
+                         for label, name in LABEL_NAMES.items()})
+
+        if directory_index is not None:
+            counts, edges = distribution(directory_index.column(column),
+                                         arguments.bins)
+            write_histogram(path.join(arguments.output,
+                                      f"{column}_distribution.csv"),
+                            edges, {"all": counts})
+
+    for label, name in LABEL_NAMES.items():
+        summary[name] = {column: summarise(labelled.column(column)
+                                           [label_values == label])
+                         for column in ("dm", "mjd")}
+
+    if directory_index is not None:
+        summary["total"] = len(directory_index)
+        summary["all"] = {column: summarise(directory_index.column(column))
+                          for column in ("dm", "mjd")}
+
+    with open(path.join(arguments.output, "summary.json"), "w") as sf:
+        json.dump(summary, sf, indent=2)
+
+    for label, name in LABEL_NAMES.items():
+        print(f"{name}: {summary[name]['dm']['count']}")
+
+
+def train(arguments):
+
+    labels = training_labels(arguments.inputs, arguments.directory,
+                             not arguments.no_examples)
+    if not labels:
+        logger.error("No labelled plots found to train the triage model on")
+        return
+
+    features = extract_features(list(labels), arguments.workers)
+    model = TriageModel.fit(features, list(labels.values()),
+                            precision=arguments.precision)
+    model.save(arguments.output)
+
+    if model.auto_threshold is None:
+        automatic = ("no automatic RFI labelling, no threshold is precise"
+                     + " enough on plots held out from the fit or there"
+                     + " are too few of them to tell")
+    else:
+        automatic = f"automatic RFI labelling above {model.auto_threshold:.3f}"
+
+    print(f"Trained on {len(labels)} plots, {automatic}. Model saved in"
+          + f" {arguments.output}")
+
+
+def triage(arguments):
+
+    model = TriageModel.load(arguments.model)
+    index = load_index(arguments.directory, arguments.extension)
+
+    features = extract_features([index.path(idx) for idx
+                                 in range(len(index))], arguments.workers)
+    scores = model.score(features)
+    write_scores(arguments.output, index.names, scores)
+
+    summary = f"Scored {len(index)} candidates into {arguments.output}"
+
+    threshold = arguments.threshold if arguments.threshold is not None \
+        else model.auto_threshold
+
+    if arguments.auto_label and threshold is None:
+        summary += (", no automatic labelling as the model has no"
+                    + " threshold known to be precise enough")
+    elif arguments.auto_label:
+        # Same place as the results file of the classifier itself
+        output_directory = data_directory(arguments.directory)
+        store = open_label_store(path.join(output_directory,
+                                           arguments.auto_label))
+        # Never override a human decision
+        auto_rfi = [(index.name(idx), RFI) for idx
+                    in (scores >= threshold).nonzero()[0]
+                    if store.get(index.name(idx), UNLABELLED) == UNLABELLED]
+        store.set_many(auto_rfi)
+        store.close()
+        summary += (f", {len(auto_rfi)} labelled as RFI above {threshold:.3f}"
+                    + f" in {arguments.auto_label}")
+
+    # The scores and labels may have been written next to the plots
+    restamp_sidecar(arguments.directory, arguments.extension)
+    print(summary)
+
+
+def export(arguments):
+
+    labels = {}
+    for file_name in arguments.inputs:
+        labels.update(read_results(file_name))
+
+    index = load_index(arguments.directory, arguments.extension)
+
+    samples = []
+    missing = 0
+    for cand_name, label in labels.items():
+        idx = index.find(cand_name)
+        if idx is None or label == UNLABELLED:
+            missing += idx is None
+            continue
+        samples.append((index.path(idx), cand_name, float(index.mjd[idx]),
+                        float(index.dm[idx]), int(index.beam[idx]), label))
+
+    if missing:
+        logger.warning(f"{missing} labelled candidates are not in"
+                       + f" {arguments.directory} and were left out")
+
+    exported = export_dataset(samples, arguments.output, arguments.size,
+                              arguments.grayscale, arguments.shard_size,
+                              arguments.workers)
+
+    print(f"Exported {exported} of {len(samples)} labelled candidates into"
+          + f" {arguments.output}")
+
+
+def plot_size(value):
+
+    try:
+        width, height = (int(size) for size in value.split("x"))
+    except ValueError:
+        raise ap.ArgumentTypeError(f"invalid size {value}, use WIDTHxHEIGHT")
+
+    if width < 1 or height < 1:
+        raise ap.ArgumentTypeError(f"invalid size {value}, both have to be"
+                                   + " positive")
+
+    return width, height
+
+
+COMMANDS = {
+    "export": export,
+    "merge": merge,
+    "stats": stats,
+    "train": train,
+    "triage": triage,
+}
+
+
+def build_parser():
+
+    parser = ap.ArgumentParser(prog="main.py",
+                               description="Headless tools for the"
+                               + " MeerTRAP classifier")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    merge_parser = commands.add_parser("merge", help="Merge the results"
+                                       + " files of several classifiers")
+    merge_parser.add_argument("inputs", help="Results files to merge",
+                              nargs="+",
+                              type=str)
+    merge_parser.add_argument("-o", "--output", help="Merged results file",
+                              required=True,
+                              type=str)
+    merge_parser.add_argument("-p", "--policy", help="How to resolve"
+                              + " candidates labelled more than once",
+                              required=False,
+                              type=str,
+                              choices=["last", "majority"],
+                              default="last")
+
+    stats_parser = commands.add_parser("stats", help="Per-class statistics"
+                                       + " and histograms")
+    stats_parser.add_argument("inputs", help="Results files",
+                              nargs="+",
+                              type=str)
+    stats_parser.add_argument("-d", "--directory", help="Input data"
+                              + " directory, for the full distribution",
+                              required=False,
+                              type=str)
+    stats_parser.add_argument("-e", "--extension", help="Plot extension",
+                              required=False,
+                              type=str,
+                              default="png")
+    stats_parser.add_argument("-o", "--output", help="Output directory",
+                              required=False,
+                              type=str,
+                              default="stats")
+    stats_parser.add_argument("-b", "--bins", help="Number of histogram bins",
+                              required=False,
+                              type=int,
+                              default=100)
+
+    train_parser = commands.add_parser("train", help="Train the RFI"
+                                       + " pre-triage model")
+    train_parser.add_argument("inputs", help="Results files with more"
+                              + " labelled plots",
+                              nargs="*",
+                              type=str)
+    train_parser.add_argument("-d", "--directory", help="Directory with"
+                              + " the plots of the results files. Defaults"
+                              + " to the directory of every results file",
+                              required=False,
+                              type=str)
+    train_parser.add_argument("-o", "--output", help="Model file",
+                              required=False,
+                              type=str,
+                              default="triage.json")
+    train_parser.add_argument("-p", "--precision", help="Required RFI"
+                              + " precision of the automatic labelling",
+                              required=False,
+                              type=float,
+                              default=0.99)
+    train_parser.add_argument("--no-examples", help="Do not train on the"
+                              + " labelled example plots",
+                              action="store_true")
+    train_parser.add_argument("-w", "--workers", help="Number of feature"
+                              + " extraction processes",
+                              required=False,
+                              type=int,
+                              default=None)
+
+    triage_parser = commands.add_parser("triage", help="Score candidates"
+                                        + " by their RFI probability")
+    triage_parser.add_argument("-d", "--directory", help="Input data"
+                               + " directory",
+                               required=True,
+                               type=str)
+    triage_parser.add_argument("-e", "--extension", help="Plot extension",
+                               required=False,
+                               type=str,
+                               default="png")
+    triage_parser.add_argument("-m", "--model", help="Model file",
+                               required=False,
+                               type=str,
+                               default="triage.json")
+    triage_parser.add_argument("-o", "--output", help="Scores file",
+                               required=False,
+                               type=str,
+                               default="scores.csv")
+    triage_parser.add_argument("-a", "--auto-label", help="Label the"
+                               + " high-confidence RFI in this results file"
+                               + " in the data directory",
+                               required=False,
+                               type=str)
+    triage_parser.add_argument("-t", "--threshold", help="RFI probability"
+                               + " for the automatic labelling. Defaults"
+                               + " to the calibrated one",
+                               required=False,
+                               type=float)
+    triage_parser.add_argument("-w", "--workers", help="Number of feature"
+                               + " extraction processes",
+                               required=False,
+                               type=int,
+                               default=None)
+
+    export_parser = commands.add_parser("export", help="Export the labelled"
+                                        + " candidates as a training dataset")
+    export_parser.add_argument("inputs", help="Results files",
+                               nargs="+",
+                               type=str)
+    export_parser.add_argument("-d", "--directory", help="Input data"
+                               + " directory",
+                               required=True,
+                               type=str)
+    export_parser.add_argument("-e", "--extension", help="Plot extension",
+                               required=False,
+                               type=str,
+                               default="png")
+    export_parser.add_argument("-o", "--output", help="Output directory",
+                               required=False,
+                               type=str,
+                               default="dataset")
+    export_parser.add_argument("-s", "--size", help="Size of the exported"
+                               + " plots as WIDTHxHEIGHT",
+                               required=False,
+                               type=plot_size,
+                               default="256x128")
+    export_parser.add_argument("--grayscale", help="Export single-channel"
+                               + " instead of RGB plots",
+                               action="store_true")
+    export_parser.add_argument("--shard-size", help="Number of plots in"
+                               + " a single array file",
+                               required=False,
+                               type=int,
+                               default=4096)
+    export_parser.add_argument("-w", "--workers", help="Number of decoding"
+                               + " processes",
+                               required=False,
+                               type=int,
+                               default=None)
+
+    return parser
+
+
+def main(argv):
+
+    arguments = build_parser().parse_args(argv)
+    COMMANDS[arguments.command](arguments)
@@ -0,0 +1,137 @@
+from numpy import abs as np_abs, arange, argsort, asarray, empty
+from numpy import flatnonzero, full, int64, isfinite, split, unique
+
+SECONDS_PER_DAY = 86400.0
+
+
+def find_clusters(mjd, dm, beam, time_tolerance=30.0, dm_tolerance=0.02,
+                  dm_min_tolerance=0.5, beam_tolerance=None):
+
+    """
+
+    Group near-coincident candidates with a single sweep in time.
+
+    Candidates are visited in MJD order and each one joins the first
+    open cluster it is close enough to, or starts a new one. A cluster
+    is closed once nothing has been added to it for longer than the time
+    tolerance, so only the handful of clusters around the current time
+    has to be checked and the sweep is O(N log N) overall.
+
+    Parameters:
+
+        mjd: array_like
+            Candidate MJDs
+
+        dm: array_like
+            Candidate DMs
+
+        beam: array_like
+            Candidate beams, -1 if not known
+
+        time_tolerance: float
+            Largest gap in seconds between consecutive cluster members
+
+        dm_tolerance: float
+            Largest DM difference from the first cluster member, as a
+            fraction of its DM
+
+        dm_min_tolerance: float
+            Smallest DM difference that is always accepted, so that low
+            DM candidates can still be grouped
+
+        beam_tolerance: int, optional
+            Largest beam number difference from the first cluster
+            member. None groups candidates from any beam, e.g. RFI
+            seen by the whole array
+
+    Returns:
+
+        clusters: array
+            Cluster number of every candidate
+
+    """
+
+    mjd = asarray(mjd)
+    dm = asarray(dm)
+    beam = asarray(beam)
+
+    clusters = full(mjd.shape[0], -1, dtype=int64)
+    times = mjd * SECONDS_PER_DAY
+
+    first_dm = []
+    first_beam = []
+    last_time = []
+    active = []
+
+    usable = isfinite(times) & isfinite(dm)
+    order = flatnonzero(usable)[argsort(times[usable], kind="stable")]
+
+    for cand in order:
+
+        time = times[cand]
+        active = [cluster for cluster in active
+                  if time - last_time[cluster] <= time_tolerance]
+
+        for cluster in active:
+            if np_abs(dm[cand] - first_dm[cluster]) > max(
+                    dm_tolerance * first_dm[cluster], dm_min_tolerance):
+                continue
+            if beam_tolerance is not None and np_abs(
+                    beam[cand] - first_beam[cluster]) > beam_tolerance:
+                continue
+            break
+        else:
+            cluster = len(last_time)
+            first_dm.append(dm[cand])
+            first_beam.append(beam[cand])
+            last_time.append(time)
+            active.append(cluster)
+
+        clusters[cand] = cluster
+        last_time[cluster] = time
+
+    # Candidates without a usable MJD or DM stay on their own
+    unusable = flatnonzero(~usable)
+    clusters[unusable] = len(last_time) + arange(unusable.shape[0])
+
+    return clusters
+
+
+def group_members(clusters):
+
+    """
+
+    Split the candidates into their clusters.
+
+    The representative of every cluster is its member that comes first
+    in the current candidate order.
+
+    Parameters:
+
+        clusters: array_like
+            Cluster number of every candidate, as from find_clusters
+
+    Returns:
+
+        representatives: array
+            Position of every cluster representative, in order
+
+        members: list
+            Positions of all the members of every cluster, the
+            representative first, in the same order as representatives
+
+    """
+
+    clusters = asarray(clusters, dtype=int64)
+
+    if clusters.shape[0] == 0:
+        return empty(0, dtype=int64), []
+
+    by_cluster = argsort(clusters, kind="stable")
+    _, starts = unique(clusters[by_cluster], return_index=True)
+    members = split(by_cluster, starts[1:])
+
+    representatives = asarray([group[0] for group in members], dtype=int64)
+    order = argsort(representatives, kind="stable")
+
+    return representatives[order], [members[idx] for idx in order]
@@ -0,0 +1,267 @@
+import json
+import logging
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from csv import writer
+from functools import partial
+from numpy import frombuffer, uint8
+from numpy.lib.format import open_memmap
+from os import cpu_count, makedirs, path, remove, replace
+
+from jester.labels import LABEL_NAMES
+
+logger = logging.getLogger(__name__)
+
+DATASET_VERSION = 1
+METADATA_COLUMNS = ("name", "mjd", "dm", "beam", "label", "shard", "row")
+
+
+def plot_pixels(file_name, size, grayscale=False):
+
+    """
+
+    Decode a candidate plot into a fixed-shape uint8 array.
+
+    Runs in the worker processes, Qt is only imported once we are there.
+
+    Parameters:
+
+        file_name: str
+            Full path to the candidate plot
+
+        size: tuple
+            Width and height of the array
+
+        grayscale: bool
+            Decode into a single channel instead of RGB
+
+    Returns:
+
+        pixels: array or None
+            Height x width, with an extra RGB axis unless grayscale,
+            None if the plot could not be decoded
+
+    """
+
+    from PyQt5.QtCore import QSize, Qt
+    from PyQt5.QtGui import QImage
+
+    from jester.decode import read_scaled
+
+    width, height = size
+    image = read_scaled(file_name, QSize(width, height))
+
+    if image.isNull():
+        logger.warning(f"Could not decode {file_name}")
+        return None
+
+    if image.width() != width or image.height() != height:
+        image = image.scaled(width, height, Qt.IgnoreAspectRatio,
+                             Qt.SmoothTransformation)
+
+    image = image.convertToFormat(QImage.Format_Grayscale8 if grayscale
+                                  else QImage.Format_RGB888)
+    channels = 1 if grayscale else 3
+    bits = image.constBits()
+    bits.setsize(image.bytesPerLine() * height)
+    pixels = frombuffer(bits, dtype=uint8).reshape(
+        height, image.bytesPerLine())[:, :width * channels]
+
+    if grayscale:
+        return pixels.copy()
+
+    return pixels.reshape(height, width, channels).copy()
+
+
+def _plot_chunk(file_names, size, grayscale):
+    return [plot_pixels(file_name, size, grayscale)
+            for file_name in file_names]
+
+
+def _decoded(executor, decode, file_names, chunksize, window):
+
+    """
+
+    Yield the decoded plots in order, with at most `window` chunks of
+    them submitted or waiting to be written at any time.
+
+    """
+
+    pending = deque()
+
+    for start in range(0, len(file_names), chunksize):
+        if len(pending) >= window:
+            yield from pending.popleft().result()
+        pending.append(executor.submit(decode,
+                                       file_names[start:start + chunksize]))
+
+    while pending:
+        yield from pending.popleft().result()
+
+
+def shard_name(shard):
+    return f"images_{shard:05d}.npy"
+
+
+def export_dataset(samples, output, size=(256, 128), grayscale=False,
+                   shard_size=4096, workers=None, chunksize=16, window=None):
+
+    """
+
+    Write labelled candidates as a memory-mappable training dataset.
+
+    Plots are decoded in a process pool and streamed, in order, into
+    fixed-shape uint8 shards created with open_memmap, so neither the
+    decoded plots nor a shard ever have to fit in memory. Only a few
+    chunks of plots are handed to the pool ahead of the one being
+    written. Every sample gets a row in metadata.csv with the shard and
+    the row it is stored in, and dataset.json describes the layout.
+    Plots that cannot be decoded are left out.
+
+    Parameters:
+
+        samples: list
+            (file path, name, mjd, dm, beam, label) of every candidate
+
+        output: str
+            Output directory, created if it does not exist
+
+        size: tuple
+            Width and height every plot is resized to
+
+        grayscale: bool
+            Store single-channel instead of RGB images
+
+        shard_size: int
+            Largest number of plots in a single shard
+
+        workers: int, optional
+            Number of decoding processes. Defaults to the number of CPUs
+
+        chunksize: int
+            Number of plots sent to a worker at once
+
+        window: int, optional
+            Largest number of chunks being decoded or waiting to be
+            written. Defaults to twice the number of workers
+
+    Returns:
+
+        exported: int
+            Number of plots written
+
+    """
+
+    makedirs(output, exist_ok=True)
+    _remove_shards(output)
+
+    width, height = size
+    shape = (height, width) if grayscale else (height, width, 3)
+    decode = partial(_plot_chunk, size=size, grayscale=grayscale)
+    window = window or 2 * (workers or cpu_count() or 1)
+
+    shards = []
+    exported = 0
+    shard = None
+    row = 0
+
+    with open(path.join(output, "metadata.csv.tmp"), "w",
+              newline="") as mf, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        metadata = writer(mf, delimiter=",")
+        metadata.writerow(METADATA_COLUMNS)
+
+        decoded = _decoded(executor, decode,
+                           [sample[0] for sample in samples], chunksize,
+                           window)
+
+        for position, (sample, pixels) in enumerate(zip(samples, decoded)):
+
+            if shard is None:
+                remaining = min(shard_size, len(samples) - position)
+                shard = open_memmap(path.join(output,
+                                              shard_name(len(shards))),
+                                    mode="w+", dtype=uint8,
+                                    shape=(remaining,) + shape)
+                row = 0
+
+            if pixels is not None:
+                shard[row] = pixels
+                metadata.writerow(tuple(sample[1:]) + (len(shards), row))
+                row += 1
+                exported += 1
+
+            # Every sample, decoded or not, used up a slot of the shard
+            remaining -= 1
+            if remaining == 0:
+                shards.append(_finish_shard(output, len(shards), shard, row))
+                shard = None
+
+    replace(path.join(output, "metadata.csv.tmp"),
+            path.join(output, "metadata.csv"))
+
+    description = {
+        "version": DATASET_VERSION,
+        "count": exported,
+        "shape": list(shape),
+        "dtype": "uint8",
+        "shards": shards,
+        "labels": {str(label): name for label, name in LABEL_NAMES.items()},
+        "metadata": "metadata.csv",
+    }
+    with open(path.join(output, "dataset.json"), "w") as df:
+        json.dump(description, df, indent=2)
+
+    return exported
+
+
+def _finish_shard(output, shard_number, shard, rows):
+
+    """
+
+    Flush a finished shard, cut down to the rows actually written.
+
+    Returns:
+
+        shard: dict
+            File name and number of rows of the shard
+
+    """
+
+    file_name = path.join(output, shard_name(shard_number))
+    shard.flush()
+
+    if rows < shard.shape[0]:
+        # Some plots could not be decoded, only rewrite in that case
+        tmp_name = file_name + ".tmp"
+        trimmed = open_memmap(tmp_name, mode="w+", dtype=uint8,
+                              shape=(rows,) + shard.shape[1:])
+        trimmed[:] = shard[:rows]
+        trimmed.flush()
+        del trimmed
+        del shard
+        replace(tmp_name, file_name)
+
+    return {"file": shard_name(shard_number), "rows": rows}
+
+
+def _remove_shards(output):
+
+    """
+
+    Remove the shards of a previous export to the same directory.
+
+    """
+
+    try:
+        with open(path.join(output, "dataset.json")) as df:
+            description = json.load(df)
+    except (OSError, ValueError):
+        return
+
+    for shard in description.get("shards", []):
+        try:
+            remove(path.join(output, shard["file"]))
+        except OSError:
+            pass
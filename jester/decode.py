@@ -0,0 +1,270 @@
+import logging
+
+from hashlib import sha1
+from os import environ, getpid, makedirs, path, remove, replace, scandir
+from os import stat, utime
+from threading import Lock, get_ident
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, Qt
+from PyQt5.QtGui import QImage, QImageReader
+
+from jester.archive import read_member, source_file
+from jester.render import RENDER_SIZE, is_array_file, render_file
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_directory():
+
+    cache_home = environ.get("XDG_CACHE_HOME") or path.expanduser("~/.cache")
+    return path.join(cache_home, "jester", "plots")
+
+
+def image_reader(file_name):
+
+    """
+
+    Return an image reader for a plot on disk or inside an archive.
+
+    """
+
+    data = read_member(file_name)
+
+    if data is None:
+        return QImageReader(file_name)
+
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    buffer.open(QIODevice.ReadOnly)
+    reader = QImageReader(buffer)
+    # The reader does not own the buffer, keep it alive along with it
+    reader.buffer = buffer
+
+    return reader
+
+
+def read_scaled(file_name, size):
+
+    """
+
+    Read a candidate plot, or render candidate data, at the given size.
+
+    Parameters:
+
+        file_name: str
+            Full path to the candidate plot or data file
+
+        size: QSize
+            Size of the image, plots keep their aspect ratio within it
+
+    Returns:
+
+        image: QImage
+            Candidate image, null if it could not be read
+
+    """
+
+    if is_array_file(file_name):
+        return render_file(file_name, size)
+
+    reader = image_reader(file_name)
+    reader.setScaledSize(size)
+    return reader.read()
+
+
+class DiskCache:
+
+    """
+
+    Size-bounded on-disk cache of downscaled candidate plots.
+
+    Entries are keyed by the plot path, modification time, file size
+    and the target display size, so a plot that changes on disk, or a
+    different screen, simply misses the cache. The least recently used
+    entries are removed once the cache grows over its size limit.
+
+    Parameters:
+
+        directory: str
+            Cache directory, created if it does not exist
+
+        max_bytes: int
+            Maximum total size of the cached images
+
+    """
+
+    def __init__(self, directory, max_bytes):
+
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+        self._bytes = 0
+
+        makedirs(directory, exist_ok=True)
+
+        with scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".png"):
+                    self._bytes += entry.stat().st_size
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def key(self, file_name, size):
+
+        file_stat = stat(source_file(file_name))
+        key = (f"{path.abspath(file_name)}|{file_stat.st_mtime_ns}"
+               + f"|{file_stat.st_size}|{size.width()}x{size.height()}")
+        return sha1(key.encode()).hexdigest()
+
+    def get(self, key):
+
+        cache_name = path.join(self._directory, key + ".png")
+        image = QImage(cache_name)
+
+        if image.isNull():
+            return None
+
+        # Keep the modification time as the last access time for LRU
+        try:
+            utime(cache_name)
+        except OSError:
+            pass
+
+        return image
+
+    def put(self, key, image):
+
+        cache_name = path.join(self._directory, key + ".png")
+        # The cache is shared by all the sessions on the machine, which
+        # can be saving the same plot at the same time
+        tmp_name = f"{cache_name}.{getpid()}_{get_ident()}.tmp"
+
+        if not image.save(tmp_name, "PNG"):
+            logger.warning(f"Could not save the scaled plot in {tmp_name}")
+            return
+
+        try:
+            # Another session may have cached the same plot already, it is
+            # replaced and does not take up any more space
+            replaced = stat(cache_name).st_size
+        except OSError:
+            replaced = 0
+
+        try:
+            size = stat(tmp_name).st_size
+            replace(tmp_name, cache_name)
+        except OSError as exc:
+            logger.warning(f"Could not save the scaled plot in {cache_name}:"
+                           + f" {exc}")
+            return
+
+        with self._lock:
+            self._bytes += size - replaced
+            if self._bytes > self._max_bytes:
+                self._evict()
+
+    def _evict(self):
+
+        with scandir(self._directory) as entries:
+            cached = [(entry.stat().st_mtime, entry.stat().st_size,
+                       entry.path) for entry in entries
+                      if entry.name.endswith(".png")]
+
+        cached.sort()
+        self._bytes = sum(size for _, size, _ in cached)
+
+        # Go a bit below the limit so that we do not evict on every put
+        target = 0.9 * self._max_bytes
+        for _, size, cache_name in cached:
+            if self._bytes <= target:
+                break
+            try:
+                remove(cache_name)
+                self._bytes -= size
+            except OSError:
+                pass
+
+
+class PlotDecoder:
+
+    """
+
+    Decode candidate plots directly at the display size.
+
+    Plots larger than the display area are decoded with QImageReader
+    scaled decoding, so that no time or memory is spent on pixels that
+    are never shown. Downscaled plots are kept in an optional on-disk
+    cache, so the next pass over the same night only has to load the
+    small renditions. Candidate data files are rendered straight at the
+    display size instead.
+
+    Parameters:
+
+        disk_cache: DiskCache, optional
+            Cache for the downscaled plots
+
+    """
+
+    def __init__(self, disk_cache=None):
+
+        self._disk_cache = disk_cache
+        self.size = None
+
+    def native_size(self, file_name):
+
+        if is_array_file(file_name):
+            return RENDER_SIZE
+
+        return image_reader(file_name).size()
+
+    def fit(self, native_size):
+
+        """
+
+        Return the size a plot is displayed at.
+
+        Plots are only ever scaled down, keeping their aspect ratio.
+
+        """
+
+        if self.size is None or (native_size.width() <= self.size.width()
+                                 and native_size.height()
+                                 <= self.size.height()):
+            return native_size
+
+        return native_size.scaled(self.size, Qt.KeepAspectRatio)
+
+    def __call__(self, file_name):
+
+        if is_array_file(file_name):
+            return render_file(file_name, self.fit(RENDER_SIZE))
+
+        if self.size is None:
+            return image_reader(file_name).read()
+
+        key = None
+        if self._disk_cache is not None:
+            try:
+                key = self._disk_cache.key(file_name, self.size)
+                image = self._disk_cache.get(key)
+                if image is not None:
+                    return image
+            except OSError:
+                key = None
+
+        reader = image_reader(file_name)
+        native_size = reader.size()
+        scaled_size = self.fit(native_size)
+
+        if scaled_size == native_size:
+            return reader.read()
+
+        reader.setScaledSize(scaled_size)
+        image = reader.read()
+
+        if key is not None and not image.isNull():
+            self._disk_cache.put(key, image)
+
+        return image
@@ -0,0 +1,237 @@
+from numpy import arange, flatnonzero, int64, isin, ones
+
+# Columns the filters can be applied to, as shown in the interface
+FILTER_COLUMNS = {"DM": "dm", "MJD": "mjd", "Beam": "beam"}
+
+
+def parse_beams(text):
+
+    """
+
+    Parse a list of beams such as "0, 3-5, 12".
+
+    Returns:
+
+        beams: list
+            Every beam in the list, ranges expanded
+
+    """
+
+    beams = []
+
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        start, _, stop = part.partition("-")
+        if stop:
+            beams.extend(range(int(start), int(stop) + 1))
+        else:
+            beams.append(int(start))
+
+    if not beams:
+        raise ValueError("No beams given")
+
+    return beams
+
+
+class RangeFilter:
+
+    """
+
+    Keep or remove the candidates with a parameter in a range.
+
+    Parameters:
+
+        column: str
+            Candidate parameter, one of the CandIndex columns
+
+        low: float
+            Start of the range, inclusive
+
+        high: float
+            End of the range, exclusive
+
+        exclude: bool
+            Remove the candidates in the range instead of keeping them
+
+    """
+
+    def __init__(self, column, low, high, exclude=True):
+
+        if high < low:
+            raise ValueError(f"Empty {column} range from {low} to {high}")
+
+        self.column = column
+        self.low = low
+        self.high = high
+        self.exclude = exclude
+
+    def mask(self, index):
+
+        values = index.column(self.column)
+        inside = (values >= self.low) & (values < self.high)
+        return ~inside if self.exclude else inside
+
+    def __str__(self):
+
+        action = "without" if self.exclude else "only"
+        return f"{action} {self.column.upper()} {self.low:g} to {self.high:g}"
+
+
+class RegionFilter:
+
+    """
+
+    Keep or remove the candidates in an MJD-DM rectangle.
+
+    Parameters:
+
+        mjd_range: tuple
+            MJD range, start inclusive and end exclusive
+
+        dm_range: tuple
+            DM range, start inclusive and end exclusive
+
+        exclude: bool
+            Remove the candidates in the rectangle instead of keeping them
+
+    """
+
+    def __init__(self, mjd_range, dm_range, exclude=False):
+
+        self._mjd = RangeFilter("mjd", *mjd_range, exclude=False)
+        self._dm = RangeFilter("dm", *dm_range, exclude=False)
+        self.exclude = exclude
+
+    def mask(self, index):
+
+        inside = self._mjd.mask(index) & self._dm.mask(index)
+        return ~inside if self.exclude else inside
+
+    def __str__(self):
+
+        action = "without" if self.exclude else "only"
+        return (f"{action} MJD {self._mjd.low:.6f} to {self._mjd.high:.6f}"
+                + f" and DM {self._dm.low:g} to {self._dm.high:g}")
+
+
+class BeamFilter:
+
+    """
+
+    Keep or remove the candidates from a set of beams.
+
+    Parameters:
+
+        beams: iterable
+            Beam numbers
+
+        exclude: bool
+            Remove the candidates from the beams instead of keeping them
+
+    """
+
+    def __init__(self, beams, exclude=False):
+
+        self.beams = sorted(set(beams))
+        self.exclude = exclude
+
+    def mask(self, index):
+
+        return isin(index.beam, self.beams, invert=self.exclude)
+
+    def __str__(self):
+
+        action = "without" if self.exclude else "only"
+        return f"{action} beams {', '.join(map(str, self.beams))}"
+
+
+class FilterStack:
+
+    """
+
+    Stack of candidate filters over an untouched candidate index.
+
+    Every filter is evaluated once, as a boolean mask over the full
+    index, and combined with the filters below it. Adding a filter
+    therefore costs a single vectorised pass and undoing one only drops
+    the top of the stack. The index itself is never modified, the
+    filtered view is the array of positions that passed every filter.
+
+    Parameters:
+
+        index: CandIndex
+            Candidates in the viewing order
+
+    """
+
+    def __init__(self, index):
+
+        self._index = index
+        self._filters = []
+        self._masks = [ones(len(index), dtype=bool)]
+
+    def __len__(self):
+        return len(self._filters)
+
+    def __iter__(self):
+        return iter(self._filters)
+
+    @property
+    def index(self):
+        return self._index
+
+    def push(self, candidate_filter):
+
+        """
+
+        Add a filter on top of the current ones.
+
+        Returns:
+
+            removed: int
+                Number of candidates the new filter removed from the
+                current view
+
+        """
+
+        mask = self._masks[-1] & candidate_filter.mask(self._index)
+        removed = int(self._masks[-1].sum() - mask.sum())
+        self._filters.append(candidate_filter)
+        self._masks.append(mask)
+        return removed
+
+    def pop(self):
+
+        """
+
+        Undo the most recent filter, None if there are no filters.
+
+        """
+
+        if not self._filters:
+            return None
+
+        self._masks.pop()
+        return self._filters.pop()
+
+    def clear(self):
+
+        del self._filters[:]
+        del self._masks[1:]
+
+    def mask(self):
+        return self._masks[-1]
+
+    def view(self):
+
+        """
+
+        Return the positions of the candidates passing every filter.
+
+        """
+
+        if not self._filters:
+            return arange(len(self._index), dtype=int64)
+
+        return flatnonzero(self._masks[-1])
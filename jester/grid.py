@@ -0,0 +1,390 @@
+import logging
+
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from PyQt5.QtCore import QPoint, QRect, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QPainter, QPen, QPixmap
+from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QPushButton
+from PyQt5.QtWidgets import QHBoxLayout, QVBoxLayout
+
+from jester.labels import RFI, CANDIDATE, KNOWN, UNLABELLED
+
+logger = logging.getLogger(__name__)
+
+GRID_TITLE = "MeerTRAP candidate grid"
+
+LABEL_COLOURS = {
+    RFI: QColor("red"),
+    KNOWN: QColor("orange"),
+    CANDIDATE: QColor("green"),
+}
+
+
+class GridWindow(QWidget):
+
+    """
+
+    Page of candidate thumbnails that can be labelled in bulk.
+
+    Every page is rendered into a single image in the background: the
+    thumbnails are decoded in parallel and painted onto the page, and
+    the pages around the current one are rendered ahead of time, so a
+    page flip is a single pixmap update. Labels and selection are drawn
+    on top of the pre-rendered page.
+
+    Labelling with A/S/D applies to the selected tiles or, with nothing
+    selected, to every tile on the page that is not labelled yet, after
+    which we move on to the next page. Nothing is labelled before the
+    page is on the screen. The labels are sent out with the `labelled`
+    signal as a list of candidate indices and the class name.
+
+    Parameters:
+
+        decoder: PlotDecoder
+            Decoder used for the thumbnails, its size is set to the
+            tile size
+
+        rows: int
+            Number of thumbnail rows
+
+        cols: int
+            Number of thumbnail columns
+
+        workers: int
+            Number of thumbnail decoding threads
+
+        cached_pages: int
+            Number of rendered pages kept in memory
+
+    """
+
+    labelled = pyqtSignal(list, str)
+    _page_ready = pyqtSignal(int, int, QImage, bool)
+
+    def __init__(self, decoder, rows=4, cols=4, workers=4, cached_pages=6):
+
+        super().__init__()
+
+        screen = QApplication.primaryScreen().availableGeometry()
+        width = int(screen.width() * 0.9)
+        height = int(screen.height() * 0.85)
+        self.setGeometry(50, 50, width, height)
+        self.setWindowTitle(GRID_TITLE)
+
+        self._rows = rows
+        self._cols = cols
+        self._tile_size = QSize(width // cols, (height - 60) // rows)
+        self._page_size = QSize(self._tile_size.width() * cols,
+                                self._tile_size.height() * rows)
+        self._decoder = decoder
+        self._decoder.size = self._tile_size - QSize(4, 4)
+
+        self._index = None
+        self._label_state = None
+        self._page = 0
+        self._selected = set()
+        self._generation = 0
+
+        self._cached_pages = cached_pages
+        self._pages = OrderedDict()
+        self._rendering = {}
+        # Pages that could not be rendered and only show the error
+        self._failed = set()
+        self._page_executor = ThreadPoolExecutor(max_workers=2,
+                                                 thread_name_prefix="jester-page")
+        self._tile_executor = ThreadPoolExecutor(max_workers=workers,
+                                                 thread_name_prefix="jester-tile")
+        self._page_ready.connect(self._on_page_ready)
+
+        main_box = QVBoxLayout()
+        main_box.setContentsMargins(0, 0, 0, 0)
+
+        self._page_label = QLabel()
+        self._page_label.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        self._page_label.setFixedSize(self._page_size)
+        main_box.addWidget(self._page_label)
+
+        nav_box = QHBoxLayout()
+        self._info_label = QLabel()
+        self._info_label.setStyleSheet("font-weight: bold;\
+                                        font-size: 16px")
+        nav_box.addWidget(self._info_label)
+        self._prev_button = QPushButton()
+        self._prev_button.setText("<")
+        self._prev_button.setFixedWidth(100)
+        self._prev_button.clicked.connect(self._previous_press)
+        nav_box.addWidget(self._prev_button)
+        self._next_button = QPushButton()
+        self._next_button.setText(">")
+        self._next_button.setFixedWidth(100)
+        self._next_button.clicked.connect(self._next_press)
+        nav_box.addWidget(self._next_button)
+        main_box.addLayout(nav_box)
+
+        self.setLayout(main_box)
+
+    @property
+    def tiles(self):
+        return self._rows * self._cols
+
+    def _page_count(self):
+
+        if self._index is None:
+            return 0
+
+        return (len(self._index) + self.tiles - 1) // self.tiles
+
+    def set_candidates(self, index, label_state, title=None):
+
+        """
+
+        Show a new candidate list, e.g. after loading or filtering.
+
+        Parameters:
+
+            index: CandIndex
+                Candidates in the viewing order
+
+            label_state: LabelState
+                Their classification state
+
+            title: str, optional
+                Window title, the default one if not given
+
+        """
+
+        self.setWindowTitle(title or GRID_TITLE)
+        self._index = index
+        self._label_state = label_state
+        self._generation += 1
+        self._pages.clear()
+        self._failed.clear()
+        for future in self._rendering.values():
+            future.cancel()
+        self._rendering.clear()
+        self._selected.clear()
+
+        if self.isVisible():
+            self.show_page(min(self._page, max(self._page_count() - 1, 0)))
+
+    def refresh(self):
+
+        if self.isVisible():
+            self._redraw()
+
+    def show_cand(self, idx):
+        self.show_page(idx // self.tiles)
+
+    def show_page(self, page):
+
+        if self._index is None or not (0 <= page < max(self._page_count(), 1)):
+            return
+
+        if page != self._page:
+            self._selected.clear()
+
+        self._page = page
+        self._request_page(page)
+
+        # Render the neighbouring pages, forward first
+        for neighbour in (page + 1, page + 2, page - 1):
+            if 0 <= neighbour < self._page_count():
+                self._request_page(neighbour)
+
+        self._redraw()
+
+    def _request_page(self, page):
+
+        if page in self._pages or page in self._rendering:
+            return
+
+        self._rendering[page] = self._page_executor.submit(
+            self._render_page, page, self._index, self._generation)
+
+    def _render_page(self, page, index, generation):
+
+        failed = False
+
+        try:
+            page_image = self._paint_page(page, index)
+        except CancelledError:
+            # Shutting down
+            return
+        except Exception as exc:
+            # Otherwise the page would be waiting for its image forever
+            logger.error(f"Could not render page {page + 1}: {exc}")
+            page_image = QImage(self._page_size, QImage.Format_RGB32)
+            page_image.fill(Qt.white)
+            painter = QPainter(page_image)
+            painter.drawText(page_image.rect(), Qt.AlignCenter,
+                             f"Could not render page {page + 1}: {exc}")
+            painter.end()
+            failed = True
+
+        # Hand the page over to the GUI thread
+        self._page_ready.emit(page, generation, page_image, failed)
+
+    def _paint_page(self, page, index):
+
+        start = page * self.tiles
+        stop = min(start + self.tiles, len(index))
+
+        thumbs = list(self._tile_executor.map(self._decoder,
+                                              [index.path(idx) for idx
+                                               in range(start, stop)]))
+
+        page_image = QImage(self._page_size, QImage.Format_RGB32)
+        page_image.fill(Qt.white)
+
+        painter = QPainter(page_image)
+        try:
+            painter.setPen(Qt.black)
+            for tile, thumb in enumerate(thumbs):
+                rect = self._tile_rect(tile)
+                painter.drawImage(rect.topLeft() + QPoint(2, 2), thumb)
+                painter.drawText(rect.adjusted(6, 4, -6, -4),
+                                 Qt.AlignLeft | Qt.AlignBottom,
+                                 f"{start + tile + 1}: DM {index.dm[start + tile]:.2f}")
+        finally:
+            painter.end()
+
+        return page_image
+
+    def _on_page_ready(self, page, generation, page_image, failed):
+
+        if generation != self._generation:
+            return
+
+        self._rendering.pop(page, None)
+        self._pages[page] = page_image
+        if failed:
+            self._failed.add(page)
+        while len(self._pages) > self._cached_pages:
+            self._failed.discard(self._pages.popitem(last=False)[0])
+
+        if page == self._page:
+            self._redraw()
+
+    def _tile_rect(self, tile):
+
+        row, col = divmod(tile, self._cols)
+        return QRect(QPoint(col * self._tile_size.width(),
+                            row * self._tile_size.height()),
+                     self._tile_size)
+
+    def _page_cands(self):
+
+        start = self._page * self.tiles
+        return range(start, min(start + self.tiles, len(self._index)))
+
+    def _redraw(self):
+
+        if self._index is None:
+            return
+
+        self._info_label.setText(f"Page {self._page + 1} out of"
+                                 + f" {self._page_count()},"
+                                 + f" {len(self._selected)} selected")
+
+        page_image = self._pages.get(self._page)
+        if page_image is not None:
+            self._pages.move_to_end(self._page)
+        else:
+            self._page_label.setText("Rendering...")
+            return
+
+        overlay = page_image.copy()
+        painter = QPainter(overlay)
+        start = self._page * self.tiles
+
+        for idx in self._page_cands():
+            rect = self._tile_rect(idx - start).adjusted(1, 1, -2, -2)
+            label = self._label_state.get(idx)
+            if label in LABEL_COLOURS:
+                painter.setPen(QPen(LABEL_COLOURS[label], 4))
+                painter.drawRect(rect)
+            if idx in self._selected:
+                painter.setPen(QPen(QColor("blue"), 4, Qt.DashLine))
+                painter.drawRect(rect.adjusted(5, 5, -5, -5))
+
+        painter.end()
+        self._page_label.setPixmap(QPixmap.fromImage(overlay))
+
+    def mousePressEvent(self, event):
+
+        pos = event.pos() - self._page_label.pos()
+        if not self._page_label.rect().contains(pos) or self._index is None:
+            return
+
+        tile = ((pos.y() // self._tile_size.height()) * self._cols
+                + pos.x() // self._tile_size.width())
+        idx = self._page * self.tiles + tile
+
+        if idx in self._page_cands():
+            self._selected ^= {idx}
+            self._redraw()
+
+    def keyPressEvent(self, event):
+
+        pressed = event.key()
+
+        if pressed == Qt.Key_A and event.modifiers() & Qt.ControlModifier:
+            self._selected = set(self._page_cands())
+            self._redraw()
+            return
+
+        route = {
+            Qt.Key_A: lambda: self._label_tiles("rfi"),
+            Qt.Key_S: lambda: self._label_tiles("known"),
+            Qt.Key_D: lambda: self._label_tiles("cand"),
+            Qt.Key_Z: self._previous_press,
+            Qt.Key_X: self._next_press,
+            Qt.Key_PageDown: self._previous_press,
+            Qt.Key_PageUp: self._next_press,
+            Qt.Key_Escape: self._clear_selection,
+        }
+
+        function = route.get(pressed)
+        if function:
+            function()
+
+    def _label_tiles(self, class_type):
+
+        # Only label what the labeller can actually see
+        if self._index is None or self._page not in self._pages \
+                or self._page in self._failed:
+            return
+
+        if self._selected:
+            cands = sorted(self._selected)
+            self._selected.clear()
+            next_page = False
+        else:
+            cands = [idx for idx in self._page_cands()
+                     if self._label_state.get(idx) == UNLABELLED]
+            next_page = True
+
+        if cands:
+            self.labelled.emit(cands, class_type)
+
+        if next_page and self._page + 1 < self._page_count():
+            self.show_page(self._page + 1)
+        else:
+            self._redraw()
+
+    def _clear_selection(self):
+
+        self._selected.clear()
+        self._redraw()
+
+    def _next_press(self, event=None):
+        self.show_page(self._page + 1)
+
+    def _previous_press(self, event=None):
+        self.show_page(self._page - 1)
+
+    def shutdown(self):
+
+        self._page_executor.shutdown(wait=False, cancel_futures=True)
+        self._tile_executor.shutdown(wait=False, cancel_futures=True)
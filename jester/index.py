@@ -0,0 +1,654 @@
+import json
+import logging
+
+from contextlib import contextmanager
+from heapq import merge
+from numpy import asarray, empty, float64, int32, int64, load, nan, save
+from os import makedirs, path, replace, stat
+from sys import intern
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("mjd", "dm", "beam")
+# Bumped whenever the parsed columns change
+SIDECAR_VERSION = 2
+
+# Modification time of every data directory whose sidecar index is up to
+# date apart from our own changes, see own_change
+_watched = {}
+_watched_lock = Lock()
+
+
+def parse_name(cand_name):
+
+    """
+
+    Extract MJD, DM and beam from the candidate plot file name.
+
+    Check for different naming conventions we currently use and
+    take them into account when getting that information. Supports
+    both mjd_<mjd>_dm_<dm>_beam_<beam>_... and <mjd>_dm_<dm>_beam_<beam>_...
+    as well as the FETCH candidate files,
+    cand_tstart_<mjd>_tcand_<seconds>_dm_<dm>_snr_<snr>..., which have
+    no beam
+
+    Parameters:
+
+        cand_name: str
+            Candidate plot name
+
+    Returns:
+
+        mjd: float
+            Candidate MJD, NaN if it cannot be parsed
+
+        dm: float
+            Candidate DM, NaN if it cannot be parsed
+
+        beam: int
+            Candidate beam, -1 if it is not present in the name
+
+    """
+
+    split_cand = path.splitext(cand_name)[0].split("_")
+
+    if cand_name.startswith("cand_tstart_"):
+        return _parse_fetch_name(cand_name, split_cand)
+
+    mjd_off = cand_name.startswith("mjd_")
+
+    try:
+        mjd = float(split_cand[0 + mjd_off])
+        dm = float(split_cand[2 + mjd_off])
+    except (IndexError, ValueError):
+        logger.warning(f"Could not get MJD and DM from {cand_name}")
+        return nan, nan, -1
+
+    try:
+        beam = int(split_cand[4 + mjd_off])
+    except (IndexError, ValueError):
+        beam = -1
+
+    return mjd, dm, beam
+
+
+def _parse_fetch_name(cand_name, split_cand):
+
+    # Start of the data in MJD and the candidate time within it
+    fields = dict(zip(split_cand[1::2], split_cand[2::2]))
+
+    try:
+        mjd = float(fields["tstart"]) + float(fields["tcand"]) / 86400.0
+        dm = float(fields["dm"])
+    except (KeyError, ValueError):
+        logger.warning(f"Could not get MJD and DM from {cand_name}")
+        return nan, nan, -1
+
+    return mjd, dm, -1
+
+
+def parse_names(names):
+
+    """
+
+    Parse candidate file names into the index columns.
+
+    Parameters:
+
+        names: iterable
+            Candidate plot file names or paths
+
+    Returns:
+
+        names: list
+            Interned file names, without the directory
+
+        mjd, dm, beam: array
+            Candidate parameters, see parse_name
+
+    """
+
+    names = [intern(path.basename(name)) for name in names]
+    mjd = empty(len(names), dtype=float64)
+    dm = empty(len(names), dtype=float64)
+    beam = empty(len(names), dtype=int32)
+
+    for idx, name in enumerate(names):
+        mjd[idx], dm[idx], beam[idx] = parse_name(name)
+
+    return names, mjd, dm, beam
+
+
+class CandPaths:
+
+    """
+
+    Read-only sequence of full candidate paths backed by a CandIndex.
+
+    """
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, idx):
+        return self._index.path(idx)
+
+
+class CandIndex:
+
+    """
+
+    Columnar index of the candidate plots in a directory.
+
+    Every file name is parsed exactly once and the parameters are kept
+    in compact NumPy arrays, one per column. File names are stored once,
+    interned, without the directory part, which is shared by all of
+    them.
+
+    Parameters:
+
+        directory: str
+            Directory with the candidate plots
+
+        names: list
+            Candidate plot file names, without the directory
+
+        mjd: array_like
+            Candidate MJDs
+
+        dm: array_like
+            Candidate DMs
+
+        beam: array_like
+            Candidate beams
+
+    """
+
+    def __init__(self, directory, names=(), mjd=(), dm=(), beam=()):
+
+        self._directory = directory
+        self._names = list(names)
+        self._size = len(self._names)
+        self._positions = None
+        self._mjd = asarray(mjd, dtype=float64)
+        self._dm = asarray(dm, dtype=float64)
+        self._beam = asarray(beam, dtype=int32)
+        self.paths = CandPaths(self)
+
+    @classmethod
+    def from_names(cls, directory, names):
+
+        """
+
+        Build the index by parsing the candidate file names.
+
+        Parameters:
+
+            directory: str
+                Directory with the candidate plots
+
+            names: iterable
+                Candidate plot file names or paths, in the viewing order
+
+        Returns:
+
+            index: CandIndex
+                Parsed candidate index
+
+        """
+
+        index = cls(directory)
+        index.extend(names)
+        return index
+
+    def extend(self, names):
+
+        """
+
+        Parse and append more candidates at the end of the index.
+
+        Parameters:
+
+            names: iterable
+                Candidate plot file names or paths
+
+        """
+
+        self.append(*parse_names(names))
+
+    def append(self, names, mjd, dm, beam):
+
+        """
+
+        Append already parsed candidates at the end of the index.
+
+        Column arrays grow geometrically, so appending in batches while
+        the directory is still being scanned is amortised O(1) per
+        candidate.
+
+        Parameters:
+
+            names: list
+                Candidate plot file names, without the directory
+
+            mjd, dm, beam: array_like
+                Candidate parameters, see parse_names
+
+        """
+
+        added = len(names)
+
+        if added == 0:
+            return
+
+        start = self._size
+        end = start + added
+
+        if end > self._mjd.shape[0]:
+            capacity = max(2 * self._mjd.shape[0], end, 1024)
+            self._mjd = self._grow(self._mjd, capacity)
+            self._dm = self._grow(self._dm, capacity)
+            self._beam = self._grow(self._beam, capacity)
+
+        self._mjd[start:end] = mjd
+        self._dm[start:end] = dm
+        self._beam[start:end] = beam
+
+        if self._positions is not None:
+            self._positions.update((name, idx) for idx, name
+                                   in enumerate(names, start))
+
+        self._names.extend(names)
+        self._size = end
+
+    def _grow(self, column, capacity):
+
+        grown = empty(capacity, dtype=column.dtype)
+        grown[:self._size] = column[:self._size]
+        return grown
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def mjd(self):
+        return self._mjd[:self._size]
+
+    @property
+    def dm(self):
+        return self._dm[:self._size]
+
+    @property
+    def beam(self):
+        return self._beam[:self._size]
+
+    def name(self, idx):
+        return self._names[idx]
+
+    def path(self, idx):
+        return path.join(self._directory, self._names[idx])
+
+    def column(self, column):
+
+        if column not in COLUMNS:
+            raise ValueError(f"Unknown candidate parameter {column}")
+
+        return getattr(self, column)
+
+    def find(self, cand_name):
+
+        """
+
+        Return the position of the candidate with the given file name.
+
+        The name to position map is only built the first time it is
+        needed.
+
+        """
+
+        if self._positions is None:
+            self._positions = {name: idx for idx, name
+                               in enumerate(self._names)}
+
+        return self._positions.get(cand_name)
+
+    def sort(self, keep=None, run=16384):
+
+        """
+
+        Return the positions that put the candidates in file name order.
+
+        The positions are sorted in runs that are merged afterwards. A
+        single sort with a built-in key would hold the GIL until it is
+        done and freeze the interface while sorting in the background.
+
+        Parameters:
+
+            keep: sequence, optional
+                Only sort these positions, e.g. to leave out candidates
+                that are gone. Defaults to all the candidates
+
+            run: int
+                Number of positions sorted in one go
+
+        """
+
+        keep = range(self._size) if keep is None else keep
+        key = self._names.__getitem__
+        runs = [sorted(keep[start:start + run], key=key)
+                for start in range(0, len(keep), run)]
+
+        return asarray(list(merge(*runs, key=key)), dtype=int64)
+
+    def take(self, keep):
+
+        """
+
+        Return the index of a subset of the candidates.
+
+        Parameters:
+
+            keep: array_like
+                Positions of the candidates to keep, in the new order
+
+        Returns:
+
+            index: CandIndex
+                Index with only the kept candidates
+
+        """
+
+        keep = asarray(keep, dtype=int64)
+
+        return CandIndex(self._directory,
+                         [self._names[idx] for idx in keep],
+                         self.mjd[keep], self.dm[keep], self.beam[keep])
+
+
+def sidecar_path(directory, extension):
+
+    # Archives get their index next to them rather than inside
+    if path.isfile(directory):
+        return f"{directory}.jester_index_{extension.lstrip('.')}"
+
+    return path.join(directory, f".jester_index_{extension.lstrip('.')}")
+
+
+def save_sidecar(index, extension):
+
+    """
+
+    Save the index next to the candidate plots.
+
+    The numeric columns are saved as .npy files that can be memory
+    mapped on the next start and the file names as a single newline
+    separated text file. The directory modification time is recorded
+    so that we can tell when the index goes out of date.
+
+    Parameters:
+
+        index: CandIndex
+            Index of all the candidates in the directory, sorted
+
+        extension: str
+            Plot file extension the index was built for
+
+    """
+
+    sidecar = sidecar_path(index.directory, extension)
+
+    try:
+        makedirs(sidecar, exist_ok=True)
+
+        for column in COLUMNS:
+            with open(path.join(sidecar, column + ".npy.tmp"), "wb") as cf:
+                save(cf, index.column(column))
+            replace(path.join(sidecar, column + ".npy.tmp"),
+                    path.join(sidecar, column + ".npy"))
+
+        with open(path.join(sidecar, "names.txt.tmp"), "w",
+                  encoding="utf-8") as nf:
+            nf.write("\n".join(index.names))
+        replace(path.join(sidecar, "names.txt.tmp"),
+                path.join(sidecar, "names.txt"))
+
+        # Only after the sidecar directory itself has been created, as
+        # this changes the modification time of the data directory
+        meta = {
+            "version": SIDECAR_VERSION,
+            "extension": extension,
+            "count": len(index),
+            "mtime_ns": stat(index.directory).st_mtime_ns,
+        }
+
+        with open(path.join(sidecar, "meta.json.tmp"), "w") as mf:
+            json.dump(meta, mf)
+        replace(path.join(sidecar, "meta.json.tmp"),
+                path.join(sidecar, "meta.json"))
+        watch_directory(index.directory, meta["mtime_ns"])
+    except OSError as exc:
+        logger.warning(f"Could not save the candidate index in {sidecar}:"
+                       + f" {exc}")
+
+
+def load_sidecar(directory, extension):
+
+    """
+
+    Load the index saved by a previous session.
+
+    Parameters:
+
+        directory: str
+            Directory with the candidate plots
+
+        extension: str
+            Plot file extension
+
+    Returns:
+
+        index: CandIndex or None
+            Index with memory-mapped columns, None if there is no usable
+            sidecar index
+
+        fresh: bool
+            True if the directory has not changed since the index was
+            saved, False if it has to be rescanned for new files
+
+    """
+
+    sidecar = sidecar_path(directory, extension)
+
+    try:
+        with open(path.join(sidecar, "meta.json")) as mf:
+            meta = json.load(mf)
+
+        if (meta["version"] != SIDECAR_VERSION
+                or meta["extension"] != extension):
+            return None, False
+
+        with open(path.join(sidecar, "names.txt"), encoding="utf-8") as nf:
+            names = nf.read()
+        names = [intern(name) for name in names.split("\n")] if names else []
+
+        columns = [load(path.join(sidecar, column + ".npy"), mmap_mode="r")
+                   for column in COLUMNS]
+    except (OSError, ValueError, KeyError) as exc:
+        logger.debug(f"No usable candidate index in {sidecar}: {exc}")
+        return None, False
+
+    if any(column.shape[0] != meta["count"] for column in columns) \
+            or len(names) != meta["count"]:
+        logger.warning(f"Candidate index in {sidecar} is corrupted")
+        return None, False
+
+    fresh = stat(directory).st_mtime_ns == meta["mtime_ns"]
+    if fresh:
+        watch_directory(directory, meta["mtime_ns"])
+
+    return CandIndex(directory, names, *columns), fresh
+
+
+def watch_directory(directory, mtime_ns):
+
+    """
+
+    Start telling our own changes to a data directory from the others.
+
+    Parameters:
+
+        directory: str
+            Directory with the candidate plots
+
+        mtime_ns: int
+            Modification time of the directory when its sidecar index
+            was known to be up to date
+
+    """
+
+    with _watched_lock:
+        _watched[path.realpath(directory)] = mtime_ns
+
+
+@contextmanager
+def own_change(file_name):
+
+    """
+
+    Wrap our own changes to the entries of a data directory.
+
+    Creating, replacing or removing a file changes the modification time
+    of its directory, which makes the sidecar index look stale. If the
+    directory has not been changed by anything else since the index was
+    known to be up to date or since our previous change, its new
+    modification time is remembered so that restamp_sidecar can tell it
+    apart. Otherwise the directory is no longer watched and the index
+    stays stale.
+
+    Parameters:
+
+        file_name: str
+            File that is going to be created, replaced or removed
+
+    """
+
+    directory = path.realpath(path.dirname(path.abspath(file_name)))
+
+    with _watched_lock:
+        watched = directory in _watched
+        if watched and _mtime_ns(directory) != _watched[directory]:
+            del _watched[directory]
+            watched = False
+
+        try:
+            yield
+        finally:
+            if watched:
+                _watched[directory] = _mtime_ns(directory)
+
+
+def _mtime_ns(directory):
+
+    try:
+        return stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+
+def restamp_sidecar(directory, extension):
+
+    """
+
+    Mark the saved index as up to date again after our own writes.
+
+    Saving the results next to the plots changes the modification time
+    of the directory, which would make the index look stale on the next
+    start. If all the changes since the index was known to be up to date
+    were our own, see own_change, the recorded modification time is
+    updated instead. Nothing is rescanned.
+
+    Parameters:
+
+        directory: str
+            Directory with the candidate plots
+
+        extension: str
+            Plot file extension
+
+    """
+
+    with _watched_lock:
+        expected = _watched.pop(path.realpath(directory), None)
+
+    # Nothing we write ends up inside an archive
+    if expected is None or path.isfile(directory):
+        return
+
+    sidecar = sidecar_path(directory, extension)
+
+    try:
+        mtime_ns = stat(directory).st_mtime_ns
+        if mtime_ns != expected:
+            return
+
+        with open(path.join(sidecar, "meta.json")) as mf:
+            meta = json.load(mf)
+
+        if meta["mtime_ns"] == mtime_ns:
+            return
+
+        meta["mtime_ns"] = mtime_ns
+        with open(path.join(sidecar, "meta.json.tmp"), "w") as mf:
+            json.dump(meta, mf)
+        replace(path.join(sidecar, "meta.json.tmp"),
+                path.join(sidecar, "meta.json"))
+    except (OSError, ValueError, KeyError) as exc:
+        logger.debug(f"Could not update the candidate index in {sidecar}:"
+                     + f" {exc}")
+
+
+def load_index(directory, extension):
+
+    """
+
+    Load the candidate index without any GUI involved.
+
+    Uses the sidecar index if it is up to date and scans the directory
+    otherwise.
+
+    Parameters:
+
+        directory: str
+            Directory with the candidate plots
+
+        extension: str
+            Plot file extension
+
+    Returns:
+
+        index: CandIndex
+            Index of all the candidates, sorted by file name
+
+    """
+
+    from jester.loader import scan_directory
+
+    index, fresh = load_sidecar(directory, extension)
+
+    if not fresh:
+        index = CandIndex.from_names(directory,
+                                     scan_directory(directory, extension))
+
+    return index
@@ -0,0 +1,910 @@
+import logging
+import sqlite3
+
+from abc import ABC, abstractmethod
+from collections import Counter
+from csv import reader, writer
+from numpy import asarray, bincount, concatenate, flatnonzero, full, int8
+from numpy import int64, zeros
+from os import fsync, path, replace, stat
+from queue import Empty, Queue
+from threading import Event, Thread
+from time import monotonic, perf_counter
+
+from jester.index import own_change
+
+logger = logging.getLogger(__name__)
+
+UNLABELLED = -1
+RFI = 0
+CANDIDATE = 1
+KNOWN = 2
+NUM_LABELS = 3
+LABEL_NAMES = {RFI: "rfi", CANDIDATE: "candidate", KNOWN: "known"}
+
+
+class LabelState:
+
+    """
+
+    Classification state of every candidate in the viewing list.
+
+    Labels are kept in a compact per-candidate array, with UNLABELLED
+    for candidates not classified yet, together with per-class counters.
+    Looking up, setting and changing a label and reading the counts are
+    all O(1).
+
+    Parameters:
+
+        size: int
+            Number of candidates
+
+    """
+
+    def __init__(self, size):
+
+        self._labels = full(size, UNLABELLED, dtype=int8)
+        self._counts = zeros(NUM_LABELS, dtype=int64)
+
+    def __len__(self):
+        return self._labels.shape[0]
+
+    @property
+    def labels(self):
+
+        labels = self._labels.view()
+        labels.flags.writeable = False
+        return labels
+
+    def get(self, idx):
+        return int(self._labels[idx])
+
+    def set(self, idx, label):
+
+        """
+
+        Set the label of a single candidate.
+
+        Parameters:
+
+            idx: int
+                Candidate index
+
+            label: int
+                New candidate label
+
+        Returns:
+
+            old_label: int
+                Previous label, UNLABELLED if there was none
+
+        """
+
+        old_label = int(self._labels[idx])
+
+        if old_label != label:
+            if old_label != UNLABELLED:
+                self._counts[old_label] -= 1
+            self._counts[label] += 1
+            self._labels[idx] = label
+
+        return old_label
+
+    def count(self, label):
+        return int(self._counts[label])
+
+    def update(self, indices, labels):
+
+        """
+
+        Set the labels of many candidates at once, e.g. on resume.
+
+        Parameters:
+
+            indices: array_like
+                Candidate indices, each at most once
+
+            labels: array_like
+                New labels, UNLABELLED leaves the candidate unclassified
+
+        """
+
+        # Only the updated candidates are recounted, as this is called
+        # for every batch while loading
+        self._counts -= self._count_labels(self._labels[indices])
+        self._labels[indices] = labels
+        self._counts += self._count_labels(self._labels[indices])
+
+    @staticmethod
+    def _count_labels(labels):
+
+        labels = labels[labels != UNLABELLED]
+        return bincount(labels, minlength=NUM_LABELS).astype(int64)
+
+    def first(self, label=UNLABELLED, start=0):
+
+        """
+
+        Return the index of the first candidate with the given label.
+
+        Returns:
+
+            idx: int or None
+                Candidate index, None if there is no such candidate
+
+        """
+
+        found = flatnonzero(self._labels[start:] == label)
+        return int(found[0]) + start if found.size else None
+
+    def extend(self, size):
+        self._labels = concatenate([self._labels,
+                                    full(size, UNLABELLED, dtype=int8)])
+
+    def indices(self, label):
+        return flatnonzero(self._labels == label)
+
+    def take(self, keep):
+
+        """
+
+        Return the state of a subset of the candidates.
+
+        Parameters:
+
+            keep: array_like
+                Indices of the candidates to keep, in the new order
+
+        Returns:
+
+            state: LabelState
+                Classification state of the kept candidates
+
+        """
+
+        state = LabelState(0)
+        state._labels = self._labels[asarray(keep, dtype=int64)]
+        state._recount()
+        return state
+
+    def _recount(self):
+
+        self._counts = self._count_labels(self._labels)
+
+
+class LabelStore(ABC):
+
+    """
+
+    Base class for the candidate label backends.
+
+    Keeps the current label of every classified candidate in memory,
+    keyed by the candidate file name, so that both inserting a new label
+    and correcting an old one are O(1). Subclasses only have to persist
+    the changes.
+
+    Parameters:
+
+        file_name: str
+            Path of the results file in the classic
+            "file name, label" CSV format
+
+    """
+
+    def __init__(self, file_name):
+
+        self._file_name = file_name
+        self._labels = {}
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __contains__(self, cand_name):
+        return cand_name in self._labels
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    def get(self, cand_name, default=None):
+        return self._labels.get(cand_name, default)
+
+    def items(self):
+        return self._labels.items()
+
+    def set(self, cand_name, label):
+
+        """
+
+        Insert or update the label of a single candidate.
+
+        Parameters:
+
+            cand_name: str
+                Candidate plot file name
+
+            label: int
+                New candidate label
+
+        Returns:
+
+            old_label: int or None
+                Previous label of the candidate, None if it was not
+                labelled before
+
+        """
+
+        old_label = self._labels.get(cand_name)
+        self._labels[cand_name] = label
+        self._write([(cand_name, label)])
+        return old_label
+
+    def set_many(self, labels):
+
+        labels = list(labels)
+        self._labels.update(labels)
+        self._write(labels)
+
+    def export(self, file_name=None):
+
+        """
+
+        Write the current labels in the results CSV format.
+
+        Every candidate appears only once, with its latest label, in the
+        order it was first labelled.
+
+        Parameters:
+
+            file_name: str, optional
+                Output file. Defaults to the results file of the store
+
+        """
+
+        file_name = file_name or self._file_name
+        tmp_name = file_name + ".tmp"
+
+        with own_change(file_name):
+            with open(tmp_name, "w", newline="") as tf:
+                tmp_csv = writer(tf, delimiter=",")
+                tmp_csv.writerows(self._labels.items())
+
+            replace(tmp_name, file_name)
+
+    def flush(self):
+        pass
+
+    def sync(self):
+
+        """
+
+        Make sure the labels written so far survive a crash.
+
+        """
+
+        self.flush()
+
+    def update_results(self):
+
+        """
+
+        Make sure the results file holds all the labels so far, e.g.
+        for other labellers to read.
+
+        """
+
+        self.flush()
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def _write(self, labels):
+        pass
+
+
+class CsvJournalStore(LabelStore):
+
+    """
+
+    Label store using the results CSV file as an append-only journal.
+
+    Every label, including corrections, is appended as a new row and the
+    last row for a given candidate wins. The file is compacted, i.e.
+    rewritten with one row per candidate, once the number of superseded
+    rows grows above a fraction of the labelled candidates and when the
+    store is closed, keeping the corrections amortised O(1).
+
+    Parameters:
+
+        file_name: str
+            Path of the results CSV file. Existing labels are loaded
+
+        compact_ratio: float
+            Fraction of superseded rows that triggers the compaction
+
+        compact_min: int
+            Minimum number of superseded rows before compacting
+
+    """
+
+    def __init__(self, file_name, compact_ratio=0.5, compact_min=1024):
+
+        super().__init__(file_name)
+
+        self._compact_ratio = compact_ratio
+        self._compact_min = compact_min
+        self._rows = 0
+
+        if path.isfile(file_name):
+            for cand_name, label in read_results(file_name):
+                self._labels[cand_name] = label
+                self._rows += 1
+
+        with own_change(file_name):
+            self._file = open(file_name, "a", buffering=1, newline="")
+        self._csv = writer(self._file, delimiter=",")
+
+    @property
+    def stale_rows(self):
+        return self._rows - len(self._labels)
+
+    def compact(self):
+
+        self._file.close()
+        try:
+            self.export()
+            self._rows = len(self._labels)
+        finally:
+            # Keep journalling even if the rewrite failed
+            self._file = open(self._file_name, "a", buffering=1,
+                              newline="")
+            self._csv = writer(self._file, delimiter=",")
+
+    def flush(self):
+        self._file.flush()
+
+    def sync(self):
+
+        self._file.flush()
+        fsync(self._file.fileno())
+
+    def close(self):
+
+        if self._file.closed:
+            return
+
+        if self.stale_rows > 0:
+            self.compact()
+
+        self._file.close()
+
+    def _write(self, labels):
+
+        self._csv.writerows(labels)
+        self._rows += len(labels)
+
+        if self.stale_rows > max(self._compact_min,
+                                 self._compact_ratio * len(self._labels)):
+            self.compact()
+
+
+class SqliteLabelStore(LabelStore):
+
+    """
+
+    Label store backed by an SQLite database next to the results file.
+
+    The results CSV is only written on request and when the store is
+    closed. Labels written to it in the meantime by anything else, e.g.
+    a session with the CSV store, are picked up when the store is opened.
+
+    Parameters:
+
+        file_name: str
+            Path of the results CSV file. The database is saved as
+            `file_name` with an additional ".sqlite" extension
+
+    """
+
+    def __init__(self, file_name):
+
+        super().__init__(file_name)
+
+        self._db_name = file_name + ".sqlite"
+
+        with own_change(self._db_name):
+            # Can be written to from the write-behind thread
+            self._db = sqlite3.connect(self._db_name,
+                                       check_same_thread=False)
+            # Keep the rollback journal around rather than creating and
+            # deleting it on every commit, which would change the data
+            # directory every time
+            self._db.execute("PRAGMA journal_mode = TRUNCATE")
+            self._db.execute("CREATE TABLE IF NOT EXISTS labels "
+                             + "(name TEXT PRIMARY KEY, label INTEGER)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta "
+                             + "(key TEXT PRIMARY KEY, value INTEGER)")
+            # A write, so that the journal is created here
+            self._db.execute("INSERT INTO meta (key, value) VALUES"
+                             + " ('opened', 1) ON CONFLICT(key)"
+                             + " DO UPDATE SET value = value + 1")
+            self._db.commit()
+
+        self._labels.update(self._db.execute("SELECT name, label FROM labels"
+                                             + " ORDER BY rowid"))
+
+        # Pick up the labels from a plain results file if we are
+        # switching backends in the middle of a night
+        if path.isfile(file_name):
+            try:
+                self._pick_up_results()
+            except ValueError:
+                self._db.close()
+                raise
+
+    def _pick_up_results(self):
+
+        exported = self._db.execute("SELECT value FROM meta WHERE key ="
+                                    + " 'exported_mtime_ns'").fetchone()
+        mtime_ns = stat(self._file_name).st_mtime_ns
+
+        # Still our own export, nothing new in there
+        if exported is not None and exported[0] == mtime_ns:
+            return
+
+        # The last row of a candidate wins, as in a CSV journal
+        results = dict(read_results(self._file_name))
+        changed = [(cand_name, label) for cand_name, label in results.items()
+                   if self._labels.get(cand_name) != label]
+
+        if not changed:
+            return
+
+        # Without an export of ours to go by, the results file can only
+        # be trusted to be newer if it was written after the database
+        if exported is None and self._labels \
+                and mtime_ns < stat(self._db_name).st_mtime_ns:
+            raise ValueError(f"{self._file_name} and {self._db_name} disagree"
+                             + f" on {len(changed)} labels and the database"
+                             + " is newer. Move one of them out of the way"
+                             + " to keep the other")
+
+        logger.info(f"Picking up {len(changed)} labels from"
+                    + f" {self._file_name}")
+        self.set_many(changed)
+
+    def close(self):
+
+        if self._db is None:
+            return
+
+        self._db.commit()
+        self._export_results()
+        self._db.close()
+        self._db = None
+
+    def flush(self):
+        self._db.commit()
+
+    def update_results(self):
+
+        self.flush()
+        self._export_results()
+
+    def _export_results(self):
+
+        self.export()
+        # So that the next session can tell whether anything else has
+        # written to the results file since
+        self._db.execute("INSERT INTO meta (key, value) VALUES"
+                         + " ('exported_mtime_ns', ?) ON CONFLICT(key)"
+                         + " DO UPDATE SET value = excluded.value",
+                         (stat(self._file_name).st_mtime_ns,))
+        self._db.commit()
+
+    def _write(self, labels):
+
+        # Upsert rather than INSERT OR REPLACE, so that the rowid, and
+        # therefore the export order, is preserved for corrections
+        self._db.executemany("INSERT INTO labels (name, label) VALUES (?, ?)"
+                             + " ON CONFLICT(name) DO UPDATE"
+                             + " SET label = excluded.label", labels)
+        self._db.commit()
+
+
+class WriteBehindStore(LabelStore):
+
+    """
+
+    Write-behind wrapper persisting the labels on a background thread.
+
+    Labels are updated in memory straight away and queued. A writer
+    thread takes everything that is waiting in the queue and writes it
+    to the wrapped store in one go, so a burst of labels becomes a single
+    grouped write and the caller never waits on the disk. The writes are
+    synced to the disk at least every `sync_interval` seconds while there
+    is anything new, which bounds what a crash can lose to that window.
+    Labels that could not be written are kept and tried again, and
+    whatever is still left once the writer thread is gone is written by
+    the caller of flush or close, or reported if that fails too.
+
+    Parameters:
+
+        store: LabelStore
+            Store the labels are persisted with. Only used from the
+            writer thread while it is running
+
+        sync_interval: float
+            Longest time in seconds a label can go without being synced
+
+        timings: LatencyRecorder, optional
+            Records the latency of the grouped writes and syncs
+
+    """
+
+    def __init__(self, store, sync_interval=2.0, timings=None):
+
+        super().__init__(store.file_name)
+
+        self._store = store
+        self._labels.update(store.items())
+        self._sync_interval = sync_interval
+        self._timings = timings
+
+        self._queue = Queue()
+        self._stop = Event()
+        self._batches = 0
+        self._written = 0
+        self._largest_batch = 0
+        self._errors = 0
+        # Labels the store has refused so far, in the labelling order
+        self._unwritten = []
+        self._closed = False
+
+        self._writer = Thread(target=self._run, name="label-writer",
+                              daemon=True)
+        self._writer.start()
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def stats(self):
+
+        return {
+            "queued": self.pending,
+            "written": self._written,
+            "batches": self._batches,
+            "largest_batch": self._largest_batch,
+            "errors": self._errors,
+            "unwritten": len(self._unwritten),
+        }
+
+    def flush(self):
+
+        """
+
+        Wait until all the queued labels are written and synced.
+
+        """
+
+        self._wait()
+
+    def update_results(self):
+
+        """
+
+        Wait until all the queued labels are in the results file.
+
+        """
+
+        self._wait(update=True)
+
+    def _wait(self, update=False):
+
+        done = Event()
+
+        if self._writer.is_alive():
+            self._queue.put((done, update))
+            # Never wait for a writer thread that has died in the meantime
+            while not done.wait(0.5) and self._writer.is_alive():
+                pass
+
+        if not done.is_set():
+            self._write_left(update)
+        elif self._unwritten:
+            logger.error(f"{len(self._unwritten)} labels are not saved in"
+                         + f" {self._file_name} yet")
+
+    def close(self):
+
+        if self._closed:
+            return
+
+        self._closed = True
+
+        try:
+            if self._writer.is_alive():
+                self.flush()
+                self._stop.set()
+                self._queue.put(None)
+                self._writer.join()
+            self._write_left()
+        finally:
+            self._store.close()
+
+    def _write_left(self, update=False):
+
+        # Only called once the writer thread is gone, so nobody else is
+        # using the store
+        labels = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Empty:
+                break
+            if isinstance(item, list):
+                labels.extend(item)
+            elif item is not None:
+                item[0].set()
+
+        if labels or self._unwritten:
+            self._set_many(labels)
+
+        try:
+            self._store.sync()
+            if update:
+                self._store.update_results()
+        except Exception as exc:
+            self._errors += 1
+            logger.error(f"Could not sync {self._file_name}: {exc}")
+
+        if self._unwritten:
+            logger.error(f"{len(self._unwritten)} labels could not be saved"
+                         + f" in {self._file_name}")
+
+    def _write(self, labels):
+        self._queue.put(labels)
+
+    def _set_many(self, labels):
+
+        # Labels refused before go first, so the order is kept
+        labels = self._unwritten + labels
+        self._unwritten = []
+
+        start = perf_counter()
+        try:
+            self._store.set_many(labels)
+        except Exception as exc:
+            # Kept for the next attempt rather than dropped
+            self._unwritten = labels
+            self._errors += 1
+            logger.error(f"Could not save {len(labels)} labels in"
+                         + f" {self._file_name}: {exc}")
+            return False
+        finally:
+            self._record("label_write", perf_counter() - start)
+
+        self._batches += 1
+        self._written += len(labels)
+        self._largest_batch = max(self._largest_batch, len(labels))
+
+        return True
+
+    def _run(self):
+
+        dirty = False
+        next_sync = monotonic() + self._sync_interval
+
+        while True:
+            try:
+                timeout = max(next_sync - monotonic(), 0.0) \
+                    if dirty or self._unwritten else None
+                items = [self._queue.get(timeout=timeout)]
+            except Empty:
+                items = []
+
+            # Group everything that piled up during the previous write
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except Empty:
+                    break
+
+            labels = []
+            waiting = []
+            for item in items:
+                if isinstance(item, list):
+                    labels.extend(item)
+                elif item is not None:
+                    waiting.append(item)
+
+            if labels:
+                dirty |= self._set_many(labels)
+
+            due = waiting or monotonic() >= next_sync or self._stop.is_set()
+
+            if due and (dirty or self._unwritten):
+                # Labels refused before are tried again at the sync rate
+                if self._unwritten:
+                    dirty |= self._set_many([])
+
+                start = perf_counter()
+                try:
+                    self._store.sync()
+                    dirty = False
+                except Exception as exc:
+                    self._errors += 1
+                    logger.error(f"Could not sync {self._file_name}: {exc}")
+                self._record("label_sync", perf_counter() - start)
+                next_sync = monotonic() + self._sync_interval
+
+            if any(update for _, update in waiting):
+                try:
+                    self._store.update_results()
+                except Exception as exc:
+                    self._errors += 1
+                    logger.error(f"Could not update {self._file_name}:"
+                                 + f" {exc}")
+
+            for done, _ in waiting:
+                done.set()
+
+            if self._stop.is_set() and self._queue.empty():
+                break
+
+    def _record(self, stage, seconds):
+
+        if self._timings is not None:
+            self._timings.record(stage, seconds)
+
+
+def read_results(file_name):
+
+    """
+
+    Stream the (file name, label) rows of a results file.
+
+    Parameters:
+
+        file_name: str
+            Path of the results CSV file
+
+    Yields:
+
+        cand_name: str
+            Candidate plot file name
+
+        label: int
+            Candidate label
+
+    """
+
+    with open(file_name, newline="") as rf:
+        for line, row in enumerate(reader(rf, delimiter=","), 1):
+            if len(row) < 2:
+                continue
+            try:
+                label = int(row[1])
+            except ValueError:
+                # e.g. a row torn by a crash in the middle of a write
+                logger.warning(f"Skipping malformed row {line} of"
+                               + f" {file_name}: {','.join(row)}")
+                continue
+            yield row[0], label
+
+
+def merge_results(inputs, output, policy="last"):
+
+    """
+
+    Merge the results files of several classifiers into a single one.
+
+    Input files are streamed row by row, so only one label, or one set
+    of votes with the majority policy, per candidate is kept in memory.
+
+    Parameters:
+
+        inputs: list
+            Paths of the results CSV files to merge
+
+        output: str
+            Path of the merged results CSV file
+
+        policy: str
+            How to resolve candidates labelled more than once: "last"
+            keeps the last label in the input order, "majority" keeps
+            the most common one, with ties going to the latest label
+
+    Returns:
+
+        merged: int
+            Number of candidates in the merged file
+
+        conflicts: int
+            Number of candidates with conflicting labels
+
+    """
+
+    if policy not in ("last", "majority"):
+        raise ValueError(f"Unknown merge policy {policy}")
+
+    labels = {}
+    votes = {}
+    conflicting = set()
+
+    for file_name in inputs:
+        for cand_name, label in read_results(file_name):
+            old_label = labels.get(cand_name)
+            if old_label is not None and old_label != label:
+                conflicting.add(cand_name)
+
+            if policy == "majority":
+                cand_votes = votes.setdefault(cand_name, Counter())
+                cand_votes[label] += 1
+                top = max(cand_votes.values())
+                if cand_votes[label] < top:
+                    continue
+
+            labels[cand_name] = label
+
+    tmp_name = output + ".tmp"
+    with own_change(output):
+        with open(tmp_name, "w", newline="") as of:
+            writer(of, delimiter=",").writerows(labels.items())
+        replace(tmp_name, output)
+
+    return len(labels), len(conflicting)
+
+
+LABEL_STORES = {
+    "csv": CsvJournalStore,
+    "sqlite": SqliteLabelStore,
+}
+
+
+def open_label_store(file_name, backend="csv", write_behind=False,
+                     sync_interval=2.0, timings=None):
+
+    """
+
+    Open the label store for the given results file.
+
+    Parameters:
+
+        file_name: str
+            Path of the results CSV file
+
+        backend: str
+            Name of the backend, one of the LABEL_STORES keys
+
+        write_behind: bool
+            Persist the labels on a background thread, see
+            WriteBehindStore
+
+        sync_interval: float
+            Longest time in seconds a label can go without being synced
+            to the disk in the write-behind mode
+
+        timings: LatencyRecorder, optional
+            Records the write-behind write and sync latencies
+
+    Returns:
+
+        store: LabelStore
+            Opened label store with any existing labels loaded
+
+    """
+
+    if backend not in LABEL_STORES:
+        raise ValueError(f"Unknown label store {backend}."
+                         + f" Available: {', '.join(LABEL_STORES)}")
+
+    logger.debug(f"Opening {backend} label store for {file_name}")
+    store = LABEL_STORES[backend](file_name)
+
+    if write_behind:
+        store = WriteBehindStore(store, sync_interval, timings)
+
+    return store
@@ -0,0 +1,182 @@
+import logging
+
+from os import scandir
+from queue import Empty, Queue
+from threading import Event, Thread
+
+from jester.archive import is_archive, open_archive
+from jester.index import parse_names
+
+logger = logging.getLogger(__name__)
+
+
+def scan_directory(directory, extension):
+
+    """
+
+    Return the sorted names of all the candidate plots in a directory.
+
+    Parameters:
+
+        directory: str
+            Directory with the candidate plots, or a tar or zip archive
+
+        extension: str
+            Plot file extension
+
+    Returns:
+
+        names: list
+            Sorted plot file names, without the directory
+
+    """
+
+    if is_archive(directory):
+        return sorted(open_archive(directory).names(extension))
+
+    with scandir(directory) as entries:
+        return sorted(entry.name for entry in entries
+                      if _is_plot(entry, extension))
+
+
+def _is_plot(entry, extension):
+
+    # Skip the hidden files, just like glob does
+    return (not entry.name.startswith(".")
+            and entry.name.endswith(extension)
+            and entry.is_file())
+
+
+class DirectoryScanner:
+
+    """
+
+    Scan a candidate directory in the background.
+
+    File names are found with os.scandir on a worker thread, in the
+    directory order, parsed into the index columns on the same thread
+    and handed over in batches. The first plot is sent on its own so
+    that it can be shown straight away. Archives are indexed on the
+    same thread and their members sent in the archive order.
+
+    Parameters:
+
+        directory: str
+            Directory with the candidate plots, or a tar or zip archive
+
+        extension: str
+            Plot file extension
+
+        batch_size: int
+            Number of file names sent in a single batch
+
+        known: list
+            Names we already have, e.g. from a stale sidecar index. They
+            are not sent again, only checked for being still there
+
+    """
+
+    def __init__(self, directory, extension, batch_size=4096, known=()):
+
+        self._directory = directory
+        self._extension = extension
+        self._batch_size = batch_size
+        self._known = known
+        self._batches = Queue()
+        self._stop = Event()
+        self._thread = Thread(target=self._scan, name="jester-scan",
+                              daemon=True)
+        self.finished = False
+        # Positions in `known` of the names that are gone
+        self.removed = []
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def poll(self, max_batches=None):
+
+        """
+
+        Return the candidates found since the last call.
+
+        Does not block. Sets `finished` once the whole directory has
+        been scanned and all the candidates have been returned.
+
+        Parameters:
+
+            max_batches: int, optional
+                Return at most this many batches, the rest is left for
+                the next call. Defaults to everything that is waiting
+
+        Returns:
+
+            batches: list
+                Parsed (names, mjd, dm, beam) batches in the directory
+                order, see parse_names
+
+        """
+
+        batches = []
+
+        while max_batches is None or len(batches) < max_batches:
+            try:
+                batch = self._batches.get_nowait()
+            except Empty:
+                break
+
+            if batch is None:
+                self.finished = True
+                break
+
+            batches.append(batch)
+
+        return batches
+
+    def _names(self):
+
+        if is_archive(self._directory):
+            yield from open_archive(self._directory).names(self._extension)
+            return
+
+        with scandir(self._directory) as entries:
+            for entry in entries:
+                if _is_plot(entry, self._extension):
+                    yield entry.name
+
+    def _scan(self):
+
+        known = set(self._known)
+        seen = set()
+        batch = []
+        batch_size = 1
+        complete = False
+
+        try:
+            for name in self._names():
+                if self._stop.is_set():
+                    break
+
+                if name in known:
+                    seen.add(name)
+                    continue
+
+                batch.append(name)
+                if len(batch) >= batch_size:
+                    self._batches.put(parse_names(batch))
+                    batch = []
+                    batch_size = self._batch_size
+            else:
+                complete = True
+        except (OSError, ValueError) as exc:
+            logger.error(f"Could not scan {self._directory}: {exc}")
+        finally:
+            if batch:
+                self._batches.put(parse_names(batch))
+            # Only a full scan can tell that a known name is gone
+            if complete and len(seen) != len(known):
+                self.removed = [idx for idx, name in enumerate(self._known)
+                                if name not in seen]
+            self._batches.put(None)
@@ -0,0 +1,343 @@
+import logging
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from numpy import array, asarray, concatenate, empty, flatnonzero, frombuffer
+from numpy import int64, load, packbits, save, uint8, uint64, unique, zeros
+from os import makedirs, path, replace
+
+from jester.index import sidecar_path
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+# Hashes of plots that could not be decoded, never similar to anything
+NO_HASH = 0
+# Name of the saved hashes, changes whenever the hash itself does
+HASH_FILE = "panel_dhash"
+
+# Data panels of the FETCH plots, DM-time and frequency-time side by
+# side, and of the rendered data files, one on top of the other. Left,
+# top, width and height as fractions of the plot
+PLOT_PANELS = ((0.125, 0.12, 0.352, 0.768), (0.549, 0.12, 0.351, 0.768))
+RENDERED_PANELS = ((0.0, 0.0, 1.0, 0.49), (0.0, 0.51, 1.0, 0.49))
+# Plots are decoded at this size before the panels are cut out
+HASH_DECODE_SIZE = (500, 250)
+
+_POPCOUNT = array([bin(byte).count("1") for byte in range(256)], dtype=uint8)
+
+
+def popcount(values):
+
+    values = asarray(values, dtype=uint64)
+    return _POPCOUNT[values.view(uint8)].reshape(-1, 8).sum(axis=1,
+                                                             dtype=int64)
+
+
+def plot_hash(file_name):
+
+    """
+
+    Compute the difference hash of the data panels of a candidate plot.
+
+    Only the DM-time and frequency-time panels are hashed, the axes and
+    the text around them look the same on every plot. Each panel is
+    reduced to a 9x4 grayscale thumbnail and every bit says whether a
+    pixel is brighter than its right neighbour, giving 32 bits per
+    panel. Plots that look alike give hashes that differ in only a few
+    bits, whatever their DM or MJD.
+
+    Parameters:
+
+        file_name: str
+            Full path to the candidate plot
+
+    Returns:
+
+        plot_hash: int
+            64-bit hash, NO_HASH if the plot could not be decoded
+
+    """
+
+    from PyQt5.QtCore import QRect, QSize, Qt
+    from PyQt5.QtGui import QImage
+
+    from jester.decode import read_scaled
+    from jester.render import is_array_file
+
+    image = read_scaled(file_name, QSize(*HASH_DECODE_SIZE))
+
+    if image.isNull():
+        logger.warning(f"Could not decode {file_name}")
+        return NO_HASH
+
+    panels = RENDERED_PANELS if is_array_file(file_name) else PLOT_PANELS
+    width, height = image.width(), image.height()
+    plot_hash = 0
+
+    for left, top, panel_width, panel_height in panels:
+        panel = image.copy(QRect(int(left * width), int(top * height),
+                                 max(int(panel_width * width), 1),
+                                 max(int(panel_height * height), 1)))
+        panel = panel.scaled(9, 4, Qt.IgnoreAspectRatio,
+                             Qt.SmoothTransformation)
+        panel = panel.convertToFormat(QImage.Format_Grayscale8)
+        bits = panel.constBits()
+        bits.setsize(panel.bytesPerLine() * 4)
+        pixels = frombuffer(bits, dtype=uint8).reshape(4, -1)[:, :9]
+
+        brighter = pixels[:, 1:] < pixels[:, :-1]
+        plot_hash = (plot_hash << 32) | int.from_bytes(
+            packbits(brighter.ravel()).tobytes(), "big")
+
+    # Completely flat plots should still not look like a missing hash
+    return plot_hash if plot_hash != NO_HASH else 1
+
+
+def compute_hashes(file_names, workers=None, chunksize=64, stop=None):
+
+    """
+
+    Hash many plots in a process pool.
+
+    Worker processes are spawned rather than forked, so this can be
+    called from the GUI process once Qt is up.
+
+    Parameters:
+
+        file_names: list
+            Full paths to the candidate plots
+
+        workers: int, optional
+            Number of worker processes. Defaults to the number of CPUs
+
+        chunksize: int
+            Number of plots sent to a worker at once
+
+        stop: Event, optional
+            Stops the hashing early once set
+
+    Returns:
+
+        hashes: array
+            Hash of every plot, NO_HASH for the plots that were not
+            hashed
+
+    """
+
+    hashes = zeros(len(file_names), dtype=uint64)
+
+    if not file_names:
+        return hashes
+
+    executor = ProcessPoolExecutor(max_workers=workers,
+                                   mp_context=get_context("spawn"))
+
+    try:
+        for idx, plot_hash_value in enumerate(
+                executor.map(plot_hash, file_names, chunksize=chunksize)):
+            if stop is not None and stop.is_set():
+                break
+            hashes[idx] = plot_hash_value
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return hashes
+
+
+def save_hashes(directory, extension, hashes):
+
+    """
+
+    Save the plot hashes next to the sidecar candidate index.
+
+    Parameters:
+
+        directory: str
+            Directory with the candidate plots
+
+        extension: str
+            Plot file extension
+
+        hashes: dict
+            Candidate plot file name to its hash
+
+    """
+
+    sidecar = sidecar_path(directory, extension)
+
+    try:
+        makedirs(sidecar, exist_ok=True)
+        with open(path.join(sidecar, HASH_FILE + "_names.txt.tmp"), "w",
+                  encoding="utf-8") as nf:
+            nf.write("\n".join(hashes))
+        with open(path.join(sidecar, HASH_FILE + ".npy.tmp"), "wb") as hf:
+            save(hf, asarray(list(hashes.values()), dtype=uint64))
+        replace(path.join(sidecar, HASH_FILE + ".npy.tmp"),
+                path.join(sidecar, HASH_FILE + ".npy"))
+        replace(path.join(sidecar, HASH_FILE + "_names.txt.tmp"),
+                path.join(sidecar, HASH_FILE + "_names.txt"))
+    except OSError as exc:
+        logger.warning(f"Could not save the plot hashes in {sidecar}: {exc}")
+
+
+def load_hashes(directory, extension):
+
+    """
+
+    Load the plot hashes saved by a previous session.
+
+    Returns:
+
+        hashes: dict
+            Candidate plot file name to its hash, empty if there are
+            no usable saved hashes
+
+    """
+
+    sidecar = sidecar_path(directory, extension)
+
+    try:
+        with open(path.join(sidecar, HASH_FILE + "_names.txt"),
+                  encoding="utf-8") as nf:
+            names = nf.read()
+        names = names.split("\n") if names else []
+        values = load(path.join(sidecar, HASH_FILE + ".npy"))
+    except (OSError, ValueError) as exc:
+        logger.debug(f"No usable plot hashes in {sidecar}: {exc}")
+        return {}
+
+    if len(names) != values.shape[0]:
+        logger.warning(f"Plot hashes in {sidecar} are corrupted")
+        return {}
+
+    return dict(zip(names, values.tolist()))
+
+
+class HashIndex:
+
+    """
+
+    Multi-index hashing for Hamming radius lookups.
+
+    The 64-bit hashes are split into `radius + 1` blocks and every block
+    is indexed separately. Two hashes within the radius have to match
+    exactly on at least one block, so a lookup only compares against the
+    hashes sharing a block with the query instead of against all of them.
+
+    Parameters:
+
+        hashes: array_like
+            Hash of every candidate, in the viewing order
+
+        radius: int
+            Largest number of differing bits between near-duplicates
+
+    """
+
+    def __init__(self, hashes, radius=3):
+
+        self._hashes = asarray(hashes, dtype=uint64)
+        self._radius = radius
+
+        blocks = radius + 1
+        bounds = [HASH_BITS * block // blocks for block in range(blocks + 1)]
+        self._blocks = [(low, (1 << (high - low)) - 1) for low, high
+                        in zip(bounds[:-1], bounds[1:])]
+
+        valid = flatnonzero(self._hashes != NO_HASH)
+        self._tables = []
+        for low, mask in self._blocks:
+            keys = (self._hashes[valid] >> uint64(low)) & uint64(mask)
+            order = keys.argsort(kind="stable")
+            sorted_keys = keys[order]
+            starts = unique(sorted_keys, return_index=True)
+            self._tables.append((starts[0], starts[1], sorted_keys,
+                                 valid[order]))
+
+    @property
+    def radius(self):
+        return self._radius
+
+    def __len__(self):
+        return self._hashes.shape[0]
+
+    def query(self, plot_hash):
+
+        """
+
+        Return the positions of all the hashes within the radius.
+
+        Parameters:
+
+            plot_hash: int
+                Hash to look up
+
+        Returns:
+
+            positions: array
+                Sorted positions of the near-duplicates, the query
+                itself included if it is in the index
+
+        """
+
+        if plot_hash == NO_HASH:
+            return empty(0, dtype=int64)
+
+        plot_hash = uint64(plot_hash)
+        found = []
+
+        for (low, mask), (keys, starts, sorted_keys, positions) \
+                in zip(self._blocks, self._tables):
+            key = (plot_hash >> uint64(low)) & uint64(mask)
+            slot = keys.searchsorted(key)
+            if slot == keys.shape[0] or keys[slot] != key:
+                continue
+            start = starts[slot]
+            stop = sorted_keys.searchsorted(key, side="right")
+            found.append(positions[start:stop])
+
+        if not found:
+            return empty(0, dtype=int64)
+
+        candidates = unique(concatenate(found))
+        distances = popcount(self._hashes[candidates] ^ plot_hash)
+
+        return candidates[distances <= self._radius]
+
+    def family(self, position):
+
+        """
+
+        Return the positions of the near-duplicates of a candidate.
+
+        """
+
+        if not 0 <= position < len(self):
+            return empty(0, dtype=int64)
+
+        return self.query(int(self._hashes[position]))
+
+
+def hash_index(names, hashes, radius=3):
+
+    """
+
+    Build the lookup index for the candidates in the viewing order.
+
+    Parameters:
+
+        names: list
+            Candidate plot file names, in the viewing order
+
+        hashes: dict
+            Candidate plot file name to its hash. Candidates without a
+            hash never have any near-duplicates
+
+        radius: int
+            Largest number of differing bits between near-duplicates
+
+    """
+
+    return HashIndex(array([hashes.get(name, NO_HASH) for name in names],
+                           dtype=uint64), radius)
@@ -0,0 +1,296 @@
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from threading import Lock
+
+from PyQt5.QtGui import QImage
+
+
+def decode_image(file_name):
+
+    """
+
+    Decode a candidate plot into a QImage.
+
+    Unlike QPixmap, QImage can be safely created outside of the GUI
+    thread, which lets us do all the expensive decoding on workers.
+
+    Parameters:
+
+        file_name: str
+            Full path to the candidate plot
+
+    Returns:
+
+        image: QImage
+            Decoded plot. Null image if the file could not be read
+
+    """
+
+    return QImage(file_name)
+
+
+class ImageCache:
+
+    """
+
+    Memory-bounded LRU cache of decoded candidate plots.
+
+    Entries are keyed by the plot path and the least recently used
+    images are evicted once the total decoded size goes above the limit.
+
+    """
+
+    def __init__(self, max_bytes):
+
+        self._max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+
+    def __contains__(self, key):
+
+        with self._lock:
+            return key in self._images
+
+    def __len__(self):
+
+        with self._lock:
+            return len(self._images)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def get(self, key):
+
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+
+        size = image.sizeInBytes()
+
+        with self._lock:
+            old_image = self._images.pop(key, None)
+            if old_image is not None:
+                self._bytes -= old_image.sizeInBytes()
+
+            self._images[key] = image
+            self._bytes += size
+
+            # Always keep the newest image, even if it is over the limit
+            # on its own
+            while self._bytes > self._max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= evicted.sizeInBytes()
+
+    def clear(self):
+
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+
+
+class Prefetcher:
+
+    """
+
+    Decode candidate plots ahead of the viewer on a worker thread pool.
+
+    Follows the direction of travel through the candidate list: after
+    every move, the next `ahead` candidates in the current direction
+    and the `behind` candidates in the opposite one are queued for
+    decoding. Repeated skips (e.g. +/-5) are followed with the same
+    stride, so that holding PgUp does not miss the cache.
+
+    Parameters:
+
+        decoder: callable
+            Function taking a plot path and returning a QImage
+
+        ahead: int
+            Number of candidates to decode in the direction of travel
+
+        behind: int
+            Number of candidates to keep decoded behind the current one
+
+        max_bytes: int
+            Memory limit of the decoded image cache
+
+        workers: int
+            Number of decoding threads
+
+        max_stride: int
+            Largest jump that is still treated as a regular skip rather
+            than a random jump through the list
+
+    """
+
+    def __init__(self, decoder=decode_image, ahead=8, behind=4,
+                 max_bytes=256 * 1024 ** 2, workers=4, max_stride=5):
+
+        self._decoder = decoder
+        self._ahead = ahead
+        self._behind = behind
+        self._max_stride = max_stride
+        self._direction = 1
+
+        self._cache = ImageCache(max_bytes)
+        self._pending = {}
+        self._pending_lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="jester-decode")
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def ahead(self):
+        return self._ahead
+
+    @ahead.setter
+    def ahead(self, ahead):
+        self._ahead = ahead
+
+    def ready(self, file_name):
+        return file_name in self._cache
+
+    def stats(self):
+
+        requests = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "cached": len(self._cache),
+            "cached_bytes": self._cache.size_bytes,
+            "pending": len(self._pending),
+        }
+
+    def get(self, file_name):
+
+        """
+
+        Return the decoded plot, decoding it on the spot on a cache miss.
+
+        If the plot is already being decoded by one of the workers, we
+        wait for that instead of decoding the same file twice.
+
+        Parameters:
+
+            file_name: str
+                Full path to the candidate plot
+
+        Returns:
+
+            image: QImage
+                Decoded candidate plot
+
+        """
+
+        image = self._cache.get(file_name)
+        if image is not None:
+            self.hits += 1
+            return image
+
+        self.misses += 1
+
+        with self._pending_lock:
+            future = self._pending.get(file_name)
+
+        if future is not None:
+            try:
+                image = future.result()
+            except CancelledError:
+                image = None
+
+        if image is None:
+            image = self._decoder(file_name)
+            self._cache.put(file_name, image)
+
+        return image
+
+    def update(self, cand_plots, idx, step):
+
+        """
+
+        Queue plots around the current candidate for decoding.
+
+        Parameters:
+
+            cand_plots: sequence
+                Paths of all the candidate plots in viewing order
+
+            idx: int
+                Index of the candidate currently shown
+
+            step: int
+                How far and in which direction we have just moved
+
+        """
+
+        if step > 0:
+            self._direction = 1
+        elif step < 0:
+            self._direction = -1
+
+        direction = self._direction
+        stride = step if 1 < abs(step) <= self._max_stride else direction
+
+        wanted = []
+        for offset in range(1, self._ahead + 1):
+            wanted.append(idx + offset * stride)
+            if stride != direction:
+                wanted.append(idx + offset * direction)
+        for offset in range(1, self._behind + 1):
+            wanted.append(idx - offset * direction)
+
+        total = len(cand_plots)
+        wanted_files = [cand_plots[cand] for cand
+                        in dict.fromkeys(wanted) if 0 <= cand < total]
+
+        with self._pending_lock:
+
+            # Drop the work that is no longer needed after a jump
+            for file_name in list(self._pending):
+                if file_name not in wanted_files:
+                    if self._pending[file_name].cancel():
+                        del self._pending[file_name]
+
+            for file_name in wanted_files:
+                if file_name in self._pending or file_name in self._cache:
+                    continue
+                future = self._executor.submit(self._decode, file_name)
+                self._pending[file_name] = future
+
+    def clear(self):
+
+        with self._pending_lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+
+        self._cache.clear()
+
+    def shutdown(self):
+
+        self.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _decode(self, file_name):
+
+        try:
+            image = self._decoder(file_name)
+            self._cache.put(file_name, image)
+            return image
+        finally:
+            with self._pending_lock:
+                self._pending.pop(file_name, None)
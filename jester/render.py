@@ -0,0 +1,244 @@
+import logging
+
+from numpy import arange, asarray, clip, empty, float32, int64, interp
+from numpy import isfinite, linspace, load, memmap, nanpercentile, uint8
+from numpy import uint32, zeros
+from io import BytesIO
+from numpy.lib import format as npy_format
+from os import path
+from zipfile import ZIP_STORED, ZipFile
+
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QImage
+
+from jester.archive import read_member
+
+logger = logging.getLogger(__name__)
+
+# Candidate data files that are rendered instead of decoded
+ARRAY_EXTENSIONS = (".npz", ".h5", ".hdf5")
+
+# Size of the rendered plot if the display size is not known yet
+RENDER_SIZE = QSize(1000, 500)
+
+# Gap between the frequency-time and DM-time panels
+PANEL_GAP = 4
+
+# Anchor colours of a viridis-like colour map
+_COLOUR_ANCHORS = asarray([
+    (68, 1, 84),
+    (59, 82, 139),
+    (33, 145, 140),
+    (94, 201, 98),
+    (253, 231, 37),
+], dtype=float32)
+
+_COLOUR_MAP = zeros(256, dtype=uint32)
+for _channel in range(3):
+    _COLOUR_MAP |= interp(arange(256), linspace(0, 255, len(_COLOUR_ANCHORS)),
+                          _COLOUR_ANCHORS[:, _channel]).astype(uint32) \
+        << (8 * (2 - _channel))
+_COLOUR_MAP |= uint32(0xFF000000)
+
+
+def is_array_file(file_name):
+    return file_name.lower().endswith(ARRAY_EXTENSIONS)
+
+
+def _npz_member(npz_name, key):
+
+    """
+
+    Memory map an array stored in an uncompressed .npz file.
+
+    Compressed members cannot be mapped and are read instead.
+
+    """
+
+    member_name = key + ".npy"
+
+    with ZipFile(npz_name) as npz:
+        info = npz.getinfo(member_name)
+        compressed = info.compress_type != ZIP_STORED
+
+    if compressed:
+        with load(npz_name) as npz:
+            return npz[key]
+
+    with open(npz_name, "rb") as nf:
+        # Skip the local file header to get to the .npy data
+        nf.seek(info.header_offset + 26)
+        name_length = int.from_bytes(nf.read(2), "little")
+        extra_length = int.from_bytes(nf.read(2), "little")
+        nf.seek(info.header_offset + 30 + name_length + extra_length)
+
+        if npy_format.read_magic(nf) == (1, 0):
+            header = npy_format.read_array_header_1_0(nf)
+        else:
+            header = npy_format.read_array_header_2_0(nf)
+        shape, fortran_order, dtype = header
+        offset = nf.tell()
+
+    return memmap(npz_name, dtype=dtype, mode="r", offset=offset,
+                  shape=shape, order="F" if fortran_order else "C")
+
+
+def _h5_dataset(dataset):
+
+    """
+
+    Memory map a contiguous, uncompressed HDF5 dataset, read it if not.
+
+    """
+
+    offset = dataset.id.get_offset()
+
+    if offset is None or dataset.chunks is not None:
+        return dataset[()]
+
+    return memmap(dataset.file.filename, dtype=dataset.dtype, mode="r",
+                  offset=offset, shape=dataset.shape)
+
+
+def load_candidate(file_name):
+
+    """
+
+    Open the arrays of a candidate data file.
+
+    Supports .npz files with `data_freq_time` (frequency x time) and
+    `data_dm_time` (DM x time) arrays and the FETCH candidate HDF5 files,
+    which need the optional h5py package. Arrays are memory mapped
+    wherever the file layout allows it.
+
+    Parameters:
+
+        file_name: str
+            Full path to the candidate data file
+
+    Returns:
+
+        freq_time: array
+            Dynamic spectrum, frequency channels along the first axis
+
+        dm_time: array
+            DM-time plane, DM trials along the first axis
+
+    """
+
+    # Files inside an archive cannot be mapped and are read whole
+    data = read_member(file_name)
+
+    if file_name.lower().endswith(".npz"):
+        if data is not None:
+            with load(BytesIO(data)) as npz:
+                return npz["data_freq_time"], npz["data_dm_time"]
+        return (_npz_member(file_name, "data_freq_time"),
+                _npz_member(file_name, "data_dm_time"))
+
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("Reading HDF5 candidates requires h5py,"
+                          + " install it with pip install h5py")
+
+    if data is not None:
+        with h5py.File(BytesIO(data), "r") as hf:
+            return hf["data_freq_time"][()].T, hf["data_dm_time"][()]
+
+    with h5py.File(file_name, "r") as hf:
+        # FETCH saves the dynamic spectrum as time x frequency
+        return (_h5_dataset(hf["data_freq_time"]).T,
+                _h5_dataset(hf["data_dm_time"]))
+
+
+def _resample(data, height, width):
+
+    """
+
+    Pick the rows and columns of a panel at the display resolution.
+
+    Only the picked samples are read from a memory-mapped array.
+
+    """
+
+    rows = (arange(height) * data.shape[0] // height).astype(int64)
+    cols = (arange(width) * data.shape[1] // width).astype(int64)
+
+    return asarray(data[rows][:, cols], dtype=float32)
+
+
+def _colour(panel):
+
+    finite = isfinite(panel)
+    if not finite.any():
+        return _COLOUR_MAP[zeros(panel.shape, dtype=uint8)]
+
+    low, high = nanpercentile(panel[finite], [1.0, 99.5])
+    scale = 255.0 / (high - low) if high > low else 0.0
+    levels = clip((panel - low) * scale, 0, 255)
+    levels[~finite] = 0
+
+    return _COLOUR_MAP[levels.astype(uint8)]
+
+
+def render_candidate(freq_time, dm_time, size=None):
+
+    """
+
+    Render the frequency-time and DM-time panels into a single image.
+
+    The dynamic spectrum is shown on top of the DM-time plane, both
+    resampled to the display size and colour mapped between their 1st
+    and 99.5th percentiles.
+
+    Parameters:
+
+        freq_time: array
+            Dynamic spectrum, frequency channels along the first axis
+
+        dm_time: array
+            DM-time plane, DM trials along the first axis
+
+        size: QSize, optional
+            Size of the rendered plot, RENDER_SIZE if not given
+
+    Returns:
+
+        image: QImage
+            Rendered candidate plot
+
+    """
+
+    size = size or RENDER_SIZE
+    width = size.width()
+    panel_height = max((size.height() - PANEL_GAP) // 2, 1)
+    height = 2 * panel_height + PANEL_GAP
+
+    pixels = empty((height, width), dtype=uint32)
+    pixels[panel_height:panel_height + PANEL_GAP] = 0xFFFFFFFF
+    pixels[:panel_height] = _colour(_resample(freq_time, panel_height, width))
+    pixels[panel_height + PANEL_GAP:] = _colour(_resample(dm_time,
+                                                          panel_height,
+                                                          width))
+
+    image = QImage(pixels.data, width, height, 4 * width,
+                   QImage.Format_RGB32)
+    # Detach the image from the NumPy buffer
+    return image.copy()
+
+
+def render_file(file_name, size=None):
+
+    """
+
+    Render a candidate data file, a null image if it cannot be read.
+
+    """
+
+    try:
+        freq_time, dm_time = load_candidate(file_name)
+        return render_candidate(freq_time, dm_time, size)
+    except (OSError, KeyError, ValueError, ImportError) as exc:
+        logger.warning(f"Could not render {path.basename(file_name)}: {exc}")
+        return QImage()
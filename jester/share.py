@@ -0,0 +1,446 @@
+import json
+import logging
+
+from glob import glob
+from os import O_CREAT, O_EXCL, O_WRONLY, close, getpid, makedirs, path
+from os import open as os_open, remove, replace, stat, write
+from socket import gethostname
+from time import time
+
+from jester.index import own_change
+from jester.labels import merge_results, read_results
+
+logger = logging.getLogger(__name__)
+
+
+def claims_directory(directory):
+
+    # Archives get their claims next to them rather than inside
+    if path.isfile(directory):
+        return f"{directory}.jester_claims"
+
+    return path.join(directory, ".jester_claims")
+
+
+def labeller_output(output, labeller):
+
+    """
+
+    Return the results file of a single labeller in the shared mode.
+
+    results.csv becomes results.<labeller>.csv, so that the labellers
+    never write to the same file.
+
+    """
+
+    stem, extension = path.splitext(output)
+    return f"{stem}.{labeller}{extension}"
+
+
+def labeller_outputs(directory, output):
+
+    """
+
+    Return the results files of all the labellers of a directory.
+
+    """
+
+    stem, extension = path.splitext(output)
+    return sorted(glob(path.join(directory, f"{stem}.*{extension}")))
+
+
+def labelled_names(directory, output):
+
+    """
+
+    Return the names of all the candidates labelled by anyone so far.
+
+    """
+
+    names = set()
+
+    for file_name in labeller_outputs(directory, output) \
+            + [path.join(directory, output)]:
+        try:
+            names.update(cand_name for cand_name, _
+                         in read_results(file_name))
+        except OSError:
+            continue
+
+    return names
+
+
+def merge_outputs(directory, output):
+
+    """
+
+    Merge the results files of all the labellers into the main one.
+
+    The main results file goes first, so the labels it already has are
+    kept unless a labeller has changed them since.
+
+    Returns:
+
+        merged: int
+            Number of candidates in the merged results file
+
+    """
+
+    inputs = labeller_outputs(directory, output)
+
+    if not inputs:
+        return 0
+
+    main_output = path.join(directory, output)
+    if path.isfile(main_output):
+        inputs.insert(0, main_output)
+
+    # Written to a temporary file first, the main one is never truncated
+    merged, conflicts = merge_results(inputs, main_output)
+    if conflicts:
+        logger.warning(f"{conflicts} candidates were labelled differently"
+                       + " in different results files, the last label"
+                       + " was kept")
+
+    return merged
+
+
+class ChunkClaims:
+
+    """
+
+    Share the classification of a directory between several people.
+
+    The sorted candidate list is split into fixed-size chunks and every
+    labeller claims one chunk at a time with a lock file, created
+    atomically in a directory next to the data. Nothing but a shared
+    file system is needed. A claim is a lease: it is renewed while the
+    labeller is working and a lock that has not been renewed for longer
+    than the lease is taken over by the next labeller, so chunks of a
+    crashed session do not stay locked. Only one labeller can take over
+    a given expired lock: they first have to create a takeover marker
+    named after it, again atomically. Finished chunks get a done marker
+    and are never handed out again.
+
+    Parameters:
+
+        directory: str
+            Directory with the candidate plots
+
+        labeller: str
+            Name of this labeller, unique among the labellers
+
+        chunk_size: int
+            Number of candidates in a chunk
+
+        lease: float
+            Lease time in seconds
+
+    """
+
+    def __init__(self, directory, labeller, chunk_size=200, lease=900.0):
+
+        self._directory = claims_directory(directory)
+        self._labeller = labeller
+        self._chunk_size = chunk_size
+        self._lease = lease
+        self.chunk = None
+
+        with own_change(self._directory):
+            makedirs(self._directory, exist_ok=True)
+
+    @property
+    def labeller(self):
+        return self._labeller
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def lease(self):
+        return self._lease
+
+    def chunks(self, total):
+        return (total + self._chunk_size - 1) // self._chunk_size
+
+    def bounds(self, chunk, total):
+        return (chunk * self._chunk_size,
+                min((chunk + 1) * self._chunk_size, total))
+
+    def _lock_path(self, chunk):
+        return path.join(self._directory, f"chunk_{chunk}.lock")
+
+    def _done_path(self, chunk):
+        return path.join(self._directory, f"chunk_{chunk}.done")
+
+    def is_done(self, chunk):
+        return path.exists(self._done_path(chunk))
+
+    def _is_live(self, chunk):
+
+        try:
+            return time() - stat(self._lock_path(chunk)).st_mtime \
+                <= self._lease
+        except OSError:
+            return False
+
+    def owner(self, chunk):
+
+        try:
+            with open(self._lock_path(chunk)) as lf:
+                return json.load(lf).get("labeller")
+        except (OSError, ValueError):
+            return None
+
+    def claim(self, total, skip=()):
+
+        """
+
+        Claim the first chunk nobody is working on.
+
+        A chunk we already hold, e.g. after a restart, is claimed again
+        first.
+
+        Parameters:
+
+            total: int
+                Number of candidates in the directory
+
+            skip: iterable
+                Chunks that should not be claimed, e.g. because all
+                their candidates are labelled already
+
+        Returns:
+
+            chunk: int or None
+                Claimed chunk, None if there is nothing left to claim
+
+        """
+
+        skip = set(skip)
+        free = [chunk for chunk in range(self.chunks(total))
+                if chunk not in skip and not self.is_done(chunk)]
+
+        for chunk in free:
+            if self.owner(chunk) == self._labeller:
+                self.renew(chunk)
+                self.chunk = chunk
+                return chunk
+
+        for chunk in free:
+            if self._try_lock(chunk):
+                self.chunk = chunk
+                return chunk
+
+        self.chunk = None
+        return None
+
+    def claimed(self, total):
+
+        """
+
+        Return the chunks other labellers are still working on.
+
+        Parameters:
+
+            total: int
+                Number of candidates in the directory
+
+        """
+
+        return [chunk for chunk in range(self.chunks(total))
+                if not self.is_done(chunk) and self._is_live(chunk)
+                and self.owner(chunk) != self._labeller]
+
+    def _claim_content(self):
+
+        return json.dumps({
+            "labeller": self._labeller,
+            "host": gethostname(),
+            "pid": getpid(),
+            "claimed": time(),
+        }).encode()
+
+    def _try_lock(self, chunk):
+
+        lock_path = self._lock_path(chunk)
+
+        try:
+            lock = os_open(lock_path, O_CREAT | O_EXCL | O_WRONLY)
+        except FileExistsError:
+            return self._take_over(chunk)
+        except OSError:
+            return False
+
+        try:
+            write(lock, self._claim_content())
+        finally:
+            close(lock)
+
+        return True
+
+    def _take_over(self, chunk):
+
+        lock_path = self._lock_path(chunk)
+
+        try:
+            lock_stat = stat(lock_path)
+        except OSError:
+            # Released in the meantime, next time round
+            return False
+
+        if time() - lock_stat.st_mtime <= self._lease:
+            return False
+
+        if not self._replace_lock(chunk, lock_stat):
+            return False
+
+        logger.info(f"Took over the expired claim on chunk {chunk}")
+        return True
+
+    def _replace_lock(self, chunk, lock_stat):
+
+        """
+
+        Replace the given version of a lock with our claim.
+
+        Used both to take over and to renew a claim. Only one labeller
+        can replace any given version of a lock.
+
+        Returns:
+
+            replaced: bool
+                False if the lock has been replaced by someone else, or
+                is being replaced right now
+
+        """
+
+        lock_path = self._lock_path(chunk)
+
+        # The marker is named after this very version of the lock, so
+        # only one labeller can get past this point
+        marker = f"{lock_path}.{lock_stat.st_ino}_{lock_stat.st_mtime_ns}"
+        try:
+            close(os_open(marker, O_CREAT | O_EXCL | O_WRONLY))
+        except FileExistsError:
+            self._remove_expired(marker)
+            return False
+        except OSError:
+            return False
+
+        try:
+            # Someone who got the marker before us may have replaced the
+            # lock and removed their marker already
+            current = stat(lock_path)
+            if (current.st_ino, current.st_mtime_ns) \
+                    != (lock_stat.st_ino, lock_stat.st_mtime_ns):
+                return False
+
+            tmp_path = f"{lock_path}.{self._labeller}.tmp"
+            with open(tmp_path, "wb") as tf:
+                tf.write(self._claim_content())
+            replace(tmp_path, lock_path)
+        except OSError as exc:
+            logger.warning(f"Could not replace the lock of chunk {chunk}:"
+                           + f" {exc}")
+            return False
+        finally:
+            try:
+                remove(marker)
+            except OSError:
+                pass
+
+        return True
+
+    def _remove_expired(self, marker):
+
+        # Left behind by a labeller that crashed in the middle of a
+        # takeover, the lock would never be taken over otherwise
+        try:
+            if time() - stat(marker).st_mtime > self._lease:
+                remove(marker)
+        except OSError:
+            pass
+
+    def renew(self, chunk=None):
+
+        """
+
+        Renew the claim on a chunk, the current one by default.
+
+        The lock is replaced with a new claim the same way an expired
+        one is taken over, so a renewal and a takeover can never both
+        succeed. The chunk is dropped if somebody else has taken it over,
+        e.g. after we have not renewed it in time.
+
+        Returns:
+
+            renewed: bool
+                False if the chunk is not ours any more
+
+        """
+
+        chunk = self.chunk if chunk is None else chunk
+        if chunk is None:
+            return False
+
+        try:
+            # Before reading the owner, if the lock is replaced in between
+            # we cannot replace it below
+            lock_stat = stat(self._lock_path(chunk))
+        except OSError:
+            lock_stat = None
+
+        if lock_stat is not None and self.owner(chunk) == self._labeller \
+                and self._replace_lock(chunk, lock_stat):
+            return True
+
+        # Someone else may be taking the lock over right now, which they
+        # can only do once it has expired. Look at the lease first, a lock
+        # that is still live cannot be replaced before we read its owner
+        live = self._is_live(chunk)
+        owner = self.owner(chunk)
+        if owner == self._labeller and live:
+            logger.warning(f"Could not renew the claim on chunk {chunk}")
+            return True
+
+        if owner == self._labeller:
+            logger.warning(f"The claim on chunk {chunk} has expired")
+        else:
+            logger.warning(f"Chunk {chunk} has been claimed by {owner}")
+        if chunk == self.chunk:
+            self.chunk = None
+        return False
+
+    def mark_done(self, chunk):
+
+        with open(self._done_path(chunk), "w") as df:
+            df.write(self._labeller)
+
+    def release(self, done=False):
+
+        """
+
+        Give up the current chunk.
+
+        Parameters:
+
+            done: bool
+                All the candidates of the chunk have been labelled
+
+        """
+
+        if self.chunk is None:
+            return
+
+        if done:
+            self.mark_done(self.chunk)
+
+        if self.owner(self.chunk) == self._labeller:
+            try:
+                remove(self._lock_path(self.chunk))
+            except OSError:
+                pass
+
+        self.chunk = None
@@ -0,0 +1,448 @@
+from collections import OrderedDict
+from csv import writer
+from math import ceil, log2
+from numpy import argsort, bincount, clip, floor, histogram, int32, int64
+from numpy import isfinite, isnan, linspace, median, nanmax, nanmin, zeros
+
+from jester.labels import UNLABELLED, NUM_LABELS
+
+
+class Histogram:
+
+    """
+
+    Fixed-edge histogram that can be updated one value at a time.
+
+    Values outside of the edges are accumulated in the first and last
+    bins, so the edges never have to move and a single update is O(1).
+
+    Parameters:
+
+        lower: float
+            Lower edge of the first bin
+
+        upper: float
+            Upper edge of the last bin
+
+        bins: int
+            Number of equal-width bins
+
+    """
+
+    def __init__(self, lower, upper, bins=100):
+
+        if upper <= lower:
+            upper = lower + 1.0
+
+        self._lower = lower
+        self._bins = bins
+        self._width = (upper - lower) / bins
+        self.edges = linspace(lower, upper, bins + 1)
+        self.counts = zeros(bins, dtype=int64)
+
+    def __len__(self):
+        return self._bins
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def bin(self, value):
+        return min(max(int((value - self._lower) // self._width), 0),
+                   self._bins - 1)
+
+    def add(self, value, weight=1):
+        self.counts[self.bin(value)] += weight
+
+    def remove(self, value):
+        self.counts[self.bin(value)] -= 1
+
+    def add_many(self, values):
+
+        values = values[isfinite(values)]
+        bins = clip(floor((values - self._lower) / self._width),
+                    0, self._bins - 1).astype(int64)
+        self.counts += bincount(bins, minlength=self._bins)
+
+    def reset(self):
+        self.counts[:] = 0
+
+
+class ClassHistograms:
+
+    """
+
+    Per-class histograms of a candidate parameter, e.g. the DM.
+
+    All the classes share the same fixed edges, and labelling or
+    relabelling a candidate is a single O(1) update.
+
+    Parameters:
+
+        lower: float
+            Lower edge of the histograms
+
+        upper: float
+            Upper edge of the histograms
+
+        bins: int
+            Number of bins
+
+    """
+
+    def __init__(self, lower, upper, bins=100):
+
+        self._hists = [Histogram(lower, upper, bins)
+                       for _ in range(NUM_LABELS)]
+
+    @classmethod
+    def from_values(cls, values, bins=100):
+
+        if not isfinite(values).any():
+            return cls(0.0, 1.0, bins)
+
+        return cls(float(nanmin(values)), float(nanmax(values)), bins)
+
+    @property
+    def edges(self):
+        return self._hists[0].edges
+
+    def counts(self, label):
+        return self._hists[label].counts
+
+    def relabel(self, value, old_label, new_label):
+
+        if old_label == new_label or isnan(value):
+            return
+
+        if old_label != UNLABELLED:
+            self._hists[old_label].remove(value)
+        if new_label != UNLABELLED:
+            self._hists[new_label].add(value)
+
+    def fill(self, values, labels):
+
+        """
+
+        Rebuild all the histograms from scratch.
+
+        Parameters:
+
+            values: array_like
+                Parameter value of every candidate
+
+            labels: array_like
+                Label of every candidate, UNLABELLED included
+
+        """
+
+        for label, hist in enumerate(self._hists):
+            hist.reset()
+            hist.add_many(values[labels == label])
+
+    def add_many(self, values, labels):
+
+        """
+
+        Add more candidates to the histograms, e.g. a newly loaded batch.
+
+        Parameters:
+
+            values: array_like
+                Parameter value of every new candidate
+
+            labels: array_like
+                Label of every new candidate, UNLABELLED included
+
+        """
+
+        for label, hist in enumerate(self._hists):
+            hist.add_many(values[labels == label])
+
+
+class DensityMap:
+
+    """
+
+    DM versus MJD density of the candidates at any zoom level.
+
+    The full MJD-DM extent is split into 2^level x 2^level tiles of
+    `tile_size` x `tile_size` bins at every zoom level. A view is drawn
+    from the tiles of the level whose bins are about as fine as the
+    screen pixels, so the amount of work per redraw does not depend on
+    the number of candidates. Tiles are binned with bincount from the
+    candidates sorted by MJD, i.e. only the candidates in the MJD range
+    of the tile are ever touched, and kept in an LRU cache, so panning
+    and zooming back and forth only bins the new tiles.
+
+    Parameters:
+
+        mjd: array_like
+            Candidate MJDs
+
+        dm: array_like
+            Candidate DMs
+
+        tile_size: int
+            Number of bins along each side of a tile
+
+        max_level: int
+            Deepest zoom level
+
+        cache_tiles: int
+            Number of tiles kept in the cache
+
+    """
+
+    def __init__(self, mjd, dm, tile_size=128, max_level=12,
+                 cache_tiles=256):
+
+        finite = isfinite(mjd) & isfinite(dm)
+        mjd = mjd[finite]
+        order = argsort(mjd, kind="stable")
+        self._mjd = mjd[order]
+        self._dm = dm[finite][order]
+
+        self._tile_size = tile_size
+        self._max_level = max_level
+        self._cache_tiles = cache_tiles
+        self._tiles = OrderedDict()
+
+        if self._mjd.size:
+            self._mjd_low, self._mjd_high = (float(self._mjd[0]),
+                                             float(self._mjd[-1]))
+            self._dm_low = float(self._dm.min())
+            self._dm_high = float(self._dm.max())
+        else:
+            self._mjd_low, self._mjd_high = 0.0, 1.0
+            self._dm_low, self._dm_high = 0.0, 1.0
+
+        if self._mjd_high <= self._mjd_low:
+            self._mjd_high = self._mjd_low + 1.0
+        if self._dm_high <= self._dm_low:
+            self._dm_high = self._dm_low + 1.0
+
+    def __len__(self):
+        return self._mjd.shape[0]
+
+    @property
+    def extent(self):
+
+        """
+
+        Return the (MJD low, MJD high, DM low, DM high) extent.
+
+        """
+
+        return self._mjd_low, self._mjd_high, self._dm_low, self._dm_high
+
+    def level(self, mjd_range, dm_range, pixels=512):
+
+        """
+
+        Return the zoom level with about `pixels` bins across the view.
+
+        """
+
+        zoom = max((self._mjd_high - self._mjd_low)
+                   / max(mjd_range[1] - mjd_range[0], 1e-12),
+                   (self._dm_high - self._dm_low)
+                   / max(dm_range[1] - dm_range[0], 1e-12))
+
+        level = ceil(log2(max(zoom * pixels / self._tile_size, 1.0)))
+        return min(max(level, 0), self._max_level)
+
+    def tile(self, level, mjd_tile, dm_tile):
+
+        """
+
+        Return the counts of a single tile.
+
+        Returns:
+
+            counts: array
+                Number of candidates in every bin, MJD along the first
+                axis
+
+        """
+
+        key = (level, mjd_tile, dm_tile)
+        counts = self._tiles.get(key)
+
+        if counts is not None:
+            self._tiles.move_to_end(key)
+            return counts
+
+        tiles = 2 ** level
+        size = self._tile_size
+        mjd_width = (self._mjd_high - self._mjd_low) / tiles
+        dm_width = (self._dm_high - self._dm_low) / tiles
+        mjd_start = self._mjd_low + mjd_tile * mjd_width
+        dm_start = self._dm_low + dm_tile * dm_width
+
+        # The last tiles also take the candidates right on the upper edge
+        start = self._mjd.searchsorted(mjd_start)
+        stop = self._mjd.shape[0] if mjd_tile == tiles - 1 \
+            else self._mjd.searchsorted(mjd_start + mjd_width)
+
+        mjd_bins = clip(floor((self._mjd[start:stop] - mjd_start)
+                              / mjd_width * size), 0, size - 1)
+        dm_bins = floor((self._dm[start:stop] - dm_start) / dm_width * size)
+        if dm_tile == tiles - 1:
+            dm_bins[dm_bins == size] = size - 1
+        inside = (dm_bins >= 0) & (dm_bins < size)
+
+        counts = bincount((mjd_bins[inside] * size
+                           + dm_bins[inside]).astype(int64),
+                          minlength=size * size).astype(int32).reshape(size,
+                                                                       size)
+
+        self._tiles[key] = counts
+        if len(self._tiles) > self._cache_tiles:
+            self._tiles.popitem(last=False)
+
+        return counts
+
+    def render(self, mjd_range, dm_range, pixels=512):
+
+        """
+
+        Return the density of the candidates in the visible region.
+
+        Parameters:
+
+            mjd_range: tuple
+                Visible MJD range
+
+            dm_range: tuple
+                Visible DM range
+
+            pixels: int
+                Approximate number of screen pixels across the view
+
+        Returns:
+
+            counts: array
+                Number of candidates in every bin, MJD along the first
+                axis. Covers whole tiles, so usually a bit more than the
+                visible region
+
+            rect: tuple
+                MJD start, DM start, MJD width and DM width of the
+                region covered by the counts
+
+        """
+
+        level = self.level(mjd_range, dm_range, pixels)
+        tiles = 2 ** level
+        size = self._tile_size
+        mjd_width = (self._mjd_high - self._mjd_low) / tiles
+        dm_width = (self._dm_high - self._dm_low) / tiles
+
+        def tile_range(low, high, origin, width):
+            first = int(clip(floor((low - origin) / width), 0, tiles - 1))
+            last = int(clip(floor((high - origin) / width), 0, tiles - 1))
+            return first, last
+
+        mjd_first, mjd_last = tile_range(mjd_range[0], mjd_range[1],
+                                         self._mjd_low, mjd_width)
+        dm_first, dm_last = tile_range(dm_range[0], dm_range[1],
+                                       self._dm_low, dm_width)
+
+        counts = zeros(((mjd_last - mjd_first + 1) * size,
+                        (dm_last - dm_first + 1) * size), dtype=int32)
+
+        for mjd_tile in range(mjd_first, mjd_last + 1):
+            for dm_tile in range(dm_first, dm_last + 1):
+                x = (mjd_tile - mjd_first) * size
+                y = (dm_tile - dm_first) * size
+                counts[x:x + size, y:y + size] = self.tile(level, mjd_tile,
+                                                           dm_tile)
+
+        rect = (self._mjd_low + mjd_first * mjd_width,
+                self._dm_low + dm_first * dm_width,
+                (mjd_last - mjd_first + 1) * mjd_width,
+                (dm_last - dm_first + 1) * dm_width)
+
+        return counts, rect
+
+
+def summarise(values):
+
+    """
+
+    Return the basic statistics of a candidate parameter.
+
+    Parameters:
+
+        values: array_like
+            Parameter values, non-finite values are ignored
+
+    Returns:
+
+        summary: dict
+            Number of values, their minimum, maximum, mean, median and
+            standard deviation
+
+    """
+
+    values = values[isfinite(values)]
+
+    if values.size == 0:
+        return {"count": 0}
+
+    return {
+        "count": int(values.size),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "mean": float(values.mean()),
+        "median": float(median(values)),
+        "std": float(values.std()),
+    }
+
+
+def distribution(values, bins=100):
+
+    """
+
+    Histogram of all the candidates, as in the full distribution plot.
+
+    Returns:
+
+        counts: array
+            Number of candidates in every bin
+
+        edges: array
+            Bin edges
+
+    """
+
+    return histogram(values[isfinite(values)], bins=bins)
+
+
+def write_histogram(file_name, edges, columns):
+
+    """
+
+    Save one or more histograms sharing the same edges as a CSV file.
+
+    Parameters:
+
+        file_name: str
+            Output file
+
+        edges: array_like
+            Bin edges, one more than the number of bins
+
+        columns: dict
+            Column name to the bin counts
+
+    """
+
+    with open(file_name, "w", newline="") as hf:
+        hist_csv = writer(hf, delimiter=",")
+        hist_csv.writerow(["lower", "upper"] + list(columns))
+        for idx in range(len(edges) - 1):
+            hist_csv.writerow([edges[idx], edges[idx + 1]]
+                              + [int(counts[idx]) for counts
+                                 in columns.values()])
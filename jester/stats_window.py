@@ -0,0 +1,270 @@
+from numpy import float32, linspace, log1p
+
+from PyQt5.QtCore import QRectF, Qt, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QComboBox, QLabel, QLineEdit, QPushButton
+from PyQt5.QtWidgets import QHBoxLayout, QVBoxLayout, QWidget
+
+from pyqtgraph import colormap, ImageItem, mkPen, PlotWidget, RectROI
+
+from jester.filters import FILTER_COLUMNS
+from jester.labels import RFI, CANDIDATE, KNOWN
+from jester.stats import DensityMap
+from jester.timing import LatencyRecorder
+
+# pyqtgraph is only imported with this module, which the classifier
+# only does once the statistics are opened for the first time
+
+
+class StatsWindow(QWidget):
+
+    # MJD and DM ranges of the region brushed on the density map
+    brushed = pyqtSignal(tuple, tuple)
+
+    def __init__(self, max_fps=10, timings=None):
+        super().__init__()
+        self.setGeometry(150 + 1024, 150, 1000, 800)
+
+        # Redraw at most max_fps times per second, no matter how fast
+        # the candidates are labelled
+        self._class_hists = None
+        self._timings = timings or LatencyRecorder()
+        self._refresh_timer = QTimer()
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.setInterval(int(1000 / max_fps))
+        self._refresh_timer.timeout.connect(self._redraw)
+
+        main_box = QVBoxLayout()
+
+        self.graph_rfi = PlotWidget()
+        self.graph_rfi.setBackground("w")
+        self.graph_rfi.setTitle("RFI", color="k")
+        self.graph_rfi.plot = self.graph_rfi.plot([0,0], [0],
+                                                  pen=mkPen('k', width=1),
+                                                  stepMode=True)
+        self.graph_known = PlotWidget()
+        self.graph_known.setBackground("w")
+        self.graph_known.setTitle("Known", color="k")
+        self.graph_known.plot = self.graph_known.plot([0,0], [0],
+                                                  pen=mkPen('k', width=1),
+                                                  stepMode=True)
+        self.graph_cand = PlotWidget()
+        self.graph_cand.setBackground("w")
+        self.graph_cand.setTitle("Candidates", color="k")
+        self.graph_cand.plot = self.graph_cand.plot([0,0], [0],
+                                                  pen=mkPen('k', width=1),
+                                                  stepMode=True)
+
+        self.dist_plot = PlotWidget()
+        self.dist_plot.setMouseEnabled(y=False)
+        self.dist_plot.setBackground("w")
+        self.dist_plot.setTitle("Full distribution", color="k")
+        self.dist_plot.plot = self.dist_plot.plot([0,0], [0],
+                                                  pen=mkPen('k', width=1),
+                                                  stepMode=True)
+
+
+        # DM-MJD density, only recomputed for the tiles that come into
+        # view when panning and zooming
+        self._density = None
+        self._density_values = None
+        self._density_range_set = False
+        self.density_plot = PlotWidget()
+        self.density_plot.setBackground("w")
+        self.density_plot.setTitle("DM vs MJD density", color="k")
+        self.density_plot.setLabel("bottom", "MJD")
+        self.density_plot.setLabel("left", "DM")
+        self.density_image = ImageItem()
+        self.density_image.setLookupTable(
+            colormap.get("viridis").getLookupTable(nPts=256))
+        self.density_plot.addItem(self.density_image)
+        self.brush = RectROI([0, 0], [1, 1], pen=mkPen("r", width=2))
+        self.brush.hide()
+        self.density_plot.addItem(self.brush)
+        self._density_timer = QTimer()
+        self._density_timer.setSingleShot(True)
+        self._density_timer.setInterval(50)
+        self._density_timer.timeout.connect(self._redraw_density)
+        self.density_plot.getViewBox().sigRangeChanged.connect(
+            self._density_timer.start)
+
+        plots_box = QHBoxLayout()
+        plots_box.addWidget(self.graph_rfi)
+        plots_box.addWidget(self.graph_known)
+        plots_box.addWidget(self.graph_cand)
+        main_box.addLayout(plots_box)
+        dist_box = QHBoxLayout()
+        dist_box.addWidget(self.dist_plot)
+        dist_box.addWidget(self.density_plot)
+        main_box.addLayout(dist_box)
+
+        brush_box = QHBoxLayout()
+        brush_box.setAlignment(Qt.AlignLeft)
+        self.brush_button = QPushButton()
+        self.brush_button.setFixedWidth(150)
+        self.brush_button.setText("Select region")
+        self.brush_button.setCheckable(True)
+        self.brush_button.toggled.connect(self._toggle_brush)
+        brush_box.addWidget(self.brush_button)
+        self.keep_region_button = QPushButton()
+        self.keep_region_button.setFixedWidth(150)
+        self.keep_region_button.setText("Keep region")
+        self.keep_region_button.setEnabled(False)
+        self.keep_region_button.clicked.connect(self._keep_region)
+        brush_box.addWidget(self.keep_region_button)
+        main_box.addLayout(brush_box)
+
+        limits_box = QHBoxLayout()
+        limits_box.setAlignment(Qt.AlignLeft)
+        
+        self.filter_mode = QComboBox()
+        self.filter_mode.addItems(["Remove", "Keep only"])
+        self.filter_mode.setFixedWidth(100)
+        limits_box.addWidget(self.filter_mode)
+        self.limits_choice = QComboBox()
+        self.limits_choice.addItems(list(FILTER_COLUMNS))
+        self.limits_choice.setFixedWidth(100)
+        self.limits_choice.currentTextChanged.connect(self._choice_changed)
+        limits_box.addWidget(self.limits_choice)
+        self.start_limit = QLineEdit()
+        self.start_limit.setPlaceholderText("from")
+        self.start_limit.setFixedWidth(150)
+        limits_box.addWidget(self.start_limit)
+        self.end_limit = QLineEdit()
+        self.end_limit.setPlaceholderText("to")
+        self.end_limit.setFixedWidth(150)
+        limits_box.addWidget(self.end_limit)
+        self.apply_limits_button = QPushButton()
+        self.apply_limits_button.setFixedWidth(120)
+        self.apply_limits_button.setText("Apply filter")
+        limits_box.addWidget(self.apply_limits_button)
+        self.undo_limits_button = QPushButton()
+        self.undo_limits_button.setFixedWidth(120)
+        self.undo_limits_button.setText("Undo filter")
+        self.undo_limits_button.setEnabled(False)
+        limits_box.addWidget(self.undo_limits_button)
+        self.remove_label = QLabel()
+        limits_box.addWidget(self.remove_label)
+        main_box.addLayout(limits_box)
+        self.filters_label = QLabel("Filters: none")
+        main_box.addWidget(self.filters_label)
+        
+
+        self.setLayout(main_box)
+
+    def _choice_changed(self, choice):
+
+        # Beams are given as a list rather than a range
+        beams = FILTER_COLUMNS[choice] == "beam"
+        self.start_limit.setPlaceholderText("beams, e.g. 0,3-5" if beams
+                                            else "from")
+        self.end_limit.setEnabled(not beams)
+
+    def _update(self, class_hists):
+
+        self._class_hists = class_hists
+        if self.isVisible() and not self._refresh_timer.isActive():
+            self._refresh_timer.start()
+
+    def _redraw(self):
+
+        if self._class_hists is None:
+            return
+
+        with self._timings.stage("stats_redraw"):
+            edges = self._class_hists.edges
+            self.graph_rfi.plot.setData(edges, self._class_hists.counts(RFI))
+            self.graph_known.plot.setData(edges,
+                                          self._class_hists.counts(KNOWN))
+            self.graph_cand.plot.setData(edges,
+                                         self._class_hists.counts(CANDIDATE))
+
+    def showEvent(self, event):
+
+        self._redraw()
+        self._redraw_density()
+        super().showEvent(event)
+
+    def set_density(self, mjd, dm, density=None):
+
+        """
+
+        Show the density of a new candidate list.
+
+        The density map is only built once the window is shown, unless
+        it has been prepared already.
+
+        """
+
+        self._density_values = (mjd, dm)
+        self._density = density
+        self._density_range_set = False
+        if self.isVisible():
+            self._redraw_density()
+
+    def _redraw_density(self):
+
+        if self._density_values is None:
+            return
+
+        with self._timings.stage("density_redraw"):
+            view_box = self.density_plot.getViewBox()
+
+            if self._density is None:
+                self._density = DensityMap(*self._density_values)
+
+            if not self._density_range_set:
+                self._density_range_set = True
+                mjd_low, mjd_high, dm_low, dm_high = self._density.extent
+                view_box.setRange(xRange=(mjd_low, mjd_high),
+                                  yRange=(dm_low, dm_high), padding=0.02)
+
+            mjd_range, dm_range = view_box.viewRange()
+            pixels = max(view_box.width(), view_box.height(), 64)
+            counts, rect = self._density.render(mjd_range, dm_range,
+                                                int(pixels))
+
+            levels = log1p(counts).astype(float32)
+            self.density_image.setImage(levels, autoLevels=False,
+                                        levels=(0.0, max(levels.max(), 1.0)))
+            self.density_image.setRect(QRectF(*rect))
+
+    def _toggle_brush(self, checked):
+
+        if checked:
+            # Start from the middle half of the visible region
+            (mjd_low, mjd_high), (dm_low, dm_high) = \
+                self.density_plot.getViewBox().viewRange()
+            self.brush.setPos([mjd_low + (mjd_high - mjd_low) / 4,
+                               dm_low + (dm_high - dm_low) / 4])
+            self.brush.setSize([(mjd_high - mjd_low) / 2,
+                                (dm_high - dm_low) / 2])
+            self.brush.show()
+        else:
+            self.brush.hide()
+
+        self.keep_region_button.setEnabled(checked)
+
+    def _keep_region(self):
+
+        position = self.brush.pos()
+        size = self.brush.size()
+        self.brush_button.setChecked(False)
+        self.brushed.emit((position.x(), position.x() + size.x()),
+                          (position.y(), position.y() + size.y()))
+
+    def update_dist_plot(self, y_dist, x_dist, extra_dec=False):
+
+        if y_dist.sum() == 0:
+            return
+
+        ax = self.dist_plot.getAxis("bottom")
+
+        min_val = x_dist[0]
+        max_val = x_dist[-1]
+        tick_vals = linspace(min_val, max_val, num=6)
+        decimals = 2 + extra_dec * 4
+        ticks = [(val, "{:.{dec}f}".format(val, dec=decimals)) for val in tick_vals]
+        ax.setTicks( [ticks, []])
+        ax.setStyle(tickLength=-5)
+        self.dist_plot.plot.setData(x_dist, y_dist)
+        self.dist_plot.autoRange()
@@ -0,0 +1,134 @@
+import json
+
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from numpy import asarray, percentile
+from threading import Lock
+from time import perf_counter
+
+
+class LatencyRecorder:
+
+    """
+
+    Rolling per-stage latency histograms.
+
+    Keeps the most recent `window` timings of every stage, e.g. plot
+    decoding or label I/O, and reports their percentiles. Safe to use
+    from the decoding threads.
+
+    Parameters:
+
+        window: int
+            Number of most recent timings kept for every stage
+
+    """
+
+    def __init__(self, window=2000):
+
+        self._window = window
+        self._samples = {}
+        self._counts = {}
+        self._lock = Lock()
+
+    def record(self, stage, seconds):
+
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self._window)
+                self._counts[stage] = 0
+            samples.append(seconds)
+            self._counts[stage] += 1
+
+    @contextmanager
+    def stage(self, stage):
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, perf_counter() - start)
+
+    def wrap(self, stage, function):
+
+        """
+
+        Return the function with every call timed as the given stage.
+
+        """
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            with self.stage(stage):
+                return function(*args, **kwargs)
+
+        return timed
+
+    def summary(self):
+
+        """
+
+        Return the latency percentiles of every stage.
+
+        Returns:
+
+            summary: dict
+                Stage name to the total number of timings and the p50,
+                p95, p99 and maximum of the recent ones in milliseconds
+
+        """
+
+        with self._lock:
+            samples = {stage: asarray(values) * 1000.0
+                       for stage, values in self._samples.items()}
+            counts = dict(self._counts)
+
+        summary = {}
+        for stage, values in sorted(samples.items()):
+            p50, p95, p99 = percentile(values, [50, 95, 99])
+            summary[stage] = {
+                "count": counts[stage],
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(values.max()),
+            }
+
+        return summary
+
+    def table(self):
+
+        lines = [f"{'stage':<16}{'count':>8}{'p50':>9}{'p95':>9}"
+                 + f"{'p99':>9}{'max':>9}"]
+        for stage, stats in self.summary().items():
+            lines.append(f"{stage:<16}{stats['count']:>8}"
+                         + f"{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}"
+                         + f"{stats['p99_ms']:>9.2f}{stats['max_ms']:>9.2f}")
+
+        return "\n".join(lines)
+
+    def dump(self, file_name, extra=None):
+
+        """
+
+        Save the latency summary as JSON.
+
+        Parameters:
+
+            file_name: str
+                Output file
+
+            extra: dict, optional
+                Additional information to save with the timings, e.g.
+                the cache statistics
+
+        """
+
+        report = {"stages": self.summary()}
+        if extra:
+            report.update(extra)
+
+        with open(file_name, "w") as tf:
+            json.dump(report, tf, indent=2)
@@ -0,0 +1,507 @@
+import json
+import logging
+
+from concurrent.futures import ProcessPoolExecutor
+from csv import reader, writer
+from math import ceil
+from numpy import abs as np_abs, arange, asarray, diag, diff, empty, exp
+from numpy import float32, float64
+from numpy import frombuffer, full, hstack, isfinite, log10, median, nan
+from numpy import ones, uint8, zeros
+from numpy.linalg import solve
+from os import path, replace
+
+from jester.archive import plot_exists
+from jester.index import parse_name
+from jester.labels import RFI, UNLABELLED, read_results
+
+logger = logging.getLogger(__name__)
+
+EXAMPLES_DIR = path.join(path.dirname(path.realpath(__file__)), "..",
+                         "examples")
+
+FEATURE_NAMES = (
+    "mean",
+    "std",
+    "column_peak",
+    "row_peak",
+    "column_spread",
+    "row_spread",
+    "gradient_ratio",
+    "bright_fraction",
+    "top_left_std",
+    "top_right_std",
+    "bottom_left_std",
+    "bottom_right_std",
+    "log_dm",
+)
+
+# Plots are reduced to this size before computing the features. Large
+# enough to keep the streaks and the bow-tie, small enough to decode fast
+FEATURE_SIZE = (128, 64)
+
+
+def _profile_peak(profile):
+
+    deviation = np_abs(profile - median(profile))
+    spread = deviation.mean()
+    return deviation.max() / spread if spread > 0 else 0.0
+
+
+def image_features(pixels, dm):
+
+    """
+
+    Compute the triage features of a single plot.
+
+    All the features are cheap whole-array reductions. Broad-band 0-DM
+    RFI shows up as strong vertical streaks, i.e. peaks in the column
+    profile, and narrow-band RFI as horizontal ones in the row profile.
+
+    Parameters:
+
+        pixels: array
+            Grayscale plot, scaled to [0, 1]
+
+        dm: float
+            Candidate DM
+
+    Returns:
+
+        features: array
+            Values of all the FEATURE_NAMES features
+
+    """
+
+    std = pixels.std()
+    columns = pixels.mean(axis=0)
+    rows = pixels.mean(axis=1)
+    dx = np_abs(diff(pixels, axis=1)).mean()
+    dy = np_abs(diff(pixels, axis=0)).mean()
+
+    height, width = pixels.shape
+    half_y, half_x = height // 2, width // 2
+
+    return asarray([
+        pixels.mean(),
+        std,
+        _profile_peak(columns),
+        _profile_peak(rows),
+        columns.std() / std if std > 0 else 0.0,
+        rows.std() / std if std > 0 else 0.0,
+        dx / dy if dy > 0 else 0.0,
+        (pixels > pixels.mean() + 3 * std).mean(),
+        pixels[:half_y, :half_x].std(),
+        pixels[:half_y, half_x:].std(),
+        pixels[half_y:, :half_x].std(),
+        pixels[half_y:, half_x:].std(),
+        log10(max(dm, 0.0) + 1.0) if isfinite(dm) else 0.0,
+    ], dtype=float32)
+
+
+def plot_features(file_name):
+
+    """
+
+    Decode a plot at a small size and compute its triage features.
+
+    Runs in the worker processes. Only QtGui is imported, which decodes
+    images without a display, and only once we are in the worker.
+
+    Parameters:
+
+        file_name: str
+            Full path to the candidate plot
+
+    Returns:
+
+        features: array
+            Plot features, all NaN if the plot could not be decoded
+
+    """
+
+    from PyQt5.QtCore import QSize
+    from PyQt5.QtGui import QImage
+
+    from jester.decode import read_scaled
+
+    image = read_scaled(file_name, QSize(*FEATURE_SIZE))
+
+    if image.isNull():
+        logger.warning(f"Could not decode {file_name}")
+        return full(len(FEATURE_NAMES), nan, dtype=float32)
+
+    image = image.convertToFormat(QImage.Format_Grayscale8)
+    width, height = image.width(), image.height()
+    bits = image.constBits()
+    bits.setsize(image.bytesPerLine() * height)
+    pixels = frombuffer(bits, dtype=uint8).reshape(
+        height, image.bytesPerLine())[:, :width].astype(float32) / 255.0
+
+    return image_features(pixels, parse_name(path.basename(file_name))[1])
+
+
+def extract_features(file_names, workers=None, chunksize=64):
+
+    """
+
+    Compute the triage features of many plots in a process pool.
+
+    Parameters:
+
+        file_names: list
+            Full paths to the candidate plots
+
+        workers: int, optional
+            Number of worker processes. Defaults to the number of CPUs
+
+        chunksize: int
+            Number of plots sent to a worker at once
+
+    Returns:
+
+        features: array
+            One row of FEATURE_NAMES features per plot
+
+    """
+
+    features = zeros((len(file_names), len(FEATURE_NAMES)), dtype=float32)
+
+    if not file_names:
+        return features
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for idx, row in enumerate(executor.map(plot_features, file_names,
+                                               chunksize=chunksize)):
+            features[idx] = row
+
+    return features
+
+
+def example_labels():
+
+    """
+
+    Return the labelled example plots shipped with the classifier.
+
+    Returns:
+
+        labels: dict
+            Full example plot path to its label
+
+    """
+
+    labels = {}
+
+    with open(path.join(EXAMPLES_DIR, "notes"), newline="") as nf:
+        for row in reader(nf, delimiter=","):
+            if len(row) < 2:
+                continue
+            labels[path.join(EXAMPLES_DIR, row[0])] = int(row[1])
+
+    return labels
+
+
+def training_labels(result_files=(), directory=None, examples=True):
+
+    """
+
+    Collect the labelled plots to calibrate the triage model on.
+
+    Parameters:
+
+        result_files: list
+            Results CSV files from previous classification sessions
+
+        directory: str, optional
+            Directory with the plots the results files refer to
+
+        examples: bool
+            Include the labelled example plots
+
+    Returns:
+
+        labels: dict
+            Full plot path to its label
+
+    """
+
+    labels = example_labels() if examples else {}
+
+    for file_name in result_files:
+        base = directory or path.dirname(path.abspath(file_name))
+        for cand_name, label in read_results(file_name):
+            labels[path.join(base, cand_name)] = label
+
+    return {file_name: label for file_name, label in labels.items()
+            if plot_exists(file_name)}
+
+
+class TriageModel:
+
+    """
+
+    Logistic regression model giving the probability that a plot is RFI.
+
+    Known sources count as astrophysical. Small enough to be fitted with
+    a few Newton iterations on the labelled examples and saved as JSON.
+
+    Parameters:
+
+        weights: array_like
+            Bias followed by one weight per standardised feature
+
+        mean: array_like
+            Feature means used for the standardisation
+
+        scale: array_like
+            Feature standard deviations used for the standardisation
+
+        auto_threshold: float or None
+            RFI probability above which candidates can be labelled
+            without a human looking at them, None if they never can
+
+    """
+
+    def __init__(self, weights, mean, scale, auto_threshold=None):
+
+        self.weights = asarray(weights, dtype=float64)
+        self.mean = asarray(mean, dtype=float64)
+        self.scale = asarray(scale, dtype=float64)
+        self.auto_threshold = auto_threshold
+
+    @classmethod
+    def fit(cls, features, labels, l2=1.0, iterations=50, precision=0.99,
+            folds=10):
+
+        """
+
+        Fit the model and calibrate the automatic labelling threshold.
+
+        The threshold is calibrated on cross-validated scores, i.e. every
+        plot is scored by a model fitted without it, as the scores of the
+        plots the model was fitted on are optimistic.
+
+        Parameters:
+
+            features: array
+                One row of features per plot
+
+            labels: array_like
+                Plot labels, RFI or any other class
+
+            l2: float
+                Strength of the L2 regularisation, keeps the fit sane
+                on a handful of examples
+
+            iterations: int
+                Maximum number of Newton iterations
+
+            precision: float
+                Required fraction of RFI among the candidates above the
+                automatic labelling threshold
+
+            folds: int
+                Number of cross-validation folds, at most one per plot
+
+        Returns:
+
+            model: TriageModel
+                Fitted model
+
+        """
+
+        features = asarray(features, dtype=float64)
+        labels = asarray(labels)
+        usable = isfinite(features).all(axis=1) & (labels != UNLABELLED)
+        features = features[usable]
+        target = (labels[usable] == RFI).astype(float64)
+
+        if target.size == 0:
+            raise ValueError("No labelled plots to fit the triage model on")
+
+        model = cls(*cls._fit_weights(features, target, l2, iterations))
+        model.auto_threshold = calibrate_threshold(
+            cls._held_out_scores(features, target, l2, iterations, folds),
+            target, precision)
+        return model
+
+    @classmethod
+    def _held_out_scores(cls, features, target, l2, iterations, folds):
+
+        folds = min(folds, target.size)
+        scores = full(target.size, nan)
+
+        if folds < 2:
+            return scores
+
+        # Deal the plots of each class out to the folds in turn, so that
+        # every fold gets both classes whenever possible
+        fold = empty(target.size, dtype=int)
+        fold[target.argsort(kind="stable")] = arange(target.size) % folds
+
+        for held_out in range(folds):
+            test = fold == held_out
+            train = ~test
+            # Nothing to tell apart without both classes
+            if target[train].min() == target[train].max():
+                continue
+            model = cls(*cls._fit_weights(features[train], target[train],
+                                          l2, iterations))
+            scores[test] = model.score(features[test])
+
+        return scores
+
+    @staticmethod
+    def _fit_weights(features, target, l2, iterations):
+
+        mean = features.mean(axis=0)
+        scale = features.std(axis=0)
+        scale[scale == 0] = 1.0
+
+        design = hstack([ones((features.shape[0], 1)),
+                         (features - mean) / scale])
+        weights = zeros(design.shape[1])
+        penalty = diag(full(design.shape[1], l2))
+        penalty[0, 0] = 0.0
+
+        for _ in range(iterations):
+            prob = 1.0 / (1.0 + exp(-design @ weights))
+            gradient = design.T @ (prob - target) + penalty @ weights
+            hessian = (design.T * (prob * (1 - prob))) @ design + penalty
+            step = solve(hessian + 1e-9 * diag(ones(design.shape[1])),
+                         gradient)
+            weights -= step
+            if np_abs(step).max() < 1e-6:
+                break
+
+        return weights, mean, scale
+
+    def score(self, features):
+
+        """
+
+        Return the probability that every plot is RFI.
+
+        Plots without usable features get a score of 0.5.
+
+        """
+
+        features = asarray(features, dtype=float64)
+        scores = full(features.shape[0], 0.5)
+        usable = isfinite(features).all(axis=1)
+        logits = (self.weights[0] + ((features[usable] - self.mean)
+                                     / self.scale) @ self.weights[1:])
+        scores[usable] = 1.0 / (1.0 + exp(-logits))
+        return scores
+
+    def save(self, file_name):
+
+        model = {
+            "features": list(FEATURE_NAMES),
+            "weights": self.weights.tolist(),
+            "mean": self.mean.tolist(),
+            "scale": self.scale.tolist(),
+            "auto_threshold": self.auto_threshold,
+        }
+
+        with open(file_name + ".tmp", "w") as mf:
+            json.dump(model, mf, indent=2)
+        replace(file_name + ".tmp", file_name)
+
+    @classmethod
+    def load(cls, file_name):
+
+        with open(file_name) as mf:
+            model = json.load(mf)
+
+        if tuple(model["features"]) != FEATURE_NAMES:
+            raise ValueError(f"Triage model {file_name} was trained on"
+                             + " different features")
+
+        return cls(model["weights"], model["mean"], model["scale"],
+                   model["auto_threshold"])
+
+
+def calibrate_threshold(scores, is_rfi, precision):
+
+    """
+
+    Find the lowest score above which the labelled plots are RFI with
+    at least the required precision.
+
+    A threshold also needs enough plots above it for the precision to
+    mean anything: at least 1 / (1 - precision) of them, so that a single
+    mistake among them would already break it. Plots without a score,
+    e.g. not held out in any fold, are left out.
+
+    Returns:
+
+        threshold: float or None
+            Calibrated threshold, None if no threshold is good enough or
+            there are too few labelled plots to tell, which disables
+            automatic labelling. Not 1.0, a saturated score can reach it
+
+    """
+
+    if precision >= 1.0:
+        return None
+
+    scored = isfinite(scores)
+    scores = scores[scored]
+    order = scores.argsort()[::-1]
+    sorted_scores = scores[order]
+    hits = asarray(is_rfi)[scored][order].cumsum()
+    support = ceil(1.0 / (1.0 - precision) - 1e-9)
+    threshold = None
+
+    for idx in range(len(sorted_scores)):
+        if hits[idx] / (idx + 1) < precision:
+            break
+        if idx + 1 < support:
+            continue
+        # Only cut between different scores
+        if idx + 1 == len(sorted_scores) \
+                or sorted_scores[idx + 1] < sorted_scores[idx]:
+            threshold = float(sorted_scores[idx])
+
+    return threshold
+
+
+def write_scores(file_name, names, scores):
+
+    """
+
+    Save the RFI probability of every candidate as name, score rows.
+
+    """
+
+    with open(file_name + ".tmp", "w", newline="") as sf:
+        scores_csv = writer(sf, delimiter=",")
+        scores_csv.writerows((name, f"{score:.6f}") for name, score
+                             in zip(names, scores))
+    replace(file_name + ".tmp", file_name)
+
+
+def read_scores(file_name):
+
+    """
+
+    Load the candidate scores saved by write_scores.
+
+    Returns:
+
+        scores: dict
+            Candidate plot file name to its RFI probability
+
+    """
+
+    scores = {}
+
+    with open(file_name, newline="") as sf:
+        for row in reader(sf, delimiter=","):
+            if len(row) < 2:
+                continue
+            scores[row[0]] = float(row[1])
+
+    return scores
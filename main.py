@@ -2,23 +2,34 @@ import argparse as ap
 import logging
 
 from os.path import isdir
-from sys import exit
+from sys import argv, exit
 
-from PyQt5.QtWidgets import QApplication
-
-from jester.classifier import CandClassifier as CandClass
+from jester.archive import is_archive
+from jester.cli import COMMANDS, main as cli_main
+from jester.labels import LABEL_STORES
 
 logger = logging.getLogger()
 
 def main():
 
+    # Headless commands, e.g. main.py merge ..., never touch Qt
+    if len(argv) > 1 and argv[1] in COMMANDS:
+        cli_main(argv[1:])
+        return
+
     parser = ap.ArgumentParser(description="Classifier for MeerTRAP",
-                               usage="%(prog)s <options>")
+                               usage="%(prog)s <options>",
+                               epilog="Headless commands: "
+                               + ", ".join(COMMANDS)
+                               + ". Run %(prog)s <command> -h for details")
 
-    parser.add_argument("-d", "--directory", help="Input data directory", 
+    parser.add_argument("-d", "--directory", help="Input data directory,"
+                        + " or an uncompressed tar or zip archive",
                         required=True,
                         type=str)
-    parser.add_argument("-e", "--extension", help="Plot extension",
+    parser.add_argument("-e", "--extension", help="Plot extension. npz, h5"
+                        + " and hdf5 candidate data files are rendered"
+                        + " directly",
                         required=False,
                         type=str,
                         default="png")
@@ -26,21 +37,192 @@ def main():
                         required=False,
                         type=str,
                         default="results.csv")
+    parser.add_argument("-s", "--label-store", help="Label store backend",
+                        required=False,
+                        type=str,
+                        choices=list(LABEL_STORES),
+                        default="csv")
+    parser.add_argument("-r", "--resume", help="Restore the labels from"
+                        + " an existing output file. Asks by default",
+                        required=False,
+                        type=str,
+                        choices=["ask", "yes", "no"],
+                        default="ask")
+    parser.add_argument("--sync-interval", help="Longest time in seconds"
+                        + " a label can go without being synced to the"
+                        + " disk. Bounds what a crash can lose",
+                        required=False,
+                        type=float,
+                        default=2.0)
+    parser.add_argument("-g", "--grid", help="Grid view size as ROWSxCOLS",
+                        required=False,
+                        type=str,
+                        default="4x4")
+    parser.add_argument("--prefetch-ahead", help="Number of plots to decode"
+                        + " ahead in the direction of travel",
+                        required=False,
+                        type=int,
+                        default=8)
+    parser.add_argument("--prefetch-behind", help="Number of decoded plots"
+                        + " to keep behind the current one",
+                        required=False,
+                        type=int,
+                        default=4)
+    parser.add_argument("--cache-size", help="Decoded plot cache size in MB",
+                        required=False,
+                        type=int,
+                        default=256)
+    parser.add_argument("--disk-cache-size", help="On-disk cache size of the"
+                        + " plots scaled down to the screen in MB."
+                        + " 0 disables the cache",
+                        required=False,
+                        type=int,
+                        default=1024)
+    parser.add_argument("--disk-cache-dir", help="Directory of the scaled"
+                        + " plot cache",
+                        required=False,
+                        type=str,
+                        default=None)
+    parser.add_argument("--scores", help="Pre-triage scores file. Shows"
+                        + " the likely astrophysical candidates first",
+                        required=False,
+                        type=str,
+                        default=None)
+    parser.add_argument("--cluster", help="Only show one candidate of"
+                        + " every group of near-coincident candidates and"
+                        + " save its label for the whole group",
+                        action="store_true")
+    parser.add_argument("--cluster-time", help="Largest time gap in"
+                        + " seconds within a cluster",
+                        required=False,
+                        type=float,
+                        default=30.0)
+    parser.add_argument("--cluster-dm", help="Largest fractional DM"
+                        + " difference within a cluster",
+                        required=False,
+                        type=float,
+                        default=0.02)
+    parser.add_argument("--cluster-beams", help="Largest beam number"
+                        + " difference within a cluster. Any beam if not set",
+                        required=False,
+                        type=int,
+                        default=None)
+    parser.add_argument("--families", help="Hash the plots to find"
+                        + " look-alikes that can be labelled together",
+                        action="store_true")
+    parser.add_argument("--family-radius", help="Largest number of"
+                        + " differing hash bits between look-alikes",
+                        required=False,
+                        type=int,
+                        default=3)
+    parser.add_argument("--share", help="Share the directory with other"
+                        + " labellers under this name, working on one"
+                        + " claimed chunk of candidates at a time",
+                        required=False,
+                        type=str,
+                        default=None)
+    parser.add_argument("--chunk-size", help="Number of candidates in a"
+                        + " shared chunk",
+                        required=False,
+                        type=int,
+                        default=200)
+    parser.add_argument("--lease", help="Seconds after which the chunk of"
+                        + " an unresponsive labeller can be taken over",
+                        required=False,
+                        type=float,
+                        default=900.0)
+    parser.add_argument("--timings", help="Save the hot-path latency"
+                        + " percentiles to this JSON file on exit",
+                        required=False,
+                        type=str,
+                        default=None)
+    parser.add_argument("--profile", help="Run under cProfile and save"
+                        + " the statistics to this file",
+                        required=False,
+                        type=str,
+                        default=None)
 
     arguments = parser.parse_args()
 
-    if not isdir(arguments.directory):
+    if not (isdir(arguments.directory) or is_archive(arguments.directory)):
         logger.error(f"Directory {arguments.directory} does not exist!")
         exit()
 
+    try:
+        grid_size = tuple(int(size) for size in arguments.grid.split("x"))
+        if len(grid_size) != 2 or min(grid_size) < 1:
+            raise ValueError
+    except ValueError:
+        logger.error(f"Invalid grid size {arguments.grid}, use ROWSxCOLS")
+        exit()
+
+    scores = None
+    if arguments.scores:
+        from jester.triage import read_scores
+        scores = read_scores(arguments.scores)
+
+    clustering = None
+    if arguments.cluster:
+        clustering = {
+            "time_tolerance": arguments.cluster_time,
+            "dm_tolerance": arguments.cluster_dm,
+            "beam_tolerance": arguments.cluster_beams,
+        }
+
+    share = None
+    if arguments.share:
+        share = {
+            "labeller": arguments.share,
+            "chunk_size": arguments.chunk_size,
+            "lease": arguments.lease,
+        }
+
+    # Started before the classifier, so that the directory scan and the
+    # initial load are profiled as well
+    profiler = None
+    if arguments.profile:
+        from cProfile import Profile
+        profiler = Profile()
+        profiler.enable()
+
+    # Only pull Qt and pyqtgraph in when we actually need the GUI
+    from PyQt5.QtWidgets import QApplication
+    from jester.classifier import CandClassifier as CandClass
+
     app = QApplication([])
-    cc = CandClass(arguments.directory, arguments.output, arguments.extension)
+    try:
+        cc = CandClass(arguments.directory, arguments.output,
+                       arguments.extension,
+                       prefetch_ahead=arguments.prefetch_ahead,
+                       prefetch_behind=arguments.prefetch_behind,
+                       cache_size=arguments.cache_size,
+                       label_store=arguments.label_store,
+                       resume={"ask": None, "yes": True,
+                               "no": False}[arguments.resume],
+                       disk_cache_size=arguments.disk_cache_size,
+                       disk_cache_dir=arguments.disk_cache_dir,
+                       grid_size=grid_size,
+                       timings_file=arguments.timings,
+                       scores=scores,
+                       clustering=clustering,
+                       family_radius=(arguments.family_radius
+                                      if arguments.families else None),
+                       share=share,
+                       sync_interval=arguments.sync_interval)
+    except ValueError as exc:
+        # e.g. the label stores of the results file disagree
+        logger.error(exc)
+        exit()
 
     try:
         # Just don't run with Python 2.x
         app.exec()
     except Exception as exc:
         logger.error(exc)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(arguments.profile)
 
 if __name__ == "__main__":
     main()